@@ -0,0 +1,5 @@
+"""End-to-end benchmarks of despot against a local stand-in for the streaming service.
+
+Run `python -m benchmarks --help` from the repository root for the available
+scenarios and options.
+"""
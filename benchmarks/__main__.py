@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import json
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any
+
+import rich_click as click
+from rich import get_console
+from rich.table import Table
+
+from despot.enums import Engine
+
+from .report import change, environment
+from .runner import BenchmarkParams, run_isolated
+from .scenarios import SCENARIOS, MiB
+
+# Metrics compared by --compare, and whether higher values are better
+_COMPARED = {"tracks_per_s": True, "bytes_per_s": True, "latency_p95": False, "peak_rss": False}
+
+
+def _table(results: dict[str, dict[str, Any]], baseline: dict[str, dict[str, Any]]) -> Table:
+    table = Table("Scenario", "Tracks", "Failures", "Time", "Tracks/s", "MiB/s", "p50", "p95", "p99", "Peak RSS")
+    for name, result in results.items():
+        base = baseline.get(name, {})
+
+        def _cell(metric: str, text: str, result: dict[str, Any] = result, base: dict[str, Any] = base) -> str:
+            if metric not in _COMPARED or metric not in base:
+                return text
+            return text + change(result[metric], base[metric], higher_is_better=_COMPARED[metric])
+
+        table.add_row(
+            name,
+            str(result["tracks"]),
+            str(result["failures"]),
+            f"{result['seconds']:.2f}s",
+            _cell("tracks_per_s", f"{result['tracks_per_s']:.1f}"),
+            _cell("bytes_per_s", f"{result['bytes_per_s'] / MiB:.1f}"),
+            f"{result['latency_p50']:.2f}s",
+            _cell("latency_p95", f"{result['latency_p95']:.2f}s"),
+            f"{result['latency_p99']:.2f}s",
+            _cell("peak_rss", f"{result['peak_rss'] / MiB:.0f} MiB"),
+        )
+    return table
+
+
+@click.command(
+    context_settings={"help_option_names": ["-h", "--help"], "show_default": True},
+    help="Benchmark despot end to end against a local stand-in for the streaming service.",
+)
+@click.argument("scenarios", nargs=-1, type=click.Choice(list(SCENARIOS)))
+@click.option(
+    "--engine",
+    type=click.Choice([str(engine) for engine in Engine]),
+    default=str(Engine.THREADS),
+    callback=lambda ctx, param, value: Engine(value),
+)
+@click.option(
+    "--concurrency",
+    default="4",
+    callback=lambda ctx, param, value: None if value == "auto" else int(value),
+    help="Simultaneous downloads, or 'auto'.",
+)
+@click.option("--lookahead", type=int, default=4)
+@click.option("--latency", type=float, default=0.02, help="Seconds added to each metadata request and stream load.")
+@click.option("--bandwidth", type=float, default=50.0, help="MiB/s of each chunk transfer, 0 for unlimited.")
+@click.option("--failure-rate", type=float, default=0.0, help="Share of stream loads that fail.")
+@click.option("--chunk-failure-rate", type=float, default=0.0, help="Share of chunk transfers that fail.")
+@click.option("--scale", type=float, default=1.0, help="Multiplies the number of items in each scenario.")
+@click.option("--seed", type=int, default=0)
+@click.option("--output", "-o", type=click.Path(dir_okay=False, path_type=Path), help="Write the results as JSON.")
+@click.option(
+    "--compare",
+    "-c",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="Show the changes relative to the JSON results of an earlier run.",
+)
+def main(
+    scenarios: tuple[str, ...], output: Path | None, compare: Path | None, bandwidth: float, **kwargs: Any
+) -> None:
+    params = BenchmarkParams(bandwidth=bandwidth * MiB or None, **kwargs)
+    console = get_console()
+    baseline: dict[str, Any] = {}
+    if compare:
+        report = json.loads(compare.read_text())
+        if report["params"] != json.loads(json.dumps(asdict(params), default=str)):
+            console.print(f"[yellow]{compare} was run with different parameters: {report['params']}")
+        baseline = report["results"]
+    results = {}
+    for name in scenarios or SCENARIOS:
+        with console.status(f"Running {name}: {SCENARIOS[name].description}"):
+            results[name] = run_isolated(name, params)
+    console.print(_table(results, baseline))
+
+    if output:
+        report = {
+            **environment(),
+            "params": asdict(params),
+            "results": results,
+        }
+        output.write_text(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,467 @@
+"""Stand-ins for the parts of librespot's `Session` that despot talks to.
+
+Metadata is served as real protobuf messages and audio as synthetic Ogg
+Vorbis streams, split into chunks the same way librespot's CDN streams are,
+so the whole download path runs unchanged without an account.
+"""
+
+from __future__ import annotations
+
+import random
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from http import HTTPStatus
+from threading import Condition, Lock
+from types import SimpleNamespace
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
+
+from librespot.audio import ChannelManager, SuperAudioFormat
+from librespot.metadata import EpisodeId, PlayableId, TrackId
+from librespot.proto import Metadata_pb2 as Metadata
+from librespot.proto import Playlist4External_pb2 as Playlist4External
+from librespot.util import Base62
+from mutagen.ogg import OggPage
+
+from despot.constants import OGG_HEADER_SIZE, _fcbgvsl
+
+CHUNK_SIZE = ChannelManager.chunk_size
+
+# Items per response, longer playlists are listed in windows like by the service's servers
+PLAYLIST_WINDOW = 100
+# Payload of one synthetic audio page, small enough to keep pages realistic
+_PAGE_PAYLOAD = 4000
+
+_base62 = Base62.create_instance_with_inverted_character_set()
+
+
+def item_uri(item_type: str, gid: bytes) -> str:
+    """Return the URI of the item of `item_type` (album, show, ...) with `gid`."""
+    return f"{_fcbgvsl}:{item_type}:{_base62.encode(gid, 22).decode()}"
+
+
+def _page(packets: list[bytes], sequence: int, position: int = 0, first: bool = False, last: bool = False) -> bytes:
+    page = OggPage()
+    page.packets = packets
+    page.sequence = sequence
+    page.serial = 1
+    page.position = position
+    page.first = first
+    page.last = last
+    return page.write()
+
+
+def make_ogg(size: int, seed: int = 0) -> bytes:
+    """Return a valid Ogg Vorbis stream of about `size` bytes, prefixed like the files of that green streaming service."""
+    ident = b"\x01vorbis" + struct.pack("<IBIiiiBB", 0, 2, 44100, 0, 320_000, 0, 0xB8, 1)
+    comment = b"\x03vorbis" + struct.pack("<I", 7) + b"despot!" + struct.pack("<I", 0) + b"\x01"
+    setup = b"\x05vorbis" + bytes(64)
+    pages = [_page([ident], 0, first=True), _page([comment, setup], 1)]
+    rnd = random.Random(seed)
+    total = sum(map(len, pages))
+    sequence = position = 0
+    while total < size:
+        payload = rnd.randbytes(min(_PAGE_PAYLOAD, max(size - total, 100)))
+        sequence += 1
+        position += 1024
+        pages.append(_page([payload], sequence + 1, position=position, last=total + len(payload) + 60 >= size))
+        total += len(pages[-1])
+    return bytes(OGG_HEADER_SIZE) + b"".join(pages)
+
+
+class FakeChunkedStream:
+    """Mimics librespot's `AbsChunkedInputStream` of a CDN stream.
+
+    Chunks are fetched by the `streamer` on a shared executor when requested
+    and reported through `notify_chunk_available()`, which wakes readers
+    waiting on a shared condition. Like in librespot, nothing reports a
+    failed fetch: its exception ends up in the executor, the chunk stays
+    requested, and `check_availability()` waits for it forever.
+    """
+
+    executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="fake-cdn")
+    wait_lock = Condition()
+
+    streamer: FakeStreamer
+
+    _pos: int = 0
+    _buffer: list[bytes]
+    _requested: list[bool]
+    _available: list[bool]
+
+    def __init__(self, streamer: FakeStreamer, chunks: int) -> None:
+        self.streamer = streamer
+        self._buffer = [b""] * chunks
+        self._requested = [False] * chunks
+        self._available = [False] * chunks
+
+    def notify_chunk_available(self, index: int) -> None:
+        self._available[index] = True
+        with self.wait_lock:
+            self.wait_lock.notify_all()
+
+    def size(self) -> int:
+        return self.streamer.size
+
+    def chunks(self) -> int:
+        return len(self._buffer)
+
+    def buffer(self) -> list[bytes]:
+        return self._buffer
+
+    def requested_chunks(self) -> list[bool]:
+        return self._requested
+
+    def available_chunks(self) -> list[bool]:
+        return self._available
+
+    def pos(self) -> int:
+        return self._pos
+
+    def seek(self, where: int) -> None:
+        self._pos = where
+        self.check_availability(where // CHUNK_SIZE, False, False)
+
+    def skip(self, n: int) -> int:
+        skipped = min(n, self.size() - self._pos)
+        self._pos += skipped
+        self.check_availability(self._pos // CHUNK_SIZE, False, False)
+        return skipped
+
+    def request_chunk_from_stream(self, index: int) -> None:
+        self.executor.submit(lambda: self.streamer.request_chunk(index))
+
+    def check_availability(self, index: int, wait: bool, halted: bool) -> None:
+        if not self._requested[index]:
+            self.request_chunk_from_stream(index)
+            self._requested[index] = True
+        if wait:
+            with self.wait_lock:
+                self.wait_lock.wait_for(lambda: self._available[index])
+
+    def read(self, size: int = 0) -> bytes:
+        if self._pos >= self.size():
+            return b""
+        index = self._pos // CHUNK_SIZE
+        self.check_availability(index, True, False)
+        end = min((index + 1) * CHUNK_SIZE, self._pos + size if size > 0 else self.size())
+        data = self._buffer[index][self._pos - index * CHUNK_SIZE : end - index * CHUNK_SIZE]
+        self._pos = end
+        return data
+
+
+class FakeStreamer:
+    """Mimics librespot's `CdnManager.Streamer`, which fetches the chunks of its stream.
+
+    Chunk 0 is fetched right away, like librespot preloads it. The others take
+    as long as `bandwidth` allows, and a failed one raises like a CDN request
+    with an error status.
+    """
+
+    size: int
+
+    _catalog: FakeCatalog
+    _data: bytes
+    _stream: FakeChunkedStream
+
+    def __init__(self, catalog: FakeCatalog, data: bytes) -> None:
+        self.size = len(data)
+        self._catalog = catalog
+        self._data = data
+        self._stream = FakeChunkedStream(self, (len(data) + CHUNK_SIZE - 1) // CHUNK_SIZE)
+        self._stream.requested_chunks()[0] = True
+        self._write_chunk(0)
+
+    def request_chunk(self, index: int) -> None:
+        chunk = self._data[index * CHUNK_SIZE : (index + 1) * CHUNK_SIZE]
+        if self._catalog.bandwidth:
+            time.sleep(len(chunk) / self._catalog.bandwidth)
+        if self._catalog.chunk_fails():
+            raise OSError(HTTPStatus.SERVICE_UNAVAILABLE.value)
+        self._write_chunk(index)
+
+    def _write_chunk(self, index: int) -> None:
+        chunk = self._data[index * CHUNK_SIZE : (index + 1) * CHUNK_SIZE]
+        self._catalog.served(len(chunk))
+        self._stream.buffer()[index] = chunk
+        self._stream.notify_chunk_available(index)
+
+    def stream(self) -> FakeChunkedStream:
+        return self._stream
+
+    def codec(self) -> SuperAudioFormat:
+        return SuperAudioFormat.VORBIS
+
+
+@dataclass
+class FakeMetrics:
+    file_id: str | None
+
+
+@dataclass
+class FakeLoadedStream:
+    track: Metadata.Track | None
+    episode: Metadata.Episode | None
+    input_stream: FakeStreamer
+    metrics: FakeMetrics
+
+
+class FakeAudioKeyManager:
+    _catalog: FakeCatalog
+
+    def __init__(self, catalog: FakeCatalog) -> None:
+        self._catalog = catalog
+
+    def get_audio_key(self, gid: bytes, file_id: bytes, retry: bool = True) -> bytes:
+        self._catalog.wait()
+        return bytes(16)
+
+
+class FakeApiClient:
+    _catalog: FakeCatalog
+
+    def __init__(self, catalog: FakeCatalog) -> None:
+        self._catalog = catalog
+
+    def _lookup(self, kind: str, key: str) -> Any:
+        self._catalog.wait()
+        return self._catalog.items[kind][key]
+
+    def get_metadata_4_track(self, track_id: Any) -> Metadata.Track:
+        return self._lookup("track", track_id.hex_id())
+
+    def get_metadata_4_episode(self, episode_id: Any) -> Metadata.Episode:
+        return self._lookup("episode", episode_id.hex_id())
+
+    def get_metadata_4_album(self, album_id: Any) -> Metadata.Album:
+        return self._lookup("album", album_id.hex_id())
+
+    def get_metadata_4_artist(self, artist_id: Any) -> Metadata.Artist:
+        return self._lookup("artist", artist_id.hex_id())
+
+    def get_metadata_4_show(self, show_id: Any) -> Metadata.Show:
+        return self._lookup("show", show_id.hex_id())
+
+    def get_playlist(self, playlist_id: Any) -> Playlist4External.SelectedListContent:
+        return self._playlist_window(playlist_id.id(), 0, PLAYLIST_WINDOW)
+
+    def send(self, method: str, suffix: str, headers: Any, body: bytes | None) -> Any:
+        # Only the windows of playlists are requested directly
+        url = urlsplit(suffix)
+        query = parse_qs(url.query)
+        playlist = self._playlist_window(
+            url.path.rsplit("/", 1)[-1], int(query["from"][0]), int(query.get("length", [PLAYLIST_WINDOW])[0])
+        )
+        return SimpleNamespace(status_code=200, content=playlist.SerializeToString())
+
+    def _playlist_window(self, playlist_id: str, start: int, length: int) -> Playlist4External.SelectedListContent:
+        playlist = self._lookup("playlist", playlist_id)
+        window = Playlist4External.SelectedListContent(revision=playlist.revision, length=playlist.length)
+        window.attributes.CopyFrom(playlist.attributes)
+        window.contents.items.extend(playlist.contents.items[start : start + length])
+        window.contents.pos = start
+        window.contents.truncated = start + length < len(playlist.contents.items)
+        return window
+
+
+class FakeContentFeeder:
+    _catalog: FakeCatalog
+    _audio_key: FakeAudioKeyManager
+
+    def __init__(self, catalog: FakeCatalog, audio_key: FakeAudioKeyManager) -> None:
+        self._catalog = catalog
+        self._audio_key = audio_key
+
+    def pick_alternative_if_necessary(self, track: Metadata.Track) -> Metadata.Track:
+        return track
+
+    def load(self, playable_id: PlayableId, audio_quality_picker: Any, preload: bool, halt_listener: Any) -> Any:
+        if isinstance(playable_id, TrackId):
+            track = self._catalog.items["track"][playable_id.hex_id()]
+            return self.load_track(track, audio_quality_picker, preload, halt_listener)
+        if isinstance(playable_id, EpisodeId):
+            episode = self._catalog.items["episode"][playable_id.hex_id()]
+            return self.load_stream(episode.audio[0], None, episode, preload, halt_listener)
+        raise TypeError(f"Unsupported playable {playable_id}")
+
+    def load_track(
+        self, track: Metadata.Track, audio_quality_picker: Any, preload: bool, halt_listener: Any
+    ) -> FakeLoadedStream:
+        return self.load_stream(track.file[0], track, None, preload, halt_listener)
+
+    def load_stream(
+        self,
+        file: Metadata.AudioFile,
+        track: Metadata.Track | None,
+        episode: Metadata.Episode | None,
+        preload: bool,
+        halt_listener: Any,
+    ) -> FakeLoadedStream:
+        catalog = self._catalog
+        catalog.wait()
+        catalog.maybe_fail()
+        self._audio_key.get_audio_key(file.file_id, file.file_id)
+        streamer = FakeStreamer(catalog, catalog.audio[file.file_id.hex()])
+        streamer.stream().skip(OGG_HEADER_SIZE)
+        return FakeLoadedStream(
+            track=track,
+            episode=episode,
+            input_stream=streamer,
+            metrics=FakeMetrics(file.file_id.hex()),
+        )
+
+
+class FakeCatalog:
+    """Metadata and audio served by a `FakeSession`.
+
+    `latency` is added to every metadata request, audio key request and stream load,
+    `bandwidth` (bytes/s) limits each chunk transfer, `failure_rate` is
+    the share of stream loads that fail and `chunk_failure_rate` the share of
+    chunk transfers that do. Random choices are seeded, so the
+    same catalog behaves the same on every run.
+    """
+
+    latency: float
+    bandwidth: float | None
+    failure_rate: float
+    chunk_failure_rate: float
+    items: dict[str, dict[str, Any]]
+    # Audio by file ID; streams of the same size share one payload
+    audio: dict[str, bytes]
+    bytes_served: int = 0
+
+    _payloads: dict[int, bytes]
+    _random: random.Random
+    _lock: Lock
+    _counter: int = 0
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        bandwidth: float | None = None,
+        failure_rate: float = 0.0,
+        chunk_failure_rate: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.chunk_failure_rate = chunk_failure_rate
+        self.items = {kind: {} for kind in ("track", "episode", "album", "artist", "show", "playlist")}
+        self.audio = {}
+        self._payloads = {}
+        self._random = random.Random(seed)
+        self._lock = Lock()
+
+    def wait(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def maybe_fail(self) -> None:
+        if not self.failure_rate:
+            return
+        with self._lock:
+            failed = self._random.random() < self.failure_rate
+        if failed:
+            raise ConnectionError("Synthetic stream failure")
+
+    def chunk_fails(self) -> bool:
+        if not self.chunk_failure_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.chunk_failure_rate
+
+    def served(self, size: int) -> None:
+        with self._lock:
+            self.bytes_served += size
+
+    def _gid(self) -> bytes:
+        self._counter += 1
+        return self._counter.to_bytes(16, "big")
+
+    def _add_audio(self, gid: bytes, size: int) -> None:
+        if size not in self._payloads:
+            self._payloads[size] = make_ogg(size, seed=size)
+        self.audio[gid.hex()] = self._payloads[size]
+
+    def add_track(self, name: str, album: Metadata.Album, number: int, size: int) -> Metadata.Track:
+        gid = self._gid()
+        track = Metadata.Track(gid=gid, name=name, number=number, disc_number=1, duration=size // 40)
+        track.artist.add(gid=album.artist[0].gid, name=album.artist[0].name)
+        track.album.CopyFrom(album)
+        track.file.add(file_id=gid, format=Metadata.AudioFile.OGG_VORBIS_320)
+        self.items["track"][gid.hex()] = track
+        self._add_audio(gid, size)
+        return track
+
+    def add_album(self, name: str, tracks: int, size: int, artist: str = "Artist") -> Metadata.Album:
+        gid = self._gid()
+        # Tracks embed a shallow copy of their album, without the track list
+        stub = Metadata.Album(gid=gid, name=name)
+        stub.artist.add(gid=gid, name=artist)
+        stub.date.year = 2020
+        album = Metadata.Album()
+        album.CopyFrom(stub)
+        disc = album.disc.add(number=1)
+        for number in range(1, tracks + 1):
+            disc.track.add(gid=self.add_track(f"Track {number}", stub, number, size).gid)
+        self.items["album"][gid.hex()] = album
+        return album
+
+    def add_artist(self, name: str, albums: int, tracks: int, size: int) -> Metadata.Artist:
+        artist = Metadata.Artist(gid=self._gid(), name=name)
+        group = artist.album_group.add()
+        for number in range(1, albums + 1):
+            group.album.add(gid=self.add_album(f"Album {number}", tracks, size, artist=name).gid)
+        self.items["artist"][artist.gid.hex()] = artist
+        return artist
+
+    def add_show(self, name: str, episodes: int, size: int) -> Metadata.Show:
+        show = Metadata.Show(gid=self._gid(), name=name)
+        for number in range(1, episodes + 1):
+            gid = self._gid()
+            episode = Metadata.Episode(gid=gid, name=f"Episode {number}", duration=size // 40)
+            episode.show.name = name
+            episode.publish_time.year = 2021
+            episode.publish_time.month = 1
+            episode.publish_time.day = number % 28 + 1
+            episode.audio.add(file_id=gid, format=Metadata.AudioFile.OGG_VORBIS_320)
+            self.items["episode"][gid.hex()] = episode
+            self._add_audio(gid, size)
+            show.episode.add(gid=gid)
+        # Like on that green streaming service, the newest episodes are listed first
+        show.episode.reverse()
+        self.items["show"][show.gid.hex()] = show
+        return show
+
+    def add_playlist(self, playlist_id: str, name: str, tracks: list[Metadata.Track]) -> None:
+        playlist = Playlist4External.SelectedListContent(revision=b"1", length=len(tracks))
+        playlist.attributes.name = name
+        for track in tracks:
+            playlist.contents.items.add(uri=item_uri("track", track.gid))
+        self.items["playlist"][playlist_id] = playlist
+
+
+class FakeSession:
+    catalog: FakeCatalog
+
+    _api: FakeApiClient
+    _content_feeder: FakeContentFeeder
+    _audio_key: FakeAudioKeyManager
+
+    def __init__(self, catalog: FakeCatalog) -> None:
+        self.catalog = catalog
+        self._api = FakeApiClient(catalog)
+        self._audio_key = FakeAudioKeyManager(catalog)
+        self._content_feeder = FakeContentFeeder(catalog, self._audio_key)
+
+    def api(self) -> FakeApiClient:
+        return self._api
+
+    def content_feeder(self) -> FakeContentFeeder:
+        return self._content_feeder
+
+    def audio_key(self) -> FakeAudioKeyManager:
+        return self._audio_key
@@ -0,0 +1,39 @@
+"""Helpers shared by the benchmark reports."""
+
+from __future__ import annotations
+
+import platform
+import subprocess
+from pathlib import Path
+from typing import Any
+
+from despot import __version__
+
+
+def commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> dict[str, Any]:
+    """Identify what a report was measured with, so runs of different commits can be told apart."""
+    return {"despot": __version__, "commit": commit(), "python": platform.python_version()}
+
+
+def change(value: float, baseline: float, *, higher_is_better: bool) -> str:
+    """Format the relative change of `value` against `baseline` as rich markup."""
+    if not baseline:
+        return ""
+    relative = (value - baseline) / baseline
+    if abs(relative) < 0.005:
+        return " [dim]±0%[/]"
+    better = relative > 0 if higher_is_better else relative < 0
+    return f" [{'green' if better else 'red'}]{relative:+.1%}[/]"
@@ -0,0 +1,127 @@
+"""Runs one benchmark scenario against a `FakeSession` and measures it."""
+
+from __future__ import annotations
+
+import multiprocessing
+import resource
+import sys
+import tempfile
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from time import perf_counter
+from typing import Any
+
+from librespot.core import Session
+from librespot.metadata import EpisodeId, TrackId
+
+from despot.base import Despot
+from despot.config import Config
+from despot.enums import Engine
+from despot.logging import configure_logging
+from despot.metrics import TrackTimings
+from despot.models import AudioQuality
+
+from .fakes import FakeCatalog, FakeSession
+from .scenarios import SCENARIOS
+
+
+@dataclass
+class BenchmarkParams:
+    engine: Engine
+    concurrency: int | None
+    lookahead: int
+    latency: float
+    bandwidth: float | None
+    failure_rate: float
+    chunk_failure_rate: float
+    scale: float
+    seed: int
+
+
+class _BenchmarkDespot(Despot):
+    _session: Session
+
+    def __init__(self, config: Config, session: FakeSession) -> None:
+        self._session = session  # type: ignore[assignment]
+        super().__init__(config)
+
+    def _get_session(self) -> Session:
+        return self._session
+
+
+def _percentile(values: list[float], share: float) -> float:
+    # Nearest rank of the sorted `values`
+    return values[min(int(share * len(values)), len(values) - 1)] if values else 0.0
+
+
+def _peak_rss() -> int:
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, KiB everywhere else
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def run_scenario(name: str, params: BenchmarkParams) -> dict[str, Any]:
+    configure_logging(debug=False)
+    catalog = FakeCatalog(
+        latency=params.latency,
+        bandwidth=params.bandwidth,
+        failure_rate=params.failure_rate,
+        chunk_failure_rate=params.chunk_failure_rate,
+        seed=params.seed,
+    )
+    links = SCENARIOS[name].build(catalog, params.scale)
+    # Includes the synthetic audio of the catalog, which is kept in memory
+    baseline_rss = _peak_rss()
+    latencies = []
+    with tempfile.TemporaryDirectory(prefix="despot-benchmark-") as destination:
+        config = Config(
+            destination=Path(destination),
+            quality=AudioQuality.VERY_HIGH,
+            engine=params.engine,
+            concurrency=params.concurrency,
+            lookahead=params.lookahead,
+            cache=False,
+        )
+        despot = _BenchmarkDespot(config, FakeSession(catalog))
+        # Latency of a track is measured from the request for its stream until its result arrives
+        started: defaultdict[str, list[float]] = defaultdict(list)
+        resolver = despot._batch_processor._resolver
+        submit = resolver.submit
+
+        def _submit(track_id: TrackId | EpisodeId, timings: TrackTimings | None = None) -> Any:
+            started[track_id.hex_id()].append(perf_counter())
+            return submit(track_id, timings)
+
+        resolver.submit = _submit  # type: ignore[method-assign]
+
+        start = perf_counter()
+        try:
+            for result in despot.iter_download(links):
+                if pending := started.get(result.track.track_id.hex_id()):
+                    latencies.append(perf_counter() - pending.pop(0))
+        finally:
+            despot.close()
+        elapsed = perf_counter() - start
+
+    latencies.sort()
+    return {
+        "tracks": len(latencies),
+        "failures": despot.failures,
+        "seconds": elapsed,
+        "tracks_per_s": (len(latencies) - despot.failures) / elapsed,
+        "bytes_per_s": catalog.bytes_served / elapsed,
+        "latency_p50": _percentile(latencies, 0.5),
+        "latency_p95": _percentile(latencies, 0.95),
+        "latency_p99": _percentile(latencies, 0.99),
+        "latency_max": _percentile(latencies, 1),
+        "peak_rss": _peak_rss(),
+        "baseline_rss": baseline_rss,
+        "phases": despot.metrics.summary()["phases"],
+    }
+
+
+def run_isolated(name: str, params: BenchmarkParams) -> dict[str, Any]:
+    # A fresh interpreter per scenario keeps the peak RSS of one from hiding another's
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_scenario, (name, params))
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Callable
+
+from despot.constants import _fcbgvsl
+
+from .fakes import FakeCatalog, item_uri
+
+KiB = 1024
+MiB = 1024 * KiB
+
+_PLAYLIST_ID = "0benchmarkplaylist0001"
+
+
+@dataclass(frozen=True)
+class Scenario:
+    description: str
+    # Adds the scenario's items to the catalog and returns the links to download
+    build: Callable[[FakeCatalog, float], list[str]]
+
+
+def _scaled(count: int, scale: float) -> int:
+    return max(round(count * scale), 1)
+
+
+def _playlist(catalog: FakeCatalog, scale: float) -> list[str]:
+    tracks = []
+    for number in range(1, _scaled(100, scale) + 1):
+        album = catalog.add_album(f"Album {number}", 10, 512 * KiB)
+        tracks += [catalog.items["track"][track.gid.hex()] for track in album.disc[0].track]
+    catalog.add_playlist(_PLAYLIST_ID, "Benchmark", tracks)
+    return [f"{_fcbgvsl}:playlist:{_PLAYLIST_ID}"]
+
+
+def _artist(catalog: FakeCatalog, scale: float) -> list[str]:
+    artist = catalog.add_artist("Artist", _scaled(50, scale), 10, 512 * KiB)
+    return [item_uri("artist", artist.gid)]
+
+
+def _podcast(catalog: FakeCatalog, scale: float) -> list[str]:
+    show = catalog.add_show("Podcast", _scaled(4, scale), 64 * MiB)
+    return [item_uri("show", show.gid)]
+
+
+def _albums(catalog: FakeCatalog, scale: float) -> list[str]:
+    return [
+        item_uri("album", catalog.add_album(f"Album {album}", 12, 4 * MiB).gid) for album in range(_scaled(8, scale))
+    ]
+
+
+SCENARIOS = {
+    "playlist": Scenario("1000 tracks of 512 KiB in one playlist", _playlist),
+    "artist": Scenario("An artist with 50 albums of 10 tracks of 512 KiB each", _artist),
+    "albums": Scenario("8 separate albums of 12 tracks of 4 MiB each", _albums),
+    "podcast": Scenario("A show with 4 episodes of 64 MiB each", _podcast),
+}
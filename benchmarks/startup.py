@@ -0,0 +1,104 @@
+"""Startup latency of the `despot` command, for the calls that never download anything."""
+
+from __future__ import annotations
+
+import json
+import re
+import subprocess
+import sys
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+from typing import Any
+
+import rich_click as click
+from rich import get_console
+from rich.table import Table
+
+from .report import change, environment
+
+# Invocations that should stay cheap, by name
+_COMMANDS = {
+    "--version": ["--version"],
+    "--help": ["--help"],
+    "usage error": ["download"],
+}
+# Modules that only a download needs; importing the CLI must not pull them in
+_HEAVY_MODULES = ("librespot", "mutagen", "despot.base", "despot.batch", "despot.models")
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)$")
+
+
+def _time_command(args: list[str]) -> float:
+    start = perf_counter()
+    subprocess.run([sys.executable, "-m", "despot.cli", *args], capture_output=True, check=False)
+    return perf_counter() - start
+
+
+def _import_profile() -> tuple[float, list[tuple[str, float]], list[str]]:
+    """Return the import time of `despot.cli`, its heaviest direct imports and the heavy modules it loaded."""
+    check = f"import sys, despot.cli; print(*[m for m in {_HEAVY_MODULES!r} if m in sys.modules])"
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", check], capture_output=True, check=True, text=True
+    )
+    total = 0.0
+    imports: list[tuple[str, float]] = []
+    for line in process.stderr.splitlines():
+        if not (match := _IMPORTTIME_RE.match(line)):
+            continue
+        cumulative, depth, module = int(match[2]) / 1e6, len(match[3]), match[4]
+        if module == "despot.cli":
+            total = cumulative
+        elif depth == 3:  # imported by the top level module
+            imports.append((module, cumulative))
+    return total, sorted(imports, key=lambda item: item[1], reverse=True)[:5], process.stdout.split()
+
+
+@click.command(
+    context_settings={"help_option_names": ["-h", "--help"], "show_default": True},
+    help="Measure how long despot takes to start for calls that don't download anything.",
+)
+@click.option("--runs", type=int, default=20, help="Runs of each invocation, the fastest and median are reported.")
+@click.option("--output", "-o", type=click.Path(dir_okay=False, path_type=Path), help="Write the results as JSON.")
+@click.option(
+    "--compare",
+    "-c",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="Show the changes relative to the JSON results of an earlier run.",
+)
+def main(runs: int, output: Path | None, compare: Path | None) -> None:
+    console = get_console()
+    baseline: dict[str, Any] = json.loads(compare.read_text())["results"] if compare else {}
+    results: dict[str, dict[str, float]] = {}
+    with console.status("Measuring startup"):
+        for name, args in _COMMANDS.items():
+            timings = [_time_command(args) for _ in range(runs)]
+            results[name] = {"min": min(timings), "median": median(timings)}
+        profiles = [_import_profile() for _ in range(runs)]
+    total, imports, heavy = min(profiles, key=lambda profile: profile[0])
+    results["import despot.cli"] = {"min": total, "median": median(profile[0] for profile in profiles)}
+
+    table = Table("Invocation", "Fastest", "Median")
+    for name, result in results.items():
+        base = baseline.get(name, {})
+        table.add_row(
+            name,
+            *(
+                f"{result[key] * 1000:.0f} ms"
+                + (change(result[key], base[key], higher_is_better=False) if key in base else "")
+                for key in ("min", "median")
+            ),
+        )
+    console.print(table)
+    console.print(
+        "Heaviest imports: " + ", ".join(f"{module} ({seconds * 1000:.0f} ms)" for module, seconds in imports)
+    )
+    if heavy:
+        console.print(f"[red]Importing the CLI loaded {', '.join(heavy)}")
+
+    if output:
+        report = {**environment(), "runs": runs, "results": results, "heavy_modules": heavy}
+        output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
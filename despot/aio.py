@@ -0,0 +1,409 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import pathlib
+from concurrent.futures import Future
+from contextlib import suppress
+from functools import partial
+from queue import Empty, SimpleQueue
+from threading import Thread
+from time import time
+from typing import Any, AsyncIterator, BinaryIO, Coroutine, Iterable, Iterator
+
+from librespot.audio import ChannelManager, PlayableContentFeeder
+from rich.progress import TaskID
+
+from .batch import BatchProcessor, _ResultQueue
+from .chunks import ChunkTracker
+from .concurrency import AsyncConcurrencyLimit
+from .config import Config
+from .constants import ASYNC_BLOCKING_WORKERS, ASYNC_READ_AHEAD_CHUNKS, RESUME_CHECKPOINT_CHUNKS
+from .enums import Phase
+from .logging import logger
+from .metrics import RunMetrics, TrackTimings
+from .models import DownloadableBatch, DownloadableTrack, ProcessingResult
+from .partial import PartialDownload
+from .progress import BatchProgress
+from .vorbis import VorbisCommentInjector
+
+# Futures of the submitted downloads in submission order, followed by either
+# `None` or the exception that ended the scheduler
+_SubmissionQueue = SimpleQueue["Future[ProcessingResult] | BaseException | None"]
+
+
+class AsyncBatchProcessor(BatchProcessor):
+    """Runs downloads as coroutines on an asyncio event loop instead of one thread each.
+
+    Chunks are requested from librespot without blocking and awaited on the
+    loop, so a download only costs a coroutine while it waits for the network.
+    Calls that still block (iterating the link parser, finalizing files) run
+    on a small executor, stream resolution uses the regular `StreamResolver`.
+    """
+
+    _thread: Thread | None = None
+    _loop: asyncio.AbstractEventLoop | None = None
+    _main: asyncio.Task[None] | None = None
+    # Counterparts of `_window` and `_slots` on the event loop
+    _window_async: AsyncConcurrencyLimit
+    _slots_async: AsyncConcurrencyLimit
+
+    @staticmethod
+    def _executor_workers(concurrency: int) -> int:
+        return min(concurrency, ASYNC_BLOCKING_WORKERS)
+
+    def _resize(self, concurrency: int) -> None:
+        # Called from the event loop, which is where the downloads account their bytes
+        super()._resize(concurrency)
+        self._slots_async.resize(concurrency)
+        self._window_async.resize(concurrency + self._lookahead)
+
+    def _transferred(self, size: int) -> None:
+        if self._adaptive is not None:
+            self._adaptive.transferred(size, active=self._slots_async.active)
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        if self._loop is not None and self._main is not None:
+            with suppress(RuntimeError):  # loop already closed
+                self._loop.call_soon_threadsafe(self._main.cancel)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        super().shutdown()
+
+    def process_many(self, batches: Iterable[DownloadableBatch]) -> Iterator[ProcessingResult]:
+        self._tempfiles = []
+        self.metrics = RunMetrics()
+        submitted: _SubmissionQueue = SimpleQueue()
+        with BatchProgress(self.config.progress, console=self._console, disable=self.config.debug) as self._progress:
+            self._thread = Thread(target=self._run, args=(batches, submitted), name="despot-async", daemon=True)
+            self._thread.start()
+            results = _ResultQueue(ordered=self.config.ordered)
+            while True:
+                try:
+                    item = submitted.get(timeout=0.1)
+                except Empty:
+                    yield from results.ready()
+                    continue
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                results.add(item)
+                yield from results.ready()
+            yield from results.remaining()
+        self.metrics.stop()
+
+    def _run(self, batches: Iterable[DownloadableBatch], submitted: _SubmissionQueue) -> None:
+        try:
+            asyncio.run(self._schedule(batches, submitted))
+        except asyncio.CancelledError:
+            logger.debug("Async scheduler was cancelled")
+        except BaseException as exc:
+            submitted.put(exc)
+        finally:
+            submitted.put(None)
+
+    async def _schedule(self, batches: Iterable[DownloadableBatch], submitted: _SubmissionQueue) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._main = asyncio.current_task()
+        window = self._window_async = AsyncConcurrencyLimit(self._concurrency + self._lookahead)
+        slots = self._slots_async = AsyncConcurrencyLimit(self._concurrency)
+        downloads: set[asyncio.Task[None]] = set()
+        iterator = iter(batches)
+        try:
+            while (batch := await self._blocking(next, iterator, None)) is not None:
+                tracks, batch_size = self._batch_tracks(batch)
+                async for idx, track in self._enumerate_tracks(tracks, lazy=not isinstance(batch.tracks, list)):
+                    if indexed := self._skip_indexed(track=track, batch=batch, batch_idx=idx, batch_size=batch_size):
+                        submitted.put(indexed)
+                        continue
+                    await window.acquire()
+                    result: Future[ProcessingResult] = Future()
+                    result.add_done_callback(self._callback)
+                    download = self._start(
+                        track, result, batch=batch, batch_idx=idx, batch_size=batch_size, window=window, slots=slots
+                    )
+                    job = asyncio.create_task(self._complete(result, download))
+                    downloads.add(job)
+                    job.add_done_callback(downloads.discard)
+                    submitted.put(result)
+            await asyncio.gather(*downloads)
+        finally:
+            for job in downloads:
+                job.cancel()
+            await asyncio.gather(*downloads, return_exceptions=True)
+
+    def _start(
+        self,
+        track: DownloadableTrack,
+        result: Future[ProcessingResult],
+        *,
+        batch: DownloadableBatch,
+        batch_idx: int,
+        batch_size: int,
+        window: AsyncConcurrencyLimit,
+        slots: AsyncConcurrencyLimit,
+    ) -> Coroutine[Any, Any, ProcessingResult]:
+        config = self._config(batch)
+        batch_kwargs: dict[str, Any] = {
+            "config": config,
+            "batch_ctx": batch.context,
+            "batch_idx": batch_idx,
+            "batch_size": batch_size,
+            "batch_description": batch.description,
+        }
+        timings = TrackTimings()
+        if self._store and self._in_store(track, config):
+            return self._link_stored_async(
+                window=window,
+                track=track,
+                store=self._store,
+                pending=self._pending.get(track.track_id.hex_id()),
+                timings=timings,
+                **batch_kwargs,
+            )
+        self._track_pending(track, result)
+        return self._download_track_async(
+            track=track,
+            stream_future=asyncio.wrap_future(self._resolver.submit(track.track_id, timings=timings)),
+            timings=timings,
+            window=window,
+            slots=slots,
+            **batch_kwargs,
+        )
+
+    @staticmethod
+    async def _complete(result: Future[ProcessingResult], download: Coroutine[Any, Any, ProcessingResult]) -> None:
+        try:
+            result.set_result(await download)
+        except asyncio.CancelledError:
+            result.cancel()
+            raise
+        except Exception as exc:
+            result.set_exception(exc)
+
+    async def _enumerate_tracks(
+        self, tracks: Iterator[DownloadableTrack], *, lazy: bool
+    ) -> AsyncIterator[tuple[int, DownloadableTrack]]:
+        if not lazy:
+            for item in enumerate(tracks):
+                yield item
+            return
+        # Listing lazy tracks may fetch more of the batch's metadata, which must not block the loop
+        idx = 0
+        while (track := await self._blocking(next, tracks, None)) is not None:
+            yield idx, track
+            idx += 1
+
+    async def _blocking(self, fn: Any, *args: Any, **kwargs: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+    async def _link_stored_async(
+        self, *, window: AsyncConcurrencyLimit, pending: Future[ProcessingResult] | None, **kwargs: Any
+    ) -> ProcessingResult:
+        try:
+            if pending is not None:
+                with suppress(Exception):
+                    await asyncio.wrap_future(pending)
+            return await self._blocking(self._link_stored, **kwargs)
+        finally:
+            window.release()
+
+    async def _download_track_async(
+        self,
+        *,
+        track: DownloadableTrack,
+        stream_future: asyncio.Future[PlayableContentFeeder.LoadedStream],
+        config: Config,
+        timings: TrackTimings,
+        window: AsyncConcurrencyLimit,
+        slots: AsyncConcurrencyLimit,
+        batch_ctx: dict,
+        batch_idx: int,
+        batch_size: int,
+        batch_description: str | None = None,
+    ) -> ProcessingResult:
+        has_header = False
+        result = ProcessingResult(track=track, timings=timings)
+        async with slots:
+            timings.queued()
+            if batch_idx == 0:
+                self._progress.print()
+            task = self._progress.add_task("", batch_idx=batch_idx + 1, batch_size=batch_size)
+            try:
+                try:
+                    stream = await stream_future
+                finally:
+                    window.release()
+                self._populate(
+                    track=track,
+                    stream=stream,
+                    batch_ctx=batch_ctx,
+                    batch_idx=batch_idx,
+                    batch_description=batch_description,
+                )
+                has_header = True
+
+                if self._bail_condition(task=task, track=track, batch_ctx=batch_ctx, config=config):
+                    return result
+
+                if await self._transfer_async(track=track, stream=stream, task=task, timings=timings) == -1:
+                    result.interrupted = True
+                    return result
+
+            except Exception as exc:
+                self._handle_failure(result, task=task, exc=exc, has_header=has_header)
+                return result
+
+        # The slot already went to the next download
+        return await asyncio.get_running_loop().run_in_executor(
+            self._finalizer, partial(self._finalize_track, result=result, task=task, batch_ctx=batch_ctx)
+        )
+
+    async def _transfer_async(
+        self,
+        *,
+        track: DownloadableTrack,
+        stream: PlayableContentFeeder.LoadedStream,
+        task: TaskID,
+        timings: TrackTimings,
+    ) -> float:
+        # Resuming hashes the part that was already downloaded
+        fp, partial_download, injector, digest = await self._blocking(
+            self._prepare_transfer, track=track, stream=stream, task=task
+        )
+        with fp, timings.measure(Phase.TRANSFER):
+            download_duration = await self._write_from_stream_async(
+                fp,
+                stream=stream,
+                task=task,
+                injector=injector,
+                timings=timings,
+                digest=digest,
+                partial=partial_download,
+                resume_filename=track.resume_filename,
+            )
+        if download_duration != -1:
+            await self._blocking(
+                self._complete_transfer,
+                track=track,
+                stream=stream,
+                injector=injector,
+                digest=digest,
+                download_duration=download_duration,
+            )
+        return download_duration
+
+    async def _write_from_stream_async(
+        self,
+        fp: BinaryIO,
+        stream: PlayableContentFeeder.LoadedStream,
+        task: TaskID,
+        injector: VorbisCommentInjector,
+        timings: TrackTimings,
+        digest: hashlib._Hash,
+        partial: PartialDownload | None = None,
+        resume_filename: pathlib.Path | None = None,
+    ) -> float:
+        # Writes go to the page cache and are done on the loop; only waiting
+        # for the network is worth a suspension point.
+        chunks = ChunkTracker.of(stream.input_stream)
+        arrivals = _ChunkArrivals(chunks, asyncio.get_running_loop())
+        position, size = chunks.stream.pos(), chunks.stream.size()
+        description = f"the download of '{fp.name}'"
+        start = next_chunk_start = time()
+        chunk_idx = 0
+        try:
+            while position < size:
+                chunk = await self._read_chunk_retrying(
+                    chunks, position, arrivals=arrivals, description=description, timings=timings
+                )
+                position += len(chunk)
+                with timings.measure(Phase.TAG):
+                    data = injector.feed(chunk)
+                fp.write(data)
+                digest.update(data)
+                timings.bytes += len(chunk)
+                self._transferred(len(chunk))
+                self._progress.advance(task, len(chunk))
+                chunk_duration = time() - next_chunk_start
+                next_chunk_start = time()
+                chunk_idx += 1
+
+                if self._stop.is_set():
+                    logger.debug("Stop event is set, bailing.")
+                    self._checkpoint(fp, injector=injector, partial=partial, resume_filename=resume_filename)
+                    return -1
+                if chunk_idx % RESUME_CHECKPOINT_CHUNKS == 0:
+                    self._checkpoint(fp, injector=injector, partial=partial, resume_filename=resume_filename)
+
+                if self.config.paranoia:
+                    await asyncio.sleep(max(1 - chunk_duration, 0))
+        except asyncio.CancelledError:
+            self._checkpoint(fp, injector=injector, partial=partial, resume_filename=resume_filename)
+            raise
+        fp.write(data := injector.flush())
+        digest.update(data)
+        fp.truncate()
+        return time() - start
+
+    async def _read_chunk_retrying(
+        self,
+        chunks: ChunkTracker,
+        position: int,
+        *,
+        arrivals: _ChunkArrivals,
+        description: str,
+        timings: TrackTimings,
+    ) -> memoryview:
+        # Failed reads are retried from the same position, so the transfer continues where it was interrupted
+        return await self._retry.call_async(
+            lambda: self._read_chunk(chunks, position, arrivals), description=description, timings=timings
+        )
+
+    @staticmethod
+    async def _read_chunk(chunks: ChunkTracker, position: int, arrivals: _ChunkArrivals) -> memoryview:
+        # AbsChunkedInputStream.read() blocks on a condition until the chunk
+        # has arrived. Instead, request the chunk (and a few following ones)
+        # directly and await the report of its arrival or failure.
+        index, offset = divmod(position, ChannelManager.chunk_size)
+        for ahead in range(index, min(index + ASYNC_READ_AHEAD_CHUNKS + 1, chunks.stream.chunks())):
+            chunks.request(ahead)
+        while True:
+            # Taken before checking, so a report in between isn't missed
+            reported = arrivals.next_report()
+            if chunks.check(index):
+                return memoryview(chunks.stream.buffer()[index])[offset:]
+            await reported
+
+
+class _ChunkArrivals:
+    """Wakes the download of a stream on the event loop when one of its chunks arrives or fails.
+
+    The `ChunkTracker` of the stream reports chunks from librespot's threads,
+    the reports are passed on to the loop.
+    """
+
+    _loop: asyncio.AbstractEventLoop
+    _reported: asyncio.Future[None] | None = None
+
+    def __init__(self, chunks: ChunkTracker, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        chunks.subscribe(self._report)
+
+    def next_report(self) -> asyncio.Future[None]:
+        """Return a future that completes with the next report of a chunk."""
+        if self._reported is None or self._reported.done():
+            self._reported = self._loop.create_future()
+        return self._reported
+
+    def _report(self) -> None:
+        # Chunks may still arrive after the loop was closed on shutdown
+        with suppress(RuntimeError):
+            self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self) -> None:
+        if self._reported is not None and not self._reported.done():
+            self._reported.set_result(None)
@@ -1,19 +1,23 @@
 from __future__ import annotations
 
-import itertools
-from typing import Iterator
+from typing import Iterable, Iterator
 
 import rich_click as click
 from librespot.core import Session
 from rich import get_console
 from rich.console import Console
 
+from .aio import AsyncBatchProcessor
 from .batch import BatchProcessor
+from .cache import MetadataCache
 from .config import Config
 from .constants import CACHE_HOME
+from .enums import Engine
 from .logging import logger
+from .metrics import RunMetrics
 from .models import ProcessingResult
 from .parser import LinkParser
+from .sync import SYNC_FILENAME, SyncState
 
 
 class Despot:
@@ -22,6 +26,8 @@ class Despot:
 
     _link_parser: LinkParser
     _batch_processor: BatchProcessor
+    _cache: MetadataCache | None = None
+    _sync: SyncState | None = None
 
     def __init__(self, config: Config, ctx: click.RichContext | None = None) -> None:
         self.config = config
@@ -30,16 +36,32 @@ class Despot:
             if ctx.console:
                 self.console = ctx.console
 
-            @ctx.call_on_close
-            def _cleanup() -> None:
-                if hasattr(self, "_batch_processor"):
-                    self._batch_processor.shutdown()
+            ctx.call_on_close(self.close)
         else:
             self.console = Console(quiet=True)
 
         session = self._get_session()
-        self._link_parser = LinkParser(session=session, console=self.console)
-        self._batch_processor = BatchProcessor(config=self.config, session=session, console=self.console)
+        if self.config.cache:
+            self._cache = MetadataCache(
+                CACHE_HOME / "metadata.sqlite3",
+                max_size=self.config.cache_size * 1024**2,
+                refresh=self.config.refresh,
+            )
+        if self.config.sync:
+            self._sync = SyncState(CACHE_HOME / SYNC_FILENAME)
+        self._link_parser = LinkParser(
+            session=session,
+            console=self.console,
+            concurrency=self.config.metadata_concurrency,
+            cache=self._cache,
+            sync=self._sync,
+            since=self.config.since,
+            latest=self.config.latest,
+        )
+        processor_cls = AsyncBatchProcessor if self.config.engine == Engine.ASYNC else BatchProcessor
+        self._batch_processor = processor_cls(
+            config=self.config, session=session, console=self.console, cache=self._cache
+        )
 
     def _get_session(self) -> Session:
         with self.console.status("Authenticating"):
@@ -64,17 +86,54 @@ class Despot:
                     )
             return builder.user_pass(self.config.username, self.config.password).create()
 
+    def close(self) -> None:
+        if hasattr(self, "_link_parser"):
+            self._link_parser.shutdown()
+        if hasattr(self, "_batch_processor"):
+            self._batch_processor.shutdown()
+        if self._cache:
+            self._cache.close()
+        if self._sync:
+            self._sync.close()
+
+    @property
+    def metrics(self) -> RunMetrics:
+        return self._batch_processor.metrics
+
+    @property
+    def failures(self) -> int:
+        return self._batch_processor.failures
+
     def download(self, links: str | list[str]) -> tuple[int, list[ProcessingResult]]:
+        results = list(self.iter_download(links))
+        return self.failures, results
+
+    def iter_download(self, links: str | Iterable[str]) -> Iterator[ProcessingResult]:
+        """Download `links` one after the other, yielding each result as soon as it is available."""
         if isinstance(links, str):
             links = [links]
-        results = list(itertools.chain.from_iterable((self._parse_and_download(link) for link in links)))
+        try:
+            for result in self._batch_processor.process_many(self._link_parser.parse_all(links)):
+                self._record_sync(result, self.config)
+                yield result
+        finally:
+            self._write_metrics()
 
-        if (failures := self._batch_processor.failures) > 0:
-            self.console.print(f"\n[red]Done with {failures} failure{'s' if failures>1 else ''}.\n")
+        if (failures := self.failures) > 0:
+            self.console.print(f"\n[red]Done with {failures} failure{'s' if failures > 1 else ''}.\n")
         else:
             self.console.print("\n[bar.finished]Done.\n")
-        return self._batch_processor.failures, results
 
-    def _parse_and_download(self, link: str) -> Iterator[ProcessingResult]:
-        for batch in self._link_parser.parse(uri_or_link=link):
-            yield from self._batch_processor.process(batch)
+    def _record_sync(self, result: ProcessingResult, config: Config) -> None:
+        # A dry run downloads nothing, so it must not mark anything as synced
+        if self._sync and not config.dry_run:
+            self._sync.record(result)
+
+    def _write_metrics(self) -> None:
+        metrics = self.metrics
+        if self.config.metrics_json:
+            metrics.write_json(self.config.metrics_json)
+            logger.debug("Wrote metrics summary to {}", self.config.metrics_json)
+        if self.config.metrics_textfile:
+            metrics.write_textfile(self.config.metrics_textfile)
+            logger.debug("Wrote Prometheus metrics to {}", self.config.metrics_textfile)
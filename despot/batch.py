@@ -1,27 +1,45 @@
+from __future__ import annotations
+
+import hashlib
+import os
 import pathlib
 import shutil
+from collections import deque
 from concurrent.futures import Future, ThreadPoolExecutor
-from http import HTTPStatus
-from io import BufferedWriter
+from contextlib import suppress
+from queue import SimpleQueue
 from threading import Event, Lock
 from time import sleep, time
-from typing import Iterator
+from typing import Any, BinaryIO, Callable, Generator, Iterable, Iterator
 
 from click import Abort
 from librespot.audio import ChannelManager, PlayableContentFeeder
 from librespot.audio.decoders import VorbisOnlyAudioQuality
-from librespot.core import ApiClient, Session
-from librespot.metadata import EpisodeId, TrackId
+from librespot.core import Session
+from librespot.metadata import TrackId
 from rich.console import Console
 from rich.filesize import decimal as decimal_filesize
-from rich.progress import Progress, TaskID
+from rich.progress import TaskID
 
+from .cache import MetadataCache
+from .chunks import ChunkTracker
+from .concurrency import AdaptiveConcurrency, ConcurrencyLimit
 from .config import Config
-from .constants import OGG_HEADER_SIZE, RICH_PROGRESS_COLUMNS
-from .enums import ItemType
-from .exceptions import ContentUnavailableError, StreamError
+from .constants import AUTO_CONCURRENCY_MAX, AUTO_CONCURRENCY_START, OGG_HEADER_SIZE, RESUME_CHECKPOINT_CHUNKS
+from .enums import ItemType, Phase
+from .exceptions import StoreError
+from .fetcher import MetadataFetcher
+from .index import DownloadIndex, IndexEntry
 from .logging import logger
-from .models import DownloadableBatch, DownloadableTrack, ProcessingResult
+from .metrics import RunMetrics, TrackTimings
+from .models import AudioQuality, DownloadableBatch, DownloadableTrack, ProcessingResult
+from .partial import PartialDownload
+from .progress import BatchProgress
+from .resolver import StreamResolver
+from .retry import RetryPolicy
+from .store import ContentStore
+from .templates import FilenameTemplate, compile_templates
+from .vorbis import VorbisCommentInjector
 
 
 class BatchProcessor:
@@ -29,180 +47,753 @@ class BatchProcessor:
 
     successes: int = 0
     failures: int = 0
+    metrics: RunMetrics
+    # Called with every result as soon as it is available, from the thread that completed it
+    on_result: Callable[[ProcessingResult], None] | None = None
 
     _console: Console
+    _concurrency: int
+    _lookahead: int
+    _block_size: int
     _executor: ThreadPoolExecutor
+    # Tags and moves completed downloads, so the download workers can go on with the next track right away
+    _finalizer: ThreadPoolExecutor
     _lock: Lock
     _stop: Event
+    _window: ConcurrencyLimit
+    # Bounds the number of downloads that transfer at the same time
+    _slots: ConcurrencyLimit
+    # Resizes `_slots` and `_window` with `--concurrency auto`
+    _adaptive: AdaptiveConcurrency | None = None
     _tempfiles: list[pathlib.Path]
-    _content_feeder: PlayableContentFeeder
-    _quality_picker: VorbisOnlyAudioQuality
-    _progress: Progress
-
-    def __init__(self, config: Config, session: Session, console: Console | None = None) -> None:
+    _resolver: StreamResolver
+    _retry: RetryPolicy
+    _fetcher: MetadataFetcher
+    _templates: dict[ItemType, FilenameTemplate]
+    _index: DownloadIndex | None = None
+    _store: ContentStore | None = None
+    # Downloads headed for the content store that are still running, by GID
+    _pending: dict[str, Future[ProcessingResult]]
+    _progress: BatchProgress
+
+    def __init__(
+        self,
+        config: Config,
+        session: Session,
+        console: Console | None = None,
+        cache: MetadataCache | None = None,
+    ) -> None:
         self.config = config
 
-        self._executor = ThreadPoolExecutor(max_workers=1 if config.paranoia else config.concurrency)
+        adaptive = config.concurrency is None and not config.paranoia
+        self._concurrency = concurrency = 1 if config.paranoia else config.concurrency or AUTO_CONCURRENCY_START
+        self._lookahead = lookahead = 0 if config.paranoia else config.lookahead
+        # Paranoia mode throttles per chunk
+        self._block_size = ChannelManager.chunk_size if config.paranoia else config.block_size * 1024
+        max_concurrency = AUTO_CONCURRENCY_MAX if adaptive else concurrency
+        self._executor = ThreadPoolExecutor(max_workers=self._executor_workers(max_concurrency))
+        self._finalizer = ThreadPoolExecutor(max_workers=config.finalize_workers, thread_name_prefix="despot-finalize")
         self._lock = Lock()
         self._stop = Event()
+        # Bounds the number of streams that are resolved (or being resolved)
+        # but not yet picked up by a download worker.
+        self._window = ConcurrencyLimit(concurrency + lookahead)
+        self._slots = ConcurrencyLimit(concurrency)
+        if adaptive:
+            self._adaptive = AdaptiveConcurrency(self._resize, limit=concurrency)
         self._console = console or Console(quiet=True)
-        self._content_feeder = session.content_feeder()
-        self._quality_picker = VorbisOnlyAudioQuality(config.quality)
+        self._retry = RetryPolicy(retries=config.retries, base_delay=config.retry_delay)
+        self._resolver = StreamResolver(
+            session=session,
+            quality_picker=VorbisOnlyAudioQuality(AudioQuality(config.quality)),
+            # One resolver for every stream the window admits, so that resolving
+            # never holds up a download worker, whatever the lookahead
+            workers=max_concurrency + lookahead,
+            fetcher=(fetcher := MetadataFetcher(session=session, concurrency=config.metadata_concurrency, cache=cache)),
+            retry=self._retry,
+        )
+        self._fetcher = fetcher
+        self._templates = compile_templates(config.templates)
+        if config.index and not config.dry_run:
+            self._index = DownloadIndex(config.destination, self._templates)
+        if config.store and not config.dry_run:
+            self._store = ContentStore(config.store, link_mode=config.link_mode)
         self._tempfiles = []
+        self._pending = {}
+        self.metrics = RunMetrics()
+
+    @staticmethod
+    def _executor_workers(concurrency: int) -> int:
+        # One thread per simultaneous download
+        return concurrency
+
+    def _resize(self, concurrency: int) -> None:
+        self._concurrency = concurrency
+        self._slots.resize(concurrency)
+        self._window.resize(concurrency + self._lookahead)
+
+    def _transferred(self, size: int) -> None:
+        if self._adaptive is not None:
+            self._adaptive.transferred(size, active=self._slots.active)
 
     def shutdown(self) -> None:
         self._stop.set()
+        self._resolver.shutdown()
         self._executor.shutdown(wait=False, cancel_futures=True)
+        # Files that are being moved into place must not be removed below
+        self._finalizer.shutdown(cancel_futures=True)
 
         if hasattr(self, "_progress"):
-            for task in self._progress.tasks or []:
-                if not task.finished:
-                    task.visible = False
-            self._progress.stop()
+            self._progress.stop(hide_unfinished=True)
 
         for tempfile in self._tempfiles:
-            if tempfile.exists():
+            if not tempfile.exists():
+                continue
+            if self.config.resume:
+                logger.info("Keeping unfinished temporary file '{}' to resume it later", tempfile)
+            else:
                 logger.info("Removing unfinished temporary file '{}'", tempfile)
                 tempfile.unlink()
 
+        if self._index:
+            self._index.close()
+
         logger.debug("Completed batch processor shutdown")
 
     def process(self, batch: DownloadableBatch) -> Iterator[ProcessingResult]:
-        self._tempfiles = []
+        return self.process_many([batch])
 
-        if self.config.newest_first and batch.type == ItemType.SHOW:
-            logger.debug("Queueing latest episodes first")
-            tracks = batch.tracks[::-1]
-        else:
-            tracks = batch.tracks
+    def process_many(self, batches: Iterable[DownloadableBatch]) -> Iterator[ProcessingResult]:
+        """Download the tracks of all `batches` through one shared window.
 
-        with Progress(
-            *RICH_PROGRESS_COLUMNS, console=self._console, disable=self.config.debug, transient=False
-        ) as self._progress:
-            self._progress.live.vertical_overflow = "visible"
-            logger.debug("Queueing downloads for batch {}", batch)
-            futures = []
-            batch_size = len(tracks)
-            for idx, track in enumerate(tracks):
+        The next batch is queued as soon as the last track of the previous one
+        has been submitted, so the workers stay busy across batch boundaries.
+        """
+        self._tempfiles = []
+        self.metrics = RunMetrics()
+        with BatchProgress(self.config.progress, console=self._console, disable=self.config.debug) as self._progress:
+            results = _ResultQueue(ordered=self.config.ordered)
+            for batch in batches:
+                if not (yield from self._queue_batch(batch, results)):
+                    break
+            yield from results.remaining()
+        self.metrics.stop()
+
+    def _queue_batch(self, batch: DownloadableBatch, results: _ResultQueue) -> Generator[ProcessingResult, None, bool]:
+        config = self._config(batch)
+        tracks, batch_size = self._batch_tracks(batch)
+        for idx, track in enumerate(tracks):
+            if indexed := self._skip_indexed(track=track, batch=batch, batch_idx=idx, batch_size=batch_size):
+                results.add(indexed)
+                continue
+            if not (yield from self._acquire_window(results)):
+                return False
+            if self._store and self._in_store(track, config):
                 job = self._executor.submit(
-                    self._download_track,
+                    self._link_stored,
                     track=track,
+                    store=self._store,
+                    pending=self._pending.get(track.track_id.hex_id()),
+                    config=config,
+                    timings=TrackTimings(),
                     batch_ctx=batch.context,
                     batch_idx=idx,
                     batch_size=batch_size,
                     batch_description=batch.description,
                 )
+                job.add_done_callback(lambda _: self._window.release())
                 job.add_done_callback(self._callback)
-                futures.append(job)
-            for future in futures:
-                yield future.result()
+                results.add(job)
+                continue
+            timings = TrackTimings()
+            stream = self._resolver.submit(track.track_id, timings=timings)
+            job = Future()
+            self._submit_stage(
+                self._executor,
+                job,
+                self._download_track,
+                job=job,
+                track=track,
+                stream_future=stream,
+                config=config,
+                timings=timings,
+                batch_ctx=batch.context,
+                batch_idx=idx,
+                batch_size=batch_size,
+                batch_description=batch.description,
+            )
+            job.add_done_callback(self._callback)
+            self._track_pending(track, job)
+            results.add(job)
+            yield from results.ready()
+        return True
+
+    def _config(self, batch: DownloadableBatch) -> Config:
+        return batch.config or self.config
+
+    def _batch_tracks(self, batch: DownloadableBatch) -> tuple[Iterator[DownloadableTrack], int]:
+        """Return the tracks of `batch` in the order they are queued, and their number."""
+        logger.debug("Queueing downloads for batch {}", batch)
+        if not isinstance(batch.tracks, list):
+            size = batch.size or 0
+            self._progress.extend(size)
+            return self._numbered(self._count_tracks(batch.tracks, size)), size
+        if self._config(batch).newest_first and batch.type == ItemType.SHOW:
+            logger.debug("Queueing latest episodes first")
+            tracks = batch.tracks[::-1]
+        else:
+            tracks = batch.tracks
+        self._progress.extend(len(tracks))
+        return self._numbered(iter(tracks)), len(tracks)
+
+    @staticmethod
+    def _numbered(tracks: Iterator[DownloadableTrack]) -> Iterator[DownloadableTrack]:
+        for idx, track in enumerate(tracks, 1):
+            if track.position is None:
+                track.position = idx
+            yield track
+
+    def _count_tracks(self, tracks: Iterator[DownloadableTrack], size: int) -> Iterator[DownloadableTrack]:
+        count = 0
+        for track in tracks:
+            count += 1
+            yield track
+        if count != size:
+            # Some items of the batch were skipped, e.g. local files in a playlist
+            self._progress.extend(count - size)
+
+    def _submit_stage(
+        self,
+        executor: ThreadPoolExecutor,
+        job: Future[ProcessingResult],
+        fn: Callable[..., ProcessingResult | None],
+        /,
+        **kwargs: Any,
+    ) -> None:
+        """Run a stage of `job` on `executor`, completing `job` with its result unless it handed `job` on."""
+
+        def _run() -> None:
+            try:
+                if (result := fn(**kwargs)) is not None:
+                    job.set_result(result)
+            except BaseException as exc:
+                job.set_exception(exc)
+
+        executor.submit(_run).add_done_callback(lambda stage: stage.cancelled() and job.cancel())
 
     def _download_track(
         self,
         *,
+        job: Future[ProcessingResult],
         track: DownloadableTrack,
+        stream_future: Future[PlayableContentFeeder.LoadedStream],
+        config: Config,
+        timings: TrackTimings,
         batch_ctx: dict,
         batch_idx: int,
         batch_size: int,
         batch_description: str | None = None,
-    ) -> ProcessingResult:
+    ) -> ProcessingResult | None:
+        """Transfer a track and hand it to the finalizer, returning its result only if it ends here."""
         has_header = False
-        result = ProcessingResult(track=track)
-        if batch_idx == 0:
-            self._console.print()
-        task = self._progress.add_task("", total=None, batch_idx=batch_idx + 1, batch_size=batch_size)
-        try:
-            stream = self._load_stream(track_id=track.track_id)
-            track.populate_metadata(stream=stream, destination=self.config.destination, idx=batch_idx + 1, **batch_ctx)
+        result = ProcessingResult(track=track, timings=timings)
+        with self._slots:
+            timings.queued()
             if batch_idx == 0:
-                self._console.print(
-                    f"[bold bright_magenta]Downloading {batch_description or track.header_description}[/]\n"
+                self._progress.print()
+            task = self._progress.add_task("", batch_idx=batch_idx + 1, batch_size=batch_size)
+            try:
+                try:
+                    stream = stream_future.result()
+                finally:
+                    self._window.release()
+                self._populate(
+                    track=track,
+                    stream=stream,
+                    batch_ctx=batch_ctx,
+                    batch_idx=batch_idx,
+                    batch_description=batch_description,
                 )
-            has_header = True
+                has_header = True
 
-            if self._bail_condition(task=task, track=track):
-                return result
+                if self._bail_condition(task=task, track=track, batch_ctx=batch_ctx, config=config):
+                    return result
 
-            total_size = stream.input_stream.size - OGG_HEADER_SIZE
-            self._progress.update(task, description=track.task_description, total=total_size, visible=True)
-            logger.debug("Downloading to {}", track.temp_filename)
-            track.target_filename.parent.mkdir(parents=True, exist_ok=True)
-            with self._lock:
-                self._tempfiles.append(track.temp_filename)
-            with track.temp_filename.open("wb") as fp:
-                if (download_duration := self._write_from_stream(fp, stream=stream, task=task)) == -1:
+                if self._transfer(track=track, stream=stream, task=task, timings=timings) == -1:
+                    result.interrupted = True
                     return result
-                logger.debug(
-                    "Done, {} took {:.2f} seconds to download ({}/s)",
-                    track.temp_filename,
-                    download_duration,
-                    decimal_filesize(total_size / download_duration),
-                )
 
-            track.metadata.write_tags(track.temp_filename)
+            except Exception as exc:
+                self._handle_failure(result, task=task, exc=exc, has_header=has_header)
+                return result
+
+        self._submit_stage(self._finalizer, job, self._finalize_track, result=result, task=task, batch_ctx=batch_ctx)
+        return None
+
+    def _finalize_track(self, *, result: ProcessingResult, task: TaskID, batch_ctx: dict) -> ProcessingResult:
+        try:
+            with result.timings.measure(Phase.FINALIZE):
+                self._finalize(track=result.track, task=task, batch_ctx=batch_ctx, timings=result.timings)
+        except Exception as exc:
+            self._handle_failure(result, task=task, exc=exc, has_header=True)
+        return result
+
+    def _populate(
+        self,
+        *,
+        track: DownloadableTrack,
+        stream: PlayableContentFeeder.LoadedStream,
+        batch_ctx: dict,
+        batch_idx: int,
+        batch_description: str | None,
+    ) -> None:
+        track.populate_metadata(
+            stream=stream,
+            destination=self.config.destination,
+            template=self._templates[track.originating_type],
+            idx=track.position or batch_idx + 1,
+            **batch_ctx,
+        )
+        self._print_header(track=track, batch_idx=batch_idx, batch_description=batch_description)
+
+    def _print_header(self, *, track: DownloadableTrack, batch_idx: int, batch_description: str | None) -> None:
+        if batch_idx == 0:
+            self._progress.print(
+                f"[bold bright_magenta]Downloading {batch_description or track.header_description}[/]\n"
+            )
+
+    def _finalize(self, *, track: DownloadableTrack, task: TaskID, batch_ctx: dict, timings: TrackTimings) -> None:
+        if track.sha256 is None:
+            # The comment header couldn't be replaced while the stream passed through
+            with timings.measure(Phase.TAG):
+                track.metadata.write_tags(track.temp_filename)
+            digest = hashlib.sha256()
+            with track.temp_filename.open("rb") as fp:
+                self._hash_file(fp, digest)
+            track.sha256 = digest.hexdigest()
+        if self._store is not None:
+            stored = self._store.add(
+                track.temp_filename, track.track_id.hex_id(), self._quality, ext=track.target_filename.suffix[1:]
+            )
+            self._store.link(stored, track.target_filename)
+        else:
             logger.debug("Moving temp file to {}", track.target_filename)
             shutil.move(track.temp_filename, track.target_filename)
+        track.resume_filename.unlink(missing_ok=True)
+        self._record(track=track, batch_ctx=batch_ctx)
+        self._progress.finish(task)
+
+    def _handle_failure(self, result: ProcessingResult, *, task: TaskID, exc: Exception, has_header: bool) -> None:
+        track = result.track
+        result.exception = exc
+        if track.originating_type in (ItemType.EPISODE, ItemType.TRACK) and not has_header:
+            self._progress.print(f"[bold red]<Unknown {track.originating_type} {track.track_id.hex_id()}>[/]\n")
+        self._progress.fail(task, exc, name=track.track_id.hex_id() if track.is_abstract else track.task_description)
+        if self.config.debug:
+            logger.opt(exception=exc).debug("Failure during download")
+        if self.config.fail_early:
+            raise Abort from exc
+
+    def _transfer(
+        self,
+        *,
+        track: DownloadableTrack,
+        stream: PlayableContentFeeder.LoadedStream,
+        task: TaskID,
+        timings: TrackTimings,
+    ) -> float:
+        fp, partial, injector, digest = self._prepare_transfer(track=track, stream=stream, task=task)
+        with fp, timings.measure(Phase.TRANSFER):
+            download_duration = self._write_from_stream(
+                fp,
+                stream=stream,
+                task=task,
+                injector=injector,
+                timings=timings,
+                digest=digest,
+                partial=partial,
+                resume_filename=track.resume_filename,
+            )
+        if download_duration != -1:
+            self._complete_transfer(
+                track=track,
+                stream=stream,
+                injector=injector,
+                digest=digest,
+                download_duration=download_duration,
+            )
+        return download_duration
 
-        except Exception as exc:
-            result.exception = exc
-            if track.originating_type in (ItemType.EPISODE, ItemType.TRACK) and not has_header:
-                self._console.print(f"[bold red]<Unknown {track.originating_type} {track.track_id.hex_id()}>[/]\n")
-            self._progress.update(task, description=f"[red]<{exc}>", visible=True)
-            if self.config.debug:
-                logger.opt(exception=exc).debug("Failure during download")
-            if self.config.fail_early:
-                raise Abort from exc
+    def _prepare_transfer(
+        self, *, track: DownloadableTrack, stream: PlayableContentFeeder.LoadedStream, task: TaskID
+    ) -> tuple[BinaryIO, PartialDownload | None, VorbisCommentInjector, hashlib._Hash]:
+        """Open the temp file and position it and the stream where the download (re)starts.
 
-        return result
+        Also returns the checksum of what was written so far, which the
+        transfer continues.
+        """
+        track.target_filename.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._tempfiles.append(track.temp_filename)
+        partial = self._prepare_partial(track=track, stream=stream)
+        if partial and partial.offset:
+            injector = track.metadata.comment_injector(
+                source_offset=partial.source_offset, sequence_delta=partial.sequence_delta, serial=partial.serial
+            )
+        else:
+            injector = track.metadata.comment_injector()
+        self._progress.update(
+            task,
+            description=track.task_description,
+            total=stream.input_stream.size - OGG_HEADER_SIZE,
+            completed=injector.source_offset,
+            visible=True,
+        )
+
+        logger.debug("Downloading to {}", track.temp_filename)
+        digest = hashlib.sha256()
+        # Smaller writes are coalesced into blocks, larger ones bypass the buffer
+        if not (partial and partial.offset):
+            fp = track.temp_filename.open("wb", buffering=self._block_size)
+        else:
+            logger.info("Resuming download of '{}' at byte {}", track.temp_filename, partial.offset)
+            fp = track.temp_filename.open("r+b", buffering=self._block_size)
+            self._hash_file(fp, digest, partial.offset)
+            fp.truncate()
+            stream.input_stream.stream().seek(partial.source_offset + OGG_HEADER_SIZE)
+        self._preallocate(fp, stream.input_stream.size - OGG_HEADER_SIZE)
+        return fp, partial, injector, digest
+
+    def _hash_file(self, fp: BinaryIO, digest: hashlib._Hash, size: int | None = None) -> None:
+        """Feed the first `size` bytes of `fp` (all by default) to `digest`, leaving `fp` behind them."""
+        fp.seek(0)
+        remaining = size
+        while data := fp.read(self._block_size if remaining is None else min(remaining, self._block_size)):
+            digest.update(data)
+            if remaining is not None:
+                remaining -= len(data)
+
+    def _preallocate(self, fp: BinaryIO, size: int) -> None:
+        """Reserve disk space for the rest of the file, so parallel downloads don't fragment each other.
+
+        The file is truncated to its actual size once the download completes.
+        """
+        if not self.config.preallocate or not hasattr(os, "posix_fallocate") or (offset := fp.tell()) >= size:
+            return
+        try:
+            os.posix_fallocate(fp.fileno(), offset, size - offset)
+        except OSError as exc:
+            logger.debug("Could not preallocate '{}': {}", fp.name, exc)
 
-    def _write_from_stream(self, fp: BufferedWriter, stream: PlayableContentFeeder.LoadedStream, task: TaskID) -> float:
+    def _complete_transfer(
+        self,
+        *,
+        track: DownloadableTrack,
+        stream: PlayableContentFeeder.LoadedStream,
+        injector: VorbisCommentInjector,
+        digest: hashlib._Hash,
+        download_duration: float,
+    ) -> None:
+        # Otherwise the file still has to be tagged, which changes its checksum
+        if injector.injected:
+            track.sha256 = digest.hexdigest()
+        logger.debug(
+            "Done, {} took {:.2f} seconds to download ({}/s)",
+            track.temp_filename,
+            download_duration,
+            decimal_filesize((stream.input_stream.size - OGG_HEADER_SIZE) / download_duration),
+        )
+
+    def _prepare_partial(
+        self, *, track: DownloadableTrack, stream: PlayableContentFeeder.LoadedStream
+    ) -> PartialDownload | None:
+        if not self.config.resume:
+            return None
+        partial = PartialDownload(
+            gid=track.track_id.hex_id(), file_id=stream.metrics.file_id, size=stream.input_stream.size
+        )
+        if track.temp_filename.exists():
+            previous = PartialDownload.load(track.resume_filename)
+            if previous and previous.matches(partial) and previous.can_resume(track.temp_filename.stat().st_size):
+                partial = previous
+            else:
+                logger.info("Discarding stale partial download '{}'", track.temp_filename)
+                track.temp_filename.unlink()
+        partial.save(track.resume_filename)
+        return partial
+
+    def _write_from_stream(
+        self,
+        fp: BinaryIO,
+        stream: PlayableContentFeeder.LoadedStream,
+        task: TaskID,
+        injector: VorbisCommentInjector,
+        timings: TrackTimings,
+        digest: hashlib._Hash,
+        partial: PartialDownload | None = None,
+        resume_filename: pathlib.Path | None = None,
+    ) -> float:
+        chunks = ChunkTracker.of(stream.input_stream)
+        position = chunks.stream.pos()
+        block = memoryview(bytearray(self._block_size))
+        description = f"the download of '{fp.name}'"
         start = next_chunk_start = time()
-        while chunk := stream.input_stream.stream().read(ChannelManager.chunk_size):
-            written = fp.write(chunk)
-            self._progress.update(task, advance=written)
+        chunk_idx = 0
+        while size := self._read_retrying(chunks, block, position, description=description, timings=timings):
+            position += size
+            with timings.measure(Phase.TAG):
+                data = injector.feed(block[:size])
+            fp.write(data)
+            digest.update(data)
+            timings.bytes += size
+            self._transferred(size)
+            self._progress.advance(task, size)
             chunk_duration = time() - next_chunk_start
             next_chunk_start = time()
+            chunk_idx += 1
 
             if self._stop.is_set():
                 logger.debug("Stop event is set, bailing.")
+                self._checkpoint(fp, injector=injector, partial=partial, resume_filename=resume_filename)
                 return -1
+            if chunk_idx % RESUME_CHECKPOINT_CHUNKS == 0:
+                self._checkpoint(fp, injector=injector, partial=partial, resume_filename=resume_filename)
 
             if self.config.paranoia:
                 sleep(max(1 - chunk_duration, 0))
+        fp.write(data := injector.flush())
+        digest.update(data)
+        fp.truncate()
         return time() - start
 
-    def _bail_condition(self, *, task: TaskID, track: DownloadableTrack) -> bool:
+    def _read_retrying(
+        self,
+        chunks: ChunkTracker,
+        view: memoryview,
+        position: int,
+        *,
+        description: str,
+        timings: TrackTimings,
+    ) -> int:
+        # Failed reads are retried from the same position, so the transfer continues where it was interrupted
+        return self._retry.call(
+            lambda: self._read_into(chunks, view, position),
+            description=description,
+            timings=timings,
+            stop=self._stop,
+        )
+
+    @staticmethod
+    def _read_into(chunks: ChunkTracker, view: memoryview, position: int) -> int:
+        """Fill `view` with the data of the stream at `position`, returns the number of bytes read.
+
+        Unlike librespot's `read()`, which allocates and copies into a new
+        `BytesIO` on every call, the data is copied straight from the chunk
+        buffers into `view`, which can be reused, and a chunk that failed to
+        download raises instead of being waited for forever. The position of
+        the stream itself is not changed.
+        """
+        input_stream = chunks.stream
+        end = min(position + len(view), input_stream.size())
+        filled = 0
+        while position < end:
+            index, offset = divmod(position, ChannelManager.chunk_size)
+            chunks.request(index)
+            chunks.wait(index)
+            chunk = memoryview(input_stream.buffer()[index])
+            size = min(len(chunk) - offset, end - position)
+            view[filled : filled + size] = chunk[offset : offset + size]
+            filled += size
+            position += size
+        return filled
+
+    @staticmethod
+    def _checkpoint(
+        fp: BinaryIO,
+        *,
+        injector: VorbisCommentInjector,
+        partial: PartialDownload | None,
+        resume_filename: pathlib.Path | None,
+    ) -> None:
+        if partial is None or resume_filename is None:
+            return
+        # Data has to reach the file before the sidecar may claim it.
+        fp.flush()
+        partial.offset = fp.tell()
+        partial.source_offset = injector.source_offset
+        partial.sequence_delta = injector.sequence_delta
+        partial.serial = injector.serial
+        partial.save(resume_filename)
+
+    def _bail_condition(self, *, task: TaskID, track: DownloadableTrack, batch_ctx: dict, config: Config) -> bool:
         prefix = ""
-        if track.target_filename.exists() and not self.config.overwrite:
+        if track.target_filename.exists() and not config.overwrite:
             filesize = track.target_filename.stat().st_size
             prefix = "[bar.finished]Exists:[/] "
-        elif self.config.dry_run:
+        elif config.dry_run:
             filesize = 0
             prefix = "[yellow]Dry-run:[/] "
 
         if prefix:
-            self._progress.update(
+            self._progress.finish(
                 task,
                 description=prefix + track.task_description,
                 total=filesize,
                 completed=filesize,
                 visible=True,
             )
+            if track.target_filename.exists():
+                self._record(track=track, batch_ctx=batch_ctx)
             return True
         return False
 
-    def _load_stream(self, track_id: TrackId | EpisodeId, retries: int = 3) -> PlayableContentFeeder.LoadedStream:
-        try:
+    def _skip_indexed(
+        self, *, track: DownloadableTrack, batch: DownloadableBatch, batch_idx: int, batch_size: int
+    ) -> Future[ProcessingResult] | None:
+        if self._index is None or self._config(batch).overwrite:
+            return None
+        scope = self._index.scope(track.originating_type, batch.context, idx=track.position)
+        if (entry := self._index.lookup(track.track_id.hex_id(), scope)) is None:
+            return None
+
+        logger.debug("Found {} in the download index at {}", track.track_id.hex_id(), entry.path)
+        description = entry.description or entry.path.stem
+        if batch_idx == 0:
+            self._progress.print()
+            self._progress.print(f"[bold bright_magenta]Downloading {batch.description or description}[/]\n")
+        task = self._progress.add_task(
+            "[bar.finished]Exists:[/] " + description,
+            total=entry.size,
+            completed=entry.size,
+            batch_idx=batch_idx + 1,
+            batch_size=batch_size,
+        )
+        self._progress.finish(task)
+        job: Future[ProcessingResult] = Future()
+        job.add_done_callback(self._callback)
+        job.set_result(ProcessingResult(track=track))
+        return job
+
+    @property
+    def _quality(self) -> str:
+        return AudioQuality(self.config.quality).name
+
+    def _in_store(self, track: DownloadableTrack, config: Config) -> bool:
+        """Whether the track is, or is about to be, in the content store."""
+        if self._store is None or config.overwrite:
+            return False
+        gid = track.track_id.hex_id()
+        return gid in self._pending or self._store.get(gid, self._quality) is not None
+
+    def _track_pending(self, track: DownloadableTrack, job: Future[ProcessingResult]) -> None:
+        # Later occurrences of the same track wait for this download and link its result.
+        if self._store is None:
+            return
+        gid = track.track_id.hex_id()
+        with self._lock:
+            self._pending[gid] = job
+
+        def _done(_: Future[ProcessingResult]) -> None:
             with self._lock:
-                while retries > 0:
-                    if stream := self._content_feeder.load(track_id, self._quality_picker, False, None):
-                        return stream
-                    retries -= 1
+                if self._pending.get(gid) is job:
+                    del self._pending[gid]
+
+        job.add_done_callback(_done)
+
+    def _link_stored(
+        self,
+        *,
+        track: DownloadableTrack,
+        store: ContentStore,
+        pending: Future[ProcessingResult] | None = None,
+        config: Config,
+        timings: TrackTimings,
+        batch_ctx: dict,
+        batch_idx: int,
+        batch_size: int,
+        batch_description: str | None = None,
+    ) -> ProcessingResult:
+        """Create the target of a track that is already in the content store, without loading its stream.
+
+        If the track is still being downloaded for another batch (`pending`),
+        wait for that download first.
+        """
+        timings.queued()
+        has_header = False
+        result = ProcessingResult(track=track, timings=timings)
+        if batch_idx == 0:
+            self._progress.print()
+        task = self._progress.add_task("", batch_idx=batch_idx + 1, batch_size=batch_size)
+        try:
+            if pending is not None:
+                with suppress(Exception):
+                    pending.result()
+            gid = track.track_id.hex_id()
+            if (stored := store.get(gid, self._quality)) is None:
+                raise StoreError
+            metadata = self._fetcher.track(gid) if isinstance(track.track_id, TrackId) else self._fetcher.episode(gid)
+            track.populate_from_metadata(
+                metadata,
+                destination=self.config.destination,
+                template=self._templates[track.originating_type],
+                ext=stored.suffix.lstrip("."),
+                idx=track.position or batch_idx + 1,
+                **batch_ctx,
+            )
+            self._print_header(track=track, batch_idx=batch_idx, batch_description=batch_description)
+            has_header = True
+
+            if self._bail_condition(task=task, track=track, batch_ctx=batch_ctx, config=config):
+                return result
+
+            size = stored.stat().st_size
+            with timings.measure(Phase.FINALIZE):
+                store.link(stored, track.target_filename)
+                if self._index is not None:
+                    track.sha256 = self._stored_checksum(self._index, gid, stored, size)
+                self._record(track=track, batch_ctx=batch_ctx)
+            self._progress.finish(
+                task,
+                description="[bar.finished]Linked:[/] " + track.task_description,
+                total=size,
+                completed=size,
+            )
         except Exception as exc:
-            if isinstance(exc, ApiClient.StatusCodeException) and exc.code == HTTPStatus.UNAVAILABLE_FOR_LEGAL_REASONS:
-                raise ContentUnavailableError from exc
-            raise StreamError from exc
-        raise StreamError
+            self._handle_failure(result, task=task, exc=exc, has_header=has_header)
+
+        return result
+
+    def _stored_checksum(self, index: DownloadIndex, gid: str, stored: pathlib.Path, size: int) -> str:
+        # The copy in the store was usually recorded when it was downloaded, under another scope
+        if (sha256 := index.checksum(gid, size)) is not None:
+            return sha256
+        digest = hashlib.sha256()
+        with stored.open("rb") as fp:
+            self._hash_file(fp, digest)
+        return digest.hexdigest()
+
+    def _record(self, *, track: DownloadableTrack, batch_ctx: dict) -> None:
+        if self._index is None:
+            return
+        self._index.add(
+            IndexEntry(
+                gid=track.track_id.hex_id(),
+                scope=self._index.scope(track.originating_type, batch_ctx, idx=track.position),
+                path=track.target_filename,
+                size=track.target_filename.stat().st_size,
+                quality=self._quality,
+                description=track.task_description,
+                sha256=track.sha256,
+            )
+        )
+
+    def _acquire_window(self, results: _ResultQueue) -> Generator[ProcessingResult, None, bool]:
+        # Hands out results that complete while waiting for a free slot.
+        while not self._stop.is_set():
+            if self._window.acquire(timeout=0.5):
+                return True
+            yield from results.ready()
+        return False
 
     def _callback(self, result: Future[ProcessingResult] | ProcessingResult) -> None:
         if isinstance(result, Future):
@@ -210,9 +801,16 @@ class BatchProcessor:
                 return
             if exc := result.exception():
                 logger.error("Unexpected failure", exc_info=exc)
+                self.metrics.add_failure(exc)
                 return self._mark_failure()
             result = result.result()
 
+        self.metrics.add(result)
+        if self.on_result is not None:
+            self.on_result(result)
+        if result.interrupted:
+            # Stopped by a shutdown, the download neither succeeded nor failed
+            return None
         if not (exc := result.exception):
             return self._mark_success()
 
@@ -225,3 +823,52 @@ class BatchProcessor:
     def _mark_failure(self) -> None:
         with self._lock:
             self.failures += 1
+
+
+class _ResultQueue:
+    """Collects the futures of a batch and hands out their results.
+
+    Results are returned as soon as their future completes, or in the order
+    the futures were added if `ordered` is set. Cancelled futures (e.g. after
+    a shutdown) are skipped.
+    """
+
+    _ordered: bool
+    _pending: deque[Future[ProcessingResult]]
+    _done: SimpleQueue[Future[ProcessingResult]]
+    _outstanding: int = 0
+
+    def __init__(self, ordered: bool = False) -> None:
+        self._ordered = ordered
+        self._pending = deque()
+        self._done = SimpleQueue()
+
+    def add(self, future: Future[ProcessingResult]) -> None:
+        if self._ordered:
+            self._pending.append(future)
+        else:
+            self._outstanding += 1
+            future.add_done_callback(self._done.put)
+
+    def ready(self) -> Iterator[ProcessingResult]:
+        """Yield the results that are available without blocking."""
+        if self._ordered:
+            while self._pending and self._pending[0].done():
+                yield from self._result(self._pending.popleft())
+            return
+        while not self._done.empty():
+            self._outstanding -= 1
+            yield from self._result(self._done.get())
+
+    def remaining(self) -> Iterator[ProcessingResult]:
+        """Yield all outstanding results, waiting for them to complete."""
+        while self._pending:
+            yield from self._result(self._pending.popleft())
+        while self._outstanding:
+            self._outstanding -= 1
+            yield from self._result(self._done.get())
+
+    @staticmethod
+    def _result(future: Future[ProcessingResult]) -> Iterator[ProcessingResult]:
+        if not future.cancelled():
+            yield future.result()
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import sqlite3
+from datetime import timedelta
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import TypeVar
+
+from google.protobuf.message import Message
+
+from .enums import ItemType
+from .logging import logger
+
+MessageType = TypeVar("MessageType", bound=Message)
+
+DEFAULT_TTLS: dict[ItemType, timedelta] = {
+    ItemType.TRACK: timedelta(days=30),
+    ItemType.EPISODE: timedelta(days=30),
+    ItemType.ALBUM: timedelta(days=7),
+    ItemType.ARTIST: timedelta(days=1),
+    ItemType.SHOW: timedelta(hours=1),
+    ItemType.PLAYLIST: timedelta(minutes=15),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    revision BLOB,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE INDEX IF NOT EXISTS metadata_accessed_at ON metadata (accessed_at);
+"""
+
+
+class MetadataCache:
+    """SQLite-backed cache of serialized metadata protobufs, keyed by item type and GID.
+
+    Entries expire after a per-type TTL. Playlists additionally carry their
+    revision, so callers holding a newer revision can treat a cached entry as
+    stale. Once the cache grows beyond `max_size` bytes, the least recently
+    used entries are evicted.
+    """
+
+    path: Path
+    ttls: dict[ItemType, timedelta]
+    max_size: int
+    refresh: bool
+
+    _conn: sqlite3.Connection
+    _lock: Lock
+    _writes: int = 0
+
+    _EVICTION_INTERVAL = 64
+
+    def __init__(
+        self,
+        path: Path,
+        max_size: int = 256 * 1024**2,
+        ttls: dict[ItemType, timedelta] | None = None,
+        refresh: bool = False,
+    ) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.refresh = refresh
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def get(
+        self, kind: ItemType, key: str, message_type: type[MessageType], revision: bytes | None = None
+    ) -> MessageType | None:
+        if self.refresh:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, revision, fetched_at FROM metadata WHERE kind = ? AND key = ?", (kind.value, key)
+            ).fetchone()
+            if row is None:
+                return None
+            data, cached_revision, fetched_at = row
+            now = time()
+            if now - fetched_at > self.ttls[kind].total_seconds() or (
+                revision is not None and revision != cached_revision
+            ):
+                logger.debug("Cached {} {} is stale", kind, key)
+                return None
+            self._conn.execute("UPDATE metadata SET accessed_at = ? WHERE kind = ? AND key = ?", (now, kind.value, key))
+        return message_type.FromString(data)
+
+    def put(self, kind: ItemType, key: str, message: Message, revision: bytes | None = None) -> None:
+        data = message.SerializeToString()
+        now = time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO metadata (kind, key, revision, data, size, fetched_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind.value, key, revision, data, len(data), now, now),
+            )
+            self._writes += 1
+            if self._writes % self._EVICTION_INTERVAL == 0:
+                self._evict()
+
+    def revision(self, kind: ItemType, key: str) -> bytes | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT revision FROM metadata WHERE kind = ? AND key = ?", (kind.value, key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def invalidate(self, kind: ItemType, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM metadata WHERE kind = ? AND key = ?", (kind.value, key))
+
+    def close(self) -> None:
+        with self._lock:
+            self._evict()
+            self._conn.close()
+
+    def _evict(self) -> None:
+        (total,) = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM metadata").fetchone()
+        if total <= self.max_size:
+            return
+        excess = total - self.max_size
+        victims: list[tuple[str, str]] = []
+        freed = 0
+        for kind, key, size in self._conn.execute("SELECT kind, key, size FROM metadata ORDER BY accessed_at ASC"):
+            if freed >= excess:
+                break
+            victims.append((kind, key))
+            freed += size
+        self._conn.executemany("DELETE FROM metadata WHERE kind = ? AND key = ?", victims)
+        logger.debug("Evicted {} cached metadata entries ({} bytes)", len(victims), freed)
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+from threading import Condition
+from typing import Any, Callable
+
+from librespot.audio import AbsChunkedInputStream
+
+from .logging import logger
+
+
+class ChunkTracker:
+    """Notices when a chunk of one of librespot's streams fails to download.
+
+    librespot requests chunks on an executor that swallows their exceptions,
+    and `AbsChunkedInputStream.check_availability()` waits until a chunk is
+    available, so a single failed request would stall its reader forever.
+    Instead, the streamer's `request_chunk()` is wrapped: a chunk whose
+    request failed is no longer marked as requested, and its error is raised
+    to the reader waiting for it, which can retry by requesting it again.
+    """
+
+    stream: AbsChunkedInputStream
+
+    _condition: Condition
+    # Errors of failed chunks by index, until they were raised to a reader
+    _errors: dict[int, Exception]
+    # Called from librespot's threads whenever a chunk arrives or fails
+    _listeners: list[Callable[[], None]]
+
+    def __init__(self, streamer: Any) -> None:
+        self.stream = stream = streamer.stream()
+        self._condition = Condition()
+        self._errors = {}
+        self._listeners = []
+        notify_chunk_available = stream.notify_chunk_available
+
+        def _notify_chunk_available(index: int) -> None:
+            notify_chunk_available(index)
+            self._report(index)
+
+        stream.notify_chunk_available = _notify_chunk_available
+        # Streams of external episodes aren't fetched in chunks
+        if (request_chunk := getattr(streamer, "request_chunk", None)) is None:
+            return
+
+        def _request_chunk(index: int) -> None:
+            try:
+                request_chunk(index)
+            except Exception as exc:
+                logger.debug("Request of chunk {} failed: {!r}", index, exc)
+                self._report(index, exc)
+
+        streamer.request_chunk = _request_chunk
+
+    @classmethod
+    def of(cls, streamer: Any) -> ChunkTracker:
+        """Return the tracker of `streamer` (a loaded stream's `input_stream`), which is created on first use."""
+        if (tracker := getattr(streamer, "_despot_chunks", None)) is None:
+            tracker = streamer._despot_chunks = cls(streamer)
+        return tracker
+
+    def subscribe(self, listener: Callable[[], None]) -> None:
+        self._listeners.append(listener)
+
+    def request(self, index: int) -> None:
+        """Request chunk `index` unless it's available or requested already, forgetting an earlier failure."""
+        with self._condition:
+            requested = self.stream.requested_chunks()
+            if requested[index] or self.stream.available_chunks()[index]:
+                return
+            requested[index] = True
+            self._errors.pop(index, None)
+        self.stream.request_chunk_from_stream(index)
+
+    def check(self, index: int) -> bool:
+        """Whether chunk `index` is available, raises the error of its request if that failed."""
+        if self.stream.available_chunks()[index]:
+            return True
+        with self._condition:
+            error = self._errors.pop(index, None)
+        if error is not None:
+            raise error
+        return False
+
+    def wait(self, index: int) -> None:
+        """Block until chunk `index` is available, raises the error of its request if that failed."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.check(index))
+
+    def _report(self, index: int, error: Exception | None = None) -> None:
+        with self._condition:
+            if error is None:
+                self._errors.pop(index, None)
+            else:
+                # The next reader of the chunk requests it again
+                self.stream.requested_chunks()[index] = False
+                self._errors[index] = error
+            self._condition.notify_all()
+        for listener in self._listeners:
+            listener()
@@ -1,22 +1,23 @@
 import pathlib
-from typing import Any
+import sys
+from typing import Any, Iterator, TextIO
 
 import rich_click as click
-from librespot.audio.decoders import AudioQuality
+from rich import get_console
 
 from . import __name__ as name
 from . import __version__ as version
-from .base import Despot
 from .config import DEFAULT_CONFIG, Config
-from .constants import ENVVAR_PREFIX
-from .enums import ItemType
-from .logging import configure_logging
+from .constants import AUDIO_QUALITIES, DATETIME_FORMAT, ENVVAR_PREFIX, SERVE_HOST, SERVE_PORT
+from .enums import Engine, ItemType, LinkMode, ProfileMode, ProgressMode
+from .exceptions import FilenameTemplateError
+from .templates import DEFAULT_TEMPLATES, compile_templates
 
 click.rich_click.USE_RICH_MARKUP = True
 click.rich_click.USE_MARKDOWN = True
 click.rich_click.OPTIONS_PANEL_TITLE = "Miscellaneous Options"
 click.rich_click.OPTION_GROUPS = {
-    name: [
+    f"{name} download": [
         {
             "name": "Basic parameters",
             "options": [
@@ -24,6 +25,8 @@ click.rich_click.OPTION_GROUPS = {
                 "--password",
                 "--destination",
                 "--quality",
+                "--input-file",
+                "--template",
             ],
         },
         {
@@ -34,34 +37,143 @@ click.rich_click.OPTION_GROUPS = {
             "name": "Podcasts-specific options",
             "options": [
                 "--newest-first",
+                "--since",
+                "--latest",
             ],
         },
         {
             "name": "Processing parameters",
             "options": [
+                "--sync",
                 "--paranoia",
                 "--overwrite",
+                "--resume",
+                "--engine",
                 "--concurrency",
+                "--lookahead",
+                "--retries",
+                "--retry-delay",
+                "--finalize-workers",
+                "--metadata-concurrency",
+                "--block-size",
+                "--preallocate",
+                "--ordered",
+                "--progress",
             ],
         },
-    ]
+        {
+            "name": "Metadata cache",
+            "options": [
+                "--cache",
+                "--refresh",
+                "--cache-size",
+            ],
+        },
+        {
+            "name": "Download index",
+            "options": [
+                "--index",
+            ],
+        },
+        {
+            "name": "Content store",
+            "options": [
+                "--store",
+                "--link-mode",
+            ],
+        },
+        {
+            "name": "Metrics and profiling",
+            "options": [
+                "--metrics-json",
+                "--metrics-textfile",
+                "--profile",
+                "--profile-mode",
+            ],
+        },
+    ],
+    f"{name} serve": [
+        {
+            "name": "Basic parameters",
+            "options": [
+                "--username",
+                "--password",
+                "--destination",
+                "--quality",
+                "--template",
+            ],
+        },
+        {
+            "name": "Server",
+            "options": [
+                "--host",
+                "--port",
+                "--socket",
+            ],
+        },
+        {
+            "name": "Processing parameters",
+            "options": [
+                "--engine",
+                "--concurrency",
+                "--lookahead",
+                "--retries",
+                "--retry-delay",
+                "--finalize-workers",
+            ],
+        },
+    ],
+}
+CONTEXT_SETTINGS = {
+    "auto_envvar_prefix": ENVVAR_PREFIX,
+    "help_option_names": ["-h", "--help"],
 }
 
 
-@click.command(
-    context_settings={
-        "auto_envvar_prefix": ENVVAR_PREFIX,
-        "help_option_names": ["-h", "--help"],
-    },
+class DefaultCommandGroup(click.RichGroup):
+    """Group that falls back to the `download` command, so `despot LINKS...` keeps working."""
+
+    default_command = "download"
+
+    def parse_args(self, ctx: click.Context, args: list[str]) -> list[str]:
+        if args and args[0] not in self.commands and args[0] not in (*ctx.help_option_names, "-V", "--version"):
+            args = [self.default_command, *args]
+        return super().parse_args(ctx, args)
+
+
+@click.group(
+    cls=DefaultCommandGroup,
+    context_settings=CONTEXT_SETTINGS,
     help=f"Download music from that green streaming service using the sharing link of any {ItemType.human_names()}.",
     no_args_is_help=True,
 )
-@click.argument(
-    "links",
-    nargs=-1,
-    required=True,
+@click.version_option(
+    version,
+    "-V",
+    "--version",
+    prog_name=name,
 )
-@click.option(
+def main() -> None:
+    pass
+
+
+destination_option = click.option(
+    "-d",
+    "--destination",
+    type=click.Path(
+        exists=False,
+        writable=True,
+        file_okay=False,
+        dir_okay=True,
+        path_type=pathlib.Path,
+    ),
+    show_default=True,
+    required=False,
+    default=DEFAULT_CONFIG.destination,
+    show_envvar=True,
+    help="Directory to which to download the files",
+)
+username_option = click.option(
     "-u",
     "--username",
     required=True,
@@ -69,7 +181,7 @@ click.rich_click.OPTION_GROUPS = {
     show_envvar=True,
     help="Your username on that green streaming service",
 )
-@click.option(
+password_option = click.option(
     "-p",
     "--password",
     required=True,
@@ -79,32 +191,146 @@ click.rich_click.OPTION_GROUPS = {
     show_envvar=True,
     help="Your password on that green streaming service",
 )
-@click.option(
-    "-d",
-    "--destination",
-    type=click.Path(
-        exists=False,
-        writable=True,
-        file_okay=False,
-        dir_okay=True,
-        path_type=pathlib.Path,
-    ),
-    show_default=True,
-    required=False,
-    default=DEFAULT_CONFIG.destination,
-    show_envvar=True,
-    help="Directory to which to download the files",
-)
-@click.option(
+quality_option = click.option(
     "-q",
     "--quality",
-    type=click.Choice([str(q) for q in AudioQuality], case_sensitive=False),
+    type=click.Choice(AUDIO_QUALITIES, case_sensitive=False),
     default=DEFAULT_CONFIG.quality,
     show_default=True,
-    callback=lambda ctx, param, value: AudioQuality(value),
     show_envvar=True,
     help="Audio quality to download",
 )
+engine_option = click.option(
+    "--engine",
+    type=click.Choice([str(e) for e in Engine], case_sensitive=False),
+    default=str(DEFAULT_CONFIG.engine),
+    show_default=True,
+    callback=lambda ctx, param, value: Engine(value),
+    show_envvar=True,
+    help="Run downloads on a pool of threads or as coroutines on an asyncio event loop (cheap at high concurrency)",
+)
+
+
+def _parse_concurrency(ctx: click.Context, param: click.Parameter, value: str) -> int | None:
+    if value == "auto":
+        return None
+    try:
+        concurrency = int(value)
+    except ValueError:
+        raise click.BadParameter(f"Expected a number or 'auto': {value}") from None
+    if concurrency < 1:
+        raise click.BadParameter(f"Expected at least one download: {value}")
+    return concurrency
+
+
+concurrency_option = click.option(
+    "-c",
+    "--concurrency",
+    metavar="N|auto",
+    default=str(DEFAULT_CONFIG.concurrency),
+    callback=_parse_concurrency,
+    show_default=True,
+    show_envvar=True,
+    help=(
+        "Maximum number of simultaneous downloads. 'auto' adjusts it while downloading,"
+        " adding downloads while throughput grows and backing off when they slow each other down"
+    ),
+)
+lookahead_option = click.option(
+    "-l",
+    "--lookahead",
+    type=click.IntRange(min=0),
+    default=DEFAULT_CONFIG.lookahead,
+    show_default=True,
+    show_envvar=True,
+    help="Number of upcoming tracks whose streams are resolved ahead of the downloads",
+)
+retries_option = click.option(
+    "--retries",
+    type=click.IntRange(min=0),
+    default=DEFAULT_CONFIG.retries,
+    show_default=True,
+    show_envvar=True,
+    help="Retries of a stream load or chunk transfer that failed for a transient reason, e.g. a network error",
+)
+retry_delay_option = click.option(
+    "--retry-delay",
+    type=click.FloatRange(min=0),
+    default=DEFAULT_CONFIG.retry_delay,
+    show_default=True,
+    show_envvar=True,
+    help="Seconds before the first retry, later ones wait exponentially longer with random jitter",
+)
+finalize_workers_option = click.option(
+    "--finalize-workers",
+    type=click.IntRange(min=1),
+    default=DEFAULT_CONFIG.finalize_workers,
+    show_default=True,
+    show_envvar=True,
+    help="Threads that tag and move completed downloads into place while the download workers go on",
+)
+
+
+def _parse_templates(ctx: click.Context, param: click.Parameter, value: tuple[str, ...]) -> dict[ItemType, str]:
+    templates = {}
+    for option in value:
+        item_type, sep, template = option.partition("=")
+        if not sep or item_type not in [str(t) for t in ItemType]:
+            raise click.BadParameter(f"Expected TYPE=TEMPLATE with TYPE one of {ItemType.human_names()}: {option}")
+        templates[ItemType(item_type)] = template
+    try:
+        compile_templates(templates)
+    except FilenameTemplateError as exc:
+        raise click.BadParameter(str(exc)) from exc
+    return templates
+
+
+template_option = click.option(
+    "-t",
+    "--template",
+    "templates",
+    metavar="TYPE=TEMPLATE",
+    multiple=True,
+    callback=_parse_templates,
+    help=(
+        "Filename template for downloads of a link type, e.g. 'album={album_artist}/{album}/{track:02d} {name}.{ext}'."
+        " Artists use the album template and shows the episode template unless given their own. Defaults: "
+        + "; ".join(f"{item_type}={template}" for item_type, template in DEFAULT_TEMPLATES.items())
+    ),
+)
+debug_option = click.option(
+    "-D",
+    "--debug",
+    type=bool,
+    default=DEFAULT_CONFIG.debug,
+    is_flag=True,
+    help="Emit detailed diagnostic logging",
+)
+
+
+@main.command(
+    context_settings=CONTEXT_SETTINGS,
+    help=f"Download music from that green streaming service using the sharing link of any {ItemType.human_names()}.",
+    no_args_is_help=True,
+)
+@click.argument(
+    "links",
+    nargs=-1,
+    required=False,
+)
+@click.option(
+    "-i",
+    "--input-file",
+    "input_files",
+    type=click.File("r", encoding="utf-8", lazy=True),
+    multiple=True,
+    help="Read links from a file, one per line, '-' for stdin. Blank lines and lines starting with '#' are ignored.",
+)
+@username_option
+@password_option
+@destination_option
+@quality_option
+@template_option
 @click.option(
     "-P",
     "--paranoia",
@@ -123,6 +349,13 @@ click.rich_click.OPTION_GROUPS = {
     show_envvar=True,
     help="Overwrite existing files",
 )
+@click.option(
+    "--resume/--no-resume",
+    default=DEFAULT_CONFIG.resume,
+    show_default=True,
+    show_envvar=True,
+    help="Keep unfinished downloads and continue them on the next run",
+)
 @click.option(
     "-nf",
     "--newest-first",
@@ -133,30 +366,165 @@ click.rich_click.OPTION_GROUPS = {
     help="Download episodes in descending order of publishing instead of ascending",
 )
 @click.option(
-    "-c",
-    "--concurrency",
-    type=int,
-    default=DEFAULT_CONFIG.concurrency,
+    "--since",
+    type=click.DateTime(formats=[DATETIME_FORMAT]),
+    default=DEFAULT_CONFIG.since,
+    callback=lambda ctx, param, value: value and value.date(),
+    show_envvar=True,
+    help="Only download episodes published on or after this date",
+)
+@click.option(
+    "--latest",
+    type=click.IntRange(min=1),
+    default=DEFAULT_CONFIG.latest,
+    show_envvar=True,
+    help="Only download the latest N episodes of each show",
+)
+@click.option(
+    "--sync",
+    type=bool,
+    default=DEFAULT_CONFIG.sync,
+    is_flag=True,
+    show_envvar=True,
+    help=(
+        "Remember what was downloaded from each show and playlist, and only download the items that are new since"
+        " the last --sync run. Unchanged playlists are skipped without listing them."
+    ),
+)
+@engine_option
+@concurrency_option
+@lookahead_option
+@retries_option
+@retry_delay_option
+@finalize_workers_option
+@click.option(
+    "--metadata-concurrency",
+    type=click.IntRange(min=1),
+    default=DEFAULT_CONFIG.metadata_concurrency,
     show_default=True,
     show_envvar=True,
-    help="Maximum number of simultaneous downloads",
+    help="Maximum number of simultaneous metadata lookups while expanding artists and playlists",
 )
 @click.option(
-    "-n",
-    "--dry-run",
+    "--block-size",
+    type=click.IntRange(min=4),
+    default=DEFAULT_CONFIG.block_size,
+    show_default=True,
+    show_envvar=True,
+    help="Size in KiB of the blocks in which streams are read and files are written, larger blocks mean fewer writes",
+)
+@click.option(
+    "--preallocate/--no-preallocate",
+    default=DEFAULT_CONFIG.preallocate,
+    show_default=True,
+    show_envvar=True,
+    help="Reserve the disk space of each file before downloading it, which keeps files on spinning disks contiguous",
+)
+@click.option(
+    "--ordered",
     type=bool,
-    default=DEFAULT_CONFIG.dry_run,
+    default=DEFAULT_CONFIG.ordered,
     is_flag=True,
-    help="Don't actually download files",
+    show_envvar=True,
+    help="Report results in the order of the batch instead of as soon as each download completes",
 )
 @click.option(
-    "-D",
-    "--debug",
+    "--progress",
+    type=click.Choice([str(m) for m in ProgressMode], case_sensitive=False),
+    default=str(DEFAULT_CONFIG.progress),
+    show_default=True,
+    callback=lambda ctx, param, value: ProgressMode(value),
+    show_envvar=True,
+    help="Show a row for every download (full), only for running ones plus a summary row (summary) or nothing (none)",
+)
+@click.option(
+    "--cache/--no-cache",
+    default=DEFAULT_CONFIG.cache,
+    show_default=True,
+    show_envvar=True,
+    help="Keep fetched metadata in an on-disk cache and reuse it across runs",
+)
+@click.option(
+    "--refresh",
     type=bool,
-    default=DEFAULT_CONFIG.debug,
+    default=DEFAULT_CONFIG.refresh,
     is_flag=True,
-    help="Emit detailed diagnostic logging",
+    show_envvar=True,
+    help="Ignore cached metadata, but store freshly fetched metadata in the cache",
+)
+@click.option(
+    "--cache-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_CONFIG.cache_size,
+    show_default=True,
+    show_envvar=True,
+    help="Maximum size of the metadata cache in MiB, least recently used entries are evicted first",
 )
+@click.option(
+    "--index/--no-index",
+    default=DEFAULT_CONFIG.index,
+    show_default=True,
+    show_envvar=True,
+    help="Keep an index of downloaded files in the destination directory to skip them without loading their streams",
+)
+@click.option(
+    "--store",
+    type=click.Path(exists=False, writable=True, file_okay=False, dir_okay=True, path_type=pathlib.Path),
+    default=DEFAULT_CONFIG.store,
+    show_envvar=True,
+    help=(
+        "Keep a single copy of every track in this directory (e.g. DESTINATION/.despot-store) and link it into each"
+        " album or playlist it appears in, instead of downloading it again"
+    ),
+)
+@click.option(
+    "--link-mode",
+    type=click.Choice([str(m) for m in LinkMode], case_sensitive=False),
+    default=str(DEFAULT_CONFIG.link_mode),
+    show_default=True,
+    callback=lambda ctx, param, value: LinkMode(value),
+    show_envvar=True,
+    help="How files in the content store are linked into place, hardlinks and reflinks fall back to copies",
+)
+@click.option(
+    "--metrics-json",
+    type=click.Path(dir_okay=False, writable=True, path_type=pathlib.Path),
+    default=DEFAULT_CONFIG.metrics_json,
+    show_envvar=True,
+    help="Write a JSON summary of the run with per-phase timings, throughput and failures to this file",
+)
+@click.option(
+    "--metrics-textfile",
+    type=click.Path(dir_okay=False, writable=True, path_type=pathlib.Path),
+    default=DEFAULT_CONFIG.metrics_textfile,
+    show_envvar=True,
+    help="Write the same metrics in the Prometheus text format, e.g. for node_exporter's textfile collector",
+)
+@click.option(
+    "--profile",
+    type=click.Path(dir_okay=False, writable=True, path_type=pathlib.Path),
+    help=(
+        "Profile all threads of the run and write the result to this file, as collapsed stacks for flamegraphs"
+        " or as pstats, depending on --profile-mode"
+    ),
+)
+@click.option(
+    "--profile-mode",
+    type=click.Choice([str(m) for m in ProfileMode], case_sensitive=False),
+    default=str(ProfileMode.SAMPLE),
+    show_default=True,
+    callback=lambda ctx, param, value: ProfileMode(value),
+    help="Sample stacks at a fixed interval (low overhead) or trace every call with cProfile",
+)
+@click.option(
+    "-n",
+    "--dry-run",
+    type=bool,
+    default=DEFAULT_CONFIG.dry_run,
+    is_flag=True,
+    help="Don't actually download files",
+)
+@debug_option
 @click.option(
     "-F",
     "--fail-early",
@@ -165,18 +533,218 @@ click.rich_click.OPTION_GROUPS = {
     is_flag=True,
     help="Abort at the first error. Useful together with --debug.",
 )
-@click.version_option(
-    version,
-    "-V",
-    "--version",
-    prog_name=name,
+@click.pass_context
+def download(
+    ctx: click.RichContext,
+    links: tuple[str, ...],
+    input_files: tuple[TextIO, ...],
+    profile: pathlib.Path | None,
+    profile_mode: ProfileMode,
+    **kwargs: Any,
+) -> int:
+    if not links and not input_files:
+        raise click.UsageError("Pass at least one link or --input-file.")
+    # Imported here, so that --help, --version and usage errors don't pay for librespot and friends
+    from .base import Despot
+    from .logging import configure_logging
+    from .profiling import profiling
+
+    config = Config(**kwargs)
+    configure_logging(config.debug)
+    with profiling(profile, profile_mode, console=ctx.console or get_console()):
+        d = Despot(config, ctx=ctx)
+        for _ in d.iter_download(_iter_links(links, input_files)):
+            pass
+    return d.failures
+
+
+def _iter_links(links: tuple[str, ...], input_files: tuple[TextIO, ...]) -> Iterator[str]:
+    from .utils import read_links
+
+    # Consumed lazily while downloading, so huge lists and pipes never have to be read up front.
+    for link in links:
+        if link == "-":
+            yield from read_links(sys.stdin)
+        else:
+            yield link
+    for input_file in input_files:
+        with input_file:
+            yield from read_links(input_file)
+
+
+@main.command(
+    context_settings=CONTEXT_SETTINGS,
+    help=(
+        "Rebuild the download index from the files in the destination directory.\n\n"
+        "Only files tagged with the ID of their track are indexed, which despot does since it keeps an index. Older"
+        " files, and files whose path matches none of the filename templates, are skipped and listed with --debug."
+        " Running their links again records them in the index without downloading them, but a later reindex skips"
+        " them again."
+    ),
+)
+@destination_option
+@template_option
+@debug_option
+@click.pass_context
+def reindex(ctx: click.RichContext, destination: pathlib.Path, templates: dict[ItemType, str], debug: bool) -> None:
+    from .index import DownloadIndex
+    from .logging import configure_logging
+
+    configure_logging(debug)
+    console = ctx.console or get_console()
+    index = DownloadIndex(destination, compile_templates(templates))
+    try:
+        with console.status(f"Indexing {destination}"):
+            count, skipped = index.rebuild()
+    finally:
+        index.close()
+    console.print(f"[bar.finished]Indexed {count} file{'s' if count != 1 else ''}.")
+    if skipped:
+        console.print(
+            f"[yellow]Skipped {len(skipped)} file{'s' if len(skipped) != 1 else ''} without a track ID or a matching"
+            " filename template, run with --debug to list them."
+        )
+
+
+@main.command(
+    context_settings=CONTEXT_SETTINGS,
+    help=(
+        "Check the files in the destination directory against the download index.\n\n"
+        "Reports files that are missing, truncated, have corrupted Ogg pages or don't match the checksum recorded"
+        " when they were downloaded. Files that were reindexed rather than downloaded have no checksum."
+    ),
 )
+@destination_option
+@click.option(
+    "--workers",
+    "-w",
+    type=click.IntRange(min=1),
+    default=None,
+    show_envvar=True,
+    help="Number of processes that read files  [default: number of CPUs]",
+)
+@click.option(
+    "--requeue",
+    is_flag=True,
+    show_envvar=True,
+    help=(
+        "Delete broken files and forget them in the download index, the content store and the sync state, so that"
+        " the next run of their links downloads them again"
+    ),
+)
+@click.option(
+    "--store",
+    type=click.Path(exists=False, file_okay=False, dir_okay=True, path_type=pathlib.Path),
+    default=DEFAULT_CONFIG.store,
+    show_envvar=True,
+    help="Content store the files are linked from, to remove broken copies with --requeue",
+)
+@debug_option
 @click.pass_context
-def main(ctx: click.RichContext, links: list[str], **kwargs: Any) -> int:
+def verify(
+    ctx: click.RichContext,
+    destination: pathlib.Path,
+    workers: int | None,
+    requeue: bool,
+    store: pathlib.Path | None,
+    debug: bool,
+) -> None:
+    from .constants import CACHE_HOME
+    from .index import INDEX_FILENAME, DownloadIndex
+    from .logging import configure_logging
+    from .store import ContentStore
+    from .sync import SYNC_FILENAME, SyncState
+    from .verify import verify as verify_files
+
+    configure_logging(debug)
+    console = ctx.console or get_console()
+    if not (destination / INDEX_FILENAME).is_file():
+        # Opening the index would create an empty one, and with it the destination
+        raise click.BadParameter(
+            f"No download index in {destination}, create one with `despot reindex`.", param_hint="'--destination'"
+        )
+    index = DownloadIndex(destination)
+    sync = SyncState(CACHE_HOME / SYNC_FILENAME) if requeue and (CACHE_HOME / SYNC_FILENAME).exists() else None
+    broken = 0
+    try:
+        entries = index.entries()
+        with console.status(f"Verifying {len(entries)} files in {destination}"):
+            for entry, problem in verify_files(entries, workers=workers):
+                if problem is None:
+                    continue
+                broken += 1
+                console.print(f"[bold red]{problem}:[/] {entry.path.relative_to(destination)}")
+                if not requeue:
+                    continue
+                entry.path.unlink(missing_ok=True)
+                index.remove(entry)
+                if store and entry.quality:
+                    ContentStore(store).remove(entry.gid, entry.quality)
+                if sync:
+                    sync.forget(entry.gid)
+    finally:
+        index.close()
+        if sync:
+            sync.close()
+    summary = f"Verified {len(entries)} file{'s' if len(entries) != 1 else ''}"
+    if not broken:
+        console.print(f"[bar.finished]{summary}, all intact.")
+    else:
+        console.print(f"[bold red]{summary}, {broken} broken{' and requeued' if requeue else ''}.")
+    ctx.exit(1 if broken else 0)
+
+
+@main.command(
+    context_settings=CONTEXT_SETTINGS,
+    help=(
+        "Keep a session and the download workers running and accept jobs over HTTP.\n\n"
+        '`POST /jobs` with `{"links": [...], "options": {...}}` queues a job and streams its results back as JSON'
+        " lines, `GET /status` reports the running jobs and metrics. Jobs may set `overwrite`, `dry_run` and"
+        " `newest_first`, everything else is fixed when the server starts."
+    ),
+)
+@username_option
+@password_option
+@destination_option
+@quality_option
+@template_option
+@click.option(
+    "--host",
+    type=str,
+    default=SERVE_HOST,
+    show_default=True,
+    show_envvar=True,
+    help="Address to listen on",
+)
+@click.option(
+    "--port",
+    type=click.IntRange(min=0, max=65535),
+    default=SERVE_PORT,
+    show_default=True,
+    show_envvar=True,
+    help="Port to listen on, 0 for any free port",
+)
+@click.option(
+    "--socket",
+    type=click.Path(dir_okay=False, writable=True, path_type=pathlib.Path),
+    show_envvar=True,
+    help="Listen on this UNIX socket instead of a TCP port",
+)
+@engine_option
+@concurrency_option
+@lookahead_option
+@retries_option
+@retry_delay_option
+@finalize_workers_option
+@debug_option
+@click.pass_context
+def serve(ctx: click.RichContext, host: str, port: int, socket: pathlib.Path | None, **kwargs: Any) -> None:
+    from .logging import configure_logging
+    from .server import DespotServer
+
     config = Config(**kwargs)
     configure_logging(config.debug)
-    d = Despot(config, ctx=ctx)
-    return d.download(links)[0]
+    DespotServer(config, ctx=ctx).serve(host=host, port=port, unix_socket=socket)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import asyncio
+from threading import Condition, Lock
+from time import perf_counter
+from typing import Callable
+
+from .constants import (
+    AUTO_CONCURRENCY_DECREASE,
+    AUTO_CONCURRENCY_GAIN,
+    AUTO_CONCURRENCY_INTERVAL,
+    AUTO_CONCURRENCY_LATENCY,
+    AUTO_CONCURRENCY_MAX,
+    AUTO_CONCURRENCY_MIN,
+    AUTO_CONCURRENCY_PROBE,
+    AUTO_CONCURRENCY_START,
+)
+from .logging import logger
+
+
+class ConcurrencyLimit:
+    """A semaphore for threads whose number of slots can change while it's in use.
+
+    Shrinking the limit doesn't interrupt holders of a slot, new ones just
+    wait until enough of them were released.
+    """
+
+    limit: int
+    active: int = 0
+
+    _condition: Condition
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self._condition = Condition()
+
+    def acquire(self, timeout: float | None = None) -> bool:
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.active < self.limit, timeout):
+                return False
+            self.active += 1
+            return True
+
+    def release(self) -> None:
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def resize(self, limit: int) -> None:
+        with self._condition:
+            self.limit = limit
+            self._condition.notify_all()
+
+    def __enter__(self) -> None:
+        self.acquire()
+
+    def __exit__(self, *exc: object) -> None:
+        self.release()
+
+
+class AsyncConcurrencyLimit:
+    """Like `ConcurrencyLimit`, for coroutines of a single event loop."""
+
+    limit: int
+    active: int = 0
+
+    _waiters: set[asyncio.Future[None]]
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self._waiters = set()
+
+    async def acquire(self) -> None:
+        while self.active >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.add(waiter)
+            try:
+                await waiter
+            finally:
+                self._waiters.discard(waiter)
+        self.active += 1
+
+    def release(self) -> None:
+        self.active -= 1
+        self._wake()
+
+    def resize(self, limit: int) -> None:
+        self.limit = limit
+        self._wake()
+
+    def _wake(self) -> None:
+        # Waiters check for a free slot themselves once they run
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def __aenter__(self) -> None:
+        await self.acquire()
+
+    async def __aexit__(self, *exc: object) -> None:
+        self.release()
+
+
+class AdaptiveConcurrency:
+    """Picks the number of simultaneous downloads for `--concurrency auto`.
+
+    Every `AUTO_CONCURRENCY_INTERVAL` seconds, the aggregate throughput of
+    that period is compared with the one before, and the time a single
+    download needs per MiB is compared with the best seen so far:
+
+    * Once the per-download latency grows past `AUTO_CONCURRENCY_LATENCY`
+      times its best, downloads get in each other's way (a saturated link, a
+      throttling server, a thrashing disk) and the limit is cut
+      multiplicatively.
+    * If the limit was raised last time and throughput didn't grow by at least
+      `AUTO_CONCURRENCY_GAIN`, the added download didn't pay off and is taken
+      back.
+    * If throughput grew, another download is added. A steady limit is probed
+      upwards every `AUTO_CONCURRENCY_PROBE` periods to notice when the
+      network got faster.
+
+    Periods in which fewer downloads ran than allowed say nothing about the
+    limit and are ignored.
+    """
+
+    limit: int
+
+    _on_change: Callable[[int], None]
+    _lock: Lock
+    _started: float
+    _bytes: int = 0
+    # Sum and number of samples of the running downloads, for their mean over a period
+    _active_sum: int = 0
+    _active_samples: int = 0
+    _throughput: float | None = None
+    _best_latency: float | None = None
+    _last_change: int = 0
+    _steady: int = 0
+
+    def __init__(self, on_change: Callable[[int], None], limit: int = AUTO_CONCURRENCY_START) -> None:
+        self.limit = limit
+        self._on_change = on_change
+        self._lock = Lock()
+        self._started = perf_counter()
+
+    def transferred(self, size: int, active: int) -> None:
+        """Account `size` bytes that were read while `active` downloads were running."""
+        with self._lock:
+            self._bytes += size
+            self._active_sum += active
+            self._active_samples += 1
+            if (elapsed := perf_counter() - self._started) < AUTO_CONCURRENCY_INTERVAL:
+                return
+            previous = self.limit
+            limit = self._adjust(self._bytes / elapsed, self._active_sum / self._active_samples)
+            self._bytes = self._active_sum = self._active_samples = 0
+            self._started = perf_counter()
+            self._last_change, self.limit = limit - previous, limit
+            if limit == previous:
+                return
+        self._on_change(limit)
+
+    def _adjust(self, throughput: float, active: float) -> int:
+        limit = self.limit
+        if throughput <= 0 or active < limit - 0.5:
+            # Not enough downloads were queued to tell anything
+            self._throughput, self._last_change = None, 0
+            return limit
+
+        # Seconds a single download needed per MiB
+        latency = active * 2**20 / throughput
+        best = self._best_latency = min(self._best_latency or latency, latency)
+        previous, self._throughput = self._throughput, throughput
+        gained = previous is None or throughput >= previous * (1 + AUTO_CONCURRENCY_GAIN)
+        self._steady += 1
+
+        if latency > best * AUTO_CONCURRENCY_LATENCY and limit > AUTO_CONCURRENCY_MIN:
+            new = max(AUTO_CONCURRENCY_MIN, int(limit * AUTO_CONCURRENCY_DECREASE))
+            reason, level = f"per-download latency is {latency / best:.1f}x its best", "INFO"
+            # The congestion may have passed, don't hold on to the old best forever
+            self._best_latency = best * AUTO_CONCURRENCY_DECREASE + latency * (1 - AUTO_CONCURRENCY_DECREASE)
+        elif self._last_change > 0 and not gained:
+            new = limit - 1
+            reason, level = "throughput didn't grow with the last increase", "DEBUG"
+        elif gained or self._steady >= AUTO_CONCURRENCY_PROBE:
+            new = min(AUTO_CONCURRENCY_MAX, limit + 1)
+            reason, level = ("throughput grew", "INFO") if gained else ("probing for more throughput", "DEBUG")
+        else:
+            return limit
+
+        self._steady = 0
+        if new != limit:
+            # Probing and taking a probe back happen all the time, they are only logged for debugging
+            logger.log(
+                level,
+                "Adjusting concurrency from {} to {}: {} ({:.2f} MiB/s, {:.2f}s/MiB per download)",
+                limit,
+                new,
+                reason,
+                throughput / 2**20,
+                latency,
+            )
+        return new
@@ -1,20 +1,55 @@
-from dataclasses import dataclass
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import date
 from pathlib import Path
+from typing import TYPE_CHECKING
+
+from .enums import Engine, ItemType, LinkMode, ProgressMode
 
-from .models import AudioQuality
+if TYPE_CHECKING:
+    from librespot.audio.decoders import AudioQuality
 
 
 @dataclass
 class Config:
     destination: Path = Path("./downloads")
-    quality: AudioQuality = AudioQuality.VERY_HIGH.name
+    quality: AudioQuality | str = "VERY_HIGH"
     debug: bool = False
     fail_early: bool = False
     ipdb: bool = True
     dry_run: bool = False
-    concurrency: int = 4
+    engine: Engine = Engine.THREADS
+    # Simultaneous downloads, `None` adapts them to the measured throughput (`--concurrency auto`)
+    concurrency: int | None = 4
+    lookahead: int = 4
+    metadata_concurrency: int = 8
+    ordered: bool = False
+    progress: ProgressMode = ProgressMode.SUMMARY
+    cache: bool = True
+    cache_size: int = 256
+    refresh: bool = False
+    index: bool = True
+    resume: bool = True
+    store: Path | None = None
+    link_mode: LinkMode = LinkMode.HARDLINK
+    block_size: int = 128
+    # Retries of transient failures, after waiting `retry_delay` seconds and exponentially longer
+    retries: int = 3
+    retry_delay: float = 0.5
+    # Threads that tag and move completed downloads into place
+    finalize_workers: int = 2
+    preallocate: bool = True
+    # Filename templates that replace the defaults, by originating type
+    templates: dict[ItemType, str] = field(default_factory=dict)
+    metrics_json: Path | None = None
+    metrics_textfile: Path | None = None
     overwrite: bool = False
     newest_first: bool = False
+    # Only queue the items of shows and playlists that weren't downloaded by an earlier `sync` run
+    sync: bool = False
+    since: date | None = None
+    latest: int | None = None
     paranoia: bool = False
 
     username: str = ""
@@ -2,7 +2,6 @@ import codecs
 from pathlib import Path
 
 from appdirs import user_cache_dir
-from rich import progress
 
 from . import __name__ as name
 
@@ -13,14 +12,34 @@ CACHE_HOME = Path(user_cache_dir(name, "drunkontee"))
 DATETIME_FORMAT = "%Y-%m-%d"
 
 OGG_HEADER_SIZE = 0xA7
-
-RICH_PROGRESS_COLUMNS = (
-    progress.SpinnerColumn(finished_text="[bar.finished]✔️"),
-    progress.TextColumn("[bar.complete]{task.fields[batch_idx]}/{task.fields[batch_size]}", justify="right"),
-    progress.TextColumn("[progress.description]{task.description}"),
-    progress.BarColumn(bar_width=25),
-    progress.TaskProgressColumn(),
-    progress.TimeRemainingColumn(),
-    progress.DownloadColumn(),
-    progress.TransferSpeedColumn(),
-)
+# Names of librespot's `AudioQuality` members, so the CLI can offer them without importing librespot
+AUDIO_QUALITIES = ("normal", "high", "very_high")
+# Number of chunks after which the resume sidecar of a `.part` file is updated
+RESUME_CHECKPOINT_CHUNKS = 16
+# Minimum number of seconds between two progress updates of the same download
+PROGRESS_INTERVAL = 0.2
+# Threads of the async engine for the few calls that still block
+ASYNC_BLOCKING_WORKERS = 4
+# Number of chunks the async engine requests ahead of the one it is waiting for
+ASYNC_READ_AHEAD_CHUNKS = 2
+# Bounds and starting point of the number of simultaneous downloads with `--concurrency auto`
+AUTO_CONCURRENCY_MIN = 1
+AUTO_CONCURRENCY_MAX = 32
+AUTO_CONCURRENCY_START = 4
+# Seconds over which `--concurrency auto` measures throughput before reconsidering the number of downloads
+AUTO_CONCURRENCY_INTERVAL = 2.0
+# Share by which throughput must grow for another download to be worth it
+AUTO_CONCURRENCY_GAIN = 0.05
+# Factor of the best per-download latency past which downloads are considered congested,
+# and the factor the number of downloads is cut by then
+AUTO_CONCURRENCY_LATENCY = 2.0
+AUTO_CONCURRENCY_DECREASE = 0.75
+# Number of periods without a change after which one more download is tried
+AUTO_CONCURRENCY_PROBE = 5
+# Bytes `despot verify` reads from a file at once
+VERIFY_BLOCK_SIZE = 1 << 20
+# Seconds between two stack samples of `--profile`
+PROFILE_SAMPLE_INTERVAL = 0.005
+# Address `despot serve` listens on unless told otherwise
+SERVE_HOST = "127.0.0.1"
+SERVE_PORT = 7878
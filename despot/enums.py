@@ -16,3 +16,49 @@ class ItemType(str, enum.Enum):
     def human_names(cls, conn: str = "or") -> str:
         _item_type_names = [t.value for t in ItemType]
         return ", ".join(_item_type_names[:-1]) + f" {conn} {_item_type_names[-1]}"
+
+
+class ProgressMode(str, enum.Enum):
+    NONE = "none"
+    SUMMARY = "summary"
+    FULL = "full"
+
+    def __str__(self) -> str:
+        return str(self.value)
+
+
+class Engine(str, enum.Enum):
+    THREADS = "threads"
+    ASYNC = "async"
+
+    def __str__(self) -> str:
+        return str(self.value)
+
+
+class LinkMode(str, enum.Enum):
+    HARDLINK = "hardlink"
+    REFLINK = "reflink"
+    SYMLINK = "symlink"
+
+    def __str__(self) -> str:
+        return str(self.value)
+
+
+class Phase(str, enum.Enum):
+    QUEUE = "queue"
+    LOCK = "lock"
+    LOAD = "load"
+    TRANSFER = "transfer"
+    TAG = "tag"
+    FINALIZE = "finalize"
+
+    def __str__(self) -> str:
+        return str(self.value)
+
+
+class ProfileMode(str, enum.Enum):
+    SAMPLE = "sample"
+    TRACE = "trace"
+
+    def __str__(self) -> str:
+        return str(self.value)
@@ -18,3 +18,7 @@ class FilenameTemplateError(DespotException):
 
 class ContentUnavailableError(StreamError):
     default_message = "Track is not available to you"
+
+
+class StoreError(DespotException):
+    default_message = "Track is missing from the content store"
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import itertools
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, TypeVar
+
+from librespot.core import ApiClient
+from librespot.metadata import AlbumId, ArtistId, EpisodeId, PlaylistId, ShowId, TrackId
+from librespot.proto import Metadata_pb2 as Metadata
+from librespot.proto import Playlist4External_pb2 as Playlist4External
+
+from .enums import ItemType
+from .logging import logger
+
+if TYPE_CHECKING:
+    from librespot.core import Session
+
+    from .cache import MetadataCache
+
+# Items requested per window of a playlist that is too long to be listed in one response
+PLAYLIST_WINDOW = 100
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MetadataFetcher:
+    _api: ApiClient
+    _cache: MetadataCache | None
+    _executor: ThreadPoolExecutor
+    _concurrency: int
+
+    def __init__(self, session: Session, concurrency: int = 8, cache: MetadataCache | None = None) -> None:
+        self._api = session.api()
+        self._cache = cache
+        self._concurrency = max(concurrency, 1)
+        self._executor = ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix="despot-metadata")
+
+    def track(self, gid: str) -> Metadata.Track:
+        return self._cached(ItemType.TRACK, gid, Metadata.Track, lambda: self._api.get_metadata_4_track(TrackId(gid)))
+
+    def episode(self, gid: str) -> Metadata.Episode:
+        return self._cached(
+            ItemType.EPISODE, gid, Metadata.Episode, lambda: self._api.get_metadata_4_episode(EpisodeId(gid))
+        )
+
+    def album(self, gid: str) -> Metadata.Album:
+        return self._cached(ItemType.ALBUM, gid, Metadata.Album, lambda: self._api.get_metadata_4_album(AlbumId(gid)))
+
+    def albums(self, gids: Iterable[str]) -> Iterator[Metadata.Album]:
+        return self.map(self.album, gids)
+
+    def artist(self, gid: str) -> Metadata.Artist:
+        return self._cached(
+            ItemType.ARTIST, gid, Metadata.Artist, lambda: self._api.get_metadata_4_artist(ArtistId(gid))
+        )
+
+    def show(self, gid: str) -> Metadata.Show:
+        return self._cached(ItemType.SHOW, gid, Metadata.Show, lambda: self._api.get_metadata_4_show(ShowId(gid)))
+
+    def playlist(self, item_id_b62: str) -> Playlist4External.SelectedListContent:
+        """Fetch the attributes and first items of a playlist.
+
+        A cached playlist is only used while its revision is still the current
+        one, which is asked for without any items.
+        """
+        if (
+            self._cache is not None
+            and (cached := self._cache.revision(ItemType.PLAYLIST, item_id_b62)) is not None
+            and self._fetch_playlist_window(item_id_b62, 0, length=0).revision != cached
+        ):
+            logger.debug("Playlist {} changed since it was cached", item_id_b62)
+            self._cache.invalidate(ItemType.PLAYLIST, item_id_b62)
+        return self._cached(
+            ItemType.PLAYLIST,
+            item_id_b62,
+            Playlist4External.SelectedListContent,
+            lambda: self._api.get_playlist(PlaylistId(item_id_b62)),
+            revision=lambda playlist: playlist.revision,
+        )
+
+    def playlist_window(self, item_id_b62: str, start: int, revision: bytes) -> Playlist4External.SelectedListContent:
+        """Fetch the items of a playlist from position `start` on, for playlists whose first response is truncated.
+
+        Windows are cached with the `revision` of the playlist they belong to, so
+        they are fetched again once the playlist changes.
+        """
+        return self._cached(
+            ItemType.PLAYLIST,
+            f"{item_id_b62}:{start}",
+            Playlist4External.SelectedListContent,
+            lambda: self._fetch_playlist_window(item_id_b62, start),
+            revision=lambda _: revision,
+            expected_revision=revision,
+        )
+
+    def _fetch_playlist_window(
+        self, item_id_b62: str, start: int, length: int = PLAYLIST_WINDOW
+    ) -> Playlist4External.SelectedListContent:
+        response = self._api.send(
+            "GET", f"/playlist/v2/playlist/{item_id_b62}?from={start}&length={length}", None, None
+        )
+        ApiClient.StatusCodeException.check_status(response)
+        if response.content is None:
+            raise IOError(f"Empty response for playlist {item_id_b62}")
+        return Playlist4External.SelectedListContent.FromString(response.content)
+
+    def _cached(
+        self,
+        kind: ItemType,
+        key: str,
+        message_type: type[R],
+        fetch: Callable[[], R],
+        revision: Callable[[R], bytes] | None = None,
+        expected_revision: bytes | None = None,
+    ) -> R:
+        if self._cache is None:
+            return fetch()
+        if (cached := self._cache.get(kind, key, message_type, revision=expected_revision)) is not None:
+            return cached
+        message = fetch()
+        self._cache.put(kind, key, message, revision=revision(message) if revision else None)
+        return message
+
+    def map(self, fn: Callable[[T], R], items: Iterable[T]) -> Iterator[R]:
+        """Apply `fn` to `items` concurrently, yielding results in input order.
+
+        At most `concurrency` calls are in flight at any time, so results can be
+        consumed while later lookups are still running.
+        """
+        iterator = iter(items)
+        pending: deque[Future[R]] = deque(
+            self._executor.submit(fn, item) for item in itertools.islice(iterator, self._concurrency)
+        )
+        try:
+            while pending:
+                future = pending.popleft()
+                for item in itertools.islice(iterator, 1):
+                    pending.append(self._executor.submit(fn, item))
+                yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,271 @@
+from __future__ import annotations
+
+import os
+import re
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+from string import Formatter
+from threading import Lock
+from typing import Any, Iterator, Mapping
+
+from mutagen import MutagenError
+from mutagen.oggvorbis import OggVorbis
+
+from .enums import ItemType
+from .logging import logger
+from .metadata import GID_TAG
+from .templates import CONTEXT_FIELDS, FilenameTemplate, compile_templates
+
+INDEX_FILENAME = ".despot-index.sqlite3"
+
+_CONTEXT_FIELDS = tuple(field for fields in CONTEXT_FIELDS.values() for field in fields)
+
+# Nominal bitrates of the Ogg Vorbis files served for each `AudioQuality`
+_QUALITY_BY_BITRATE = {96_000: "NORMAL", 160_000: "HIGH", 320_000: "VERY_HIGH"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    gid TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    quality TEXT,
+    description TEXT,
+    sha256 TEXT,
+    PRIMARY KEY (gid, scope)
+);
+"""
+# Indexes created before checksums were recorded lack their column
+_MIGRATIONS = {"sha256": "ALTER TABLE downloads ADD COLUMN sha256 TEXT"}
+
+
+@dataclass
+class IndexEntry:
+    gid: str
+    scope: str
+    path: Path
+    size: int
+    quality: str | None = None
+    description: str | None = None
+    # Of the file as it was written, `None` if it wasn't downloaded by despot in one piece, e.g. reindexed
+    sha256: str | None = None
+
+
+def _substitute(template: str, context: Mapping[str, Any]) -> str:
+    parts = []
+    for literal, field, spec, conversion in Formatter().parse(template):
+        parts.append(literal)
+        if field is None:
+            continue
+        if field in context:
+            parts.append(format(context[field], spec or "").replace("{", "{{").replace("}", "}}"))
+        else:
+            parts.append("{" + field + ("!" + conversion if conversion else "") + (":" + spec if spec else "") + "}")
+    return "".join(parts)
+
+
+def _template_regex(template: str) -> re.Pattern[str]:
+    pattern = []
+    for literal, field, spec, _ in Formatter().parse(template):
+        pattern.append(re.escape(literal))
+        if field is None:
+            continue
+        value = r"\d+" if spec and spec.endswith("d") else r"[^/]+?"
+        pattern.append(f"(?P<{field}>{value})" if field.isidentifier() else value)
+    return re.compile("".join(pattern) + "$")
+
+
+def _template_specificity(template: str) -> int:
+    # Templates with more numeric fields are matched first, so that e.g. a
+    # playlist entry is not mistaken for a show episode.
+    return sum(1 for _, field, spec, _ in Formatter().parse(template) if field and spec and spec.endswith("d"))
+
+
+class DownloadIndex:
+    """Persistent map from track/episode GID to the file it was downloaded to.
+
+    The index lives in the destination directory and allows skipping items
+    that already exist without loading their streams first. It doubles as
+    the manifest `despot verify` checks the files against.
+    """
+
+    destination: Path
+
+    _templates: dict[ItemType, FilenameTemplate]
+    _conn: sqlite3.Connection
+    _lock: Lock
+
+    # Keeps the checksum of an entry that is recorded again without one, as long as the file didn't change
+    _INSERT = (
+        "INSERT INTO downloads (gid, scope, path, size, quality, description, sha256) VALUES (?, ?, ?, ?, ?, ?, ?)"
+        " ON CONFLICT (gid, scope) DO UPDATE SET path = excluded.path, size = excluded.size,"
+        " quality = excluded.quality, description = excluded.description,"
+        " sha256 = CASE WHEN path = excluded.path AND size = excluded.size"
+        " THEN coalesce(excluded.sha256, sha256) ELSE excluded.sha256 END"
+    )
+
+    def __init__(self, destination: Path, templates: dict[ItemType, FilenameTemplate] | None = None) -> None:
+        self.destination = destination
+        self._templates = templates or compile_templates()
+        destination.mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        self._conn = sqlite3.connect(destination / INDEX_FILENAME, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(downloads)")}
+        for column, statement in _MIGRATIONS.items():
+            if column not in columns:
+                self._conn.execute(statement)
+
+    def scope(
+        self, originating_type: ItemType, context: Mapping[str, Any] | None = None, *, idx: int | None = None
+    ) -> str:
+        """Return the key under which downloads of `originating_type` are indexed.
+
+        The scope is the filename template with the batch context (e.g. the
+        playlist name) and the position in the batch already substituted, so
+        it can be computed before any metadata is known and it changes
+        whenever the resulting path would. A track that appears twice in a
+        playlist has a scope for each of its files.
+        """
+        context = {**(context or {}), "idx": idx} if idx is not None else context or {}
+        return _substitute(self._templates[originating_type].template, context)
+
+    def lookup(self, gid: str, scope: str) -> IndexEntry | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, size, quality, description, sha256 FROM downloads WHERE gid = ? AND scope = ?",
+                (gid, scope),
+            ).fetchone()
+        if row is None:
+            return None
+        entry = IndexEntry(gid, scope, self.destination / row[0], *row[1:])
+        try:
+            if entry.path.stat().st_size == entry.size:
+                return entry
+        except FileNotFoundError:
+            pass
+        logger.debug("Index entry for {} is outdated, ignoring it", gid)
+        return None
+
+    def checksum(self, gid: str, size: int) -> str | None:
+        """Return the checksum recorded for any file of `gid` with `size` bytes, e.g. another link to the same copy."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sha256 FROM downloads WHERE gid = ? AND size = ? AND sha256 IS NOT NULL LIMIT 1", (gid, size)
+            ).fetchone()
+        return row[0] if row else None
+
+    def add(self, entry: IndexEntry) -> None:
+        row = self._to_row(entry)
+        with self._lock:
+            # The file replaced whatever was recorded for its path, e.g. after a playlist was reordered
+            self._conn.execute(
+                "DELETE FROM downloads WHERE path = ? AND NOT (gid = ? AND scope = ?)", (row[2], row[0], row[1])
+            )
+            self._conn.execute(self._INSERT, row)
+
+    def remove(self, entry: IndexEntry) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM downloads WHERE gid = ? AND scope = ?", (entry.gid, entry.scope))
+
+    def entries(self) -> list[IndexEntry]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT gid, scope, path, size, quality, description, sha256 FROM downloads ORDER BY path"
+            ).fetchall()
+        return [IndexEntry(gid, scope, self.destination / path, *rest) for gid, scope, path, *rest in rows]
+
+    def rebuild(self) -> tuple[int, list[Path]]:
+        """Replace the index with the tagged files found in the destination directory.
+
+        Checksums of files that are still where they were, with the same
+        size, are kept. Returns the number of indexed files and the files that
+        were skipped, most commonly because despot downloaded them before it
+        tagged files with their ID, which can't be recovered from the file.
+        """
+        skipped: list[Path] = []
+        rows = [self._to_row(entry) for entry in self._scan(skipped)]
+        with self._lock:
+            checksums = {
+                (path, size): sha256
+                for path, size, sha256 in self._conn.execute(
+                    "SELECT path, size, sha256 FROM downloads WHERE sha256 IS NOT NULL"
+                )
+            }
+            rows = [(*row[:-1], checksums.get((row[2], row[3]))) for row in rows]
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM downloads")
+            self._conn.executemany(self._INSERT, rows)
+            self._conn.execute("COMMIT")
+        return len(rows), skipped
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _to_row(self, entry: IndexEntry) -> tuple[str, str, str, int, str | None, str | None, str | None]:
+        return (
+            entry.gid,
+            entry.scope,
+            entry.path.relative_to(self.destination).as_posix(),
+            entry.size,
+            entry.quality,
+            entry.description,
+            entry.sha256,
+        )
+
+    def _scan(self, skipped: list[Path]) -> Iterator[IndexEntry]:
+        templates = {
+            template: _template_regex(template)
+            for template in sorted(
+                {template.template for template in self._templates.values()}, key=_template_specificity, reverse=True
+            )
+        }
+        for root, dirs, files in os.walk(self.destination):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for filename in files:
+                if filename.startswith(".") or not filename.endswith(".ogg"):
+                    continue
+                path = Path(root) / filename
+                if entry := self._entry_from_file(path, templates):
+                    yield entry
+                else:
+                    skipped.append(path)
+
+    def _entry_from_file(self, path: Path, templates: dict[str, re.Pattern[str]]) -> IndexEntry | None:
+        try:
+            obj = OggVorbis(path)
+        except MutagenError as exc:
+            logger.warning("Skipping unreadable file '{}': {}", path, exc)
+            return None
+        tags: Any = obj.tags
+        info: Any = obj.info
+        if not tags or not (gids := tags.get(GID_TAG)):
+            logger.debug("Skipping '{}', it has no {} tag", path, GID_TAG)
+            return None
+
+        relative = path.relative_to(self.destination).as_posix()
+        for template, regex in templates.items():
+            if match := regex.match(relative):
+                context: dict[str, Any] = {
+                    field: match[field] for field in _CONTEXT_FIELDS if field in regex.groupindex
+                }
+                if "idx" in regex.groupindex:
+                    context["idx"] = int(match["idx"])
+                scope = _substitute(template, context)
+                break
+        else:
+            logger.debug("Skipping '{}', its path matches none of the filename templates", path)
+            return None
+
+        return IndexEntry(
+            gid=gids[0],
+            scope=scope,
+            path=path,
+            size=path.stat().st_size,
+            quality=_QUALITY_BY_BITRATE.get(info.bitrate),
+            description=str(tags.get("TITLE", [path.stem])[0]),
+        )
@@ -9,11 +9,10 @@ from librespot.proto import Metadata_pb2 as Metadata
 from mutagen.ogg import MutagenError
 from mutagen.oggvorbis import OggVorbis
 
-from despot.exceptions import FilenameTemplateError
-
-from .enums import ItemType
 from .logging import logger
+from .templates import FilenameTemplate
 from .utils import format_artist, format_date, make_safe_filename
+from .vorbis import VorbisCommentInjector
 
 MetadataType = TypeVar("MetadataType", Metadata.Track, Metadata.Episode)
 
@@ -35,6 +34,8 @@ _PROPERTY_MAP_EPISODE: dict[str, Callable[[Metadata.Episode], str | int]] = {
     "publish_time": lambda x: format_date(x.publish_time),
 }
 
+GID_TAG = "DESPOT_GID"
+
 
 class WrappedMetadata(Generic[MetadataType]):
     _metadata: MetadataType
@@ -53,31 +54,12 @@ class WrappedMetadata(Generic[MetadataType]):
                 value = getter(self._metadata)
         return value
 
-    def _to_filename_parts(self) -> dict[str, str | int]:
-        return {key: make_safe_filename(self.get(key)) for key in self.propmap}
-
     def generate_filename(
-        self, destination: Path, originating_type: ItemType, ext: str, **filename_attrs: str | int
+        self, destination: Path, template: FilenameTemplate, ext: str, **filename_attrs: str | int
     ) -> Path:
-        match originating_type:
-            case ItemType.TRACK:
-                tmpl = "{artist} - {name}.{ext}"
-            case ItemType.SHOW | ItemType.EPISODE:
-                tmpl = "{show}/{publish_time} - {name}.{ext}"
-            case ItemType.ALBUM | ItemType.ARTIST:
-                tmpl = "{album_artist}/{album} ({album_year})/{disc:02d}-{track:02d} {name}.{ext}"
-            case ItemType.PLAYLIST:
-                tmpl = "{playlist_name}/{idx:03d} {artist_or_show} - {name}.{ext}"
-            case _:
-                raise NotImplementedError
-        try:
-            return destination / tmpl.format(
-                **self._to_filename_parts(),
-                **filename_attrs,
-                ext=ext,
-            )
-        except (ValueError, KeyError) as exc:
-            raise FilenameTemplateError(f"Invalid field '{exc.args[0]}' for {originating_type} filename") from exc
+        # Only the fields the template references are looked up
+        values = {field: make_safe_filename(self.get(field)) for field in template.fields}
+        return destination / template.format(**values, **filename_attrs, ext=ext)
 
     def _to_tags(self) -> dict[str, str | list[str]]:
         match self._metadata:
@@ -88,6 +70,7 @@ class WrappedMetadata(Generic[MetadataType]):
                     "ALBUMARTIST": [self.get("show")],
                     "ALBUM": [self.get("show")],
                     "DATE": self.get("publish_time"),
+                    GID_TAG: self._metadata.gid.hex(),
                 }
             case Metadata.Track():
                 return {
@@ -98,9 +81,17 @@ class WrappedMetadata(Generic[MetadataType]):
                     "DATE": format_date(self._metadata.album.date),
                     "TRACK": str(self.get("track")),
                     "DISCNUMBER": str(self.get("disc")),
+                    GID_TAG: self._metadata.gid.hex(),
                 }
         raise NotImplementedError
 
+    def comment_injector(
+        self, *, source_offset: int = 0, sequence_delta: int | None = None, serial: int | None = None
+    ) -> VorbisCommentInjector:
+        return VorbisCommentInjector(
+            self._to_tags(), source_offset=source_offset, sequence_delta=sequence_delta, serial=serial
+        )
+
     def write_tags(self, filename: Path) -> None:
         obj = OggVorbis(filename)
         obj.update(self._to_tags())
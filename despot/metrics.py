@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import json
+import os
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from threading import Lock
+from time import perf_counter, time
+from typing import TYPE_CHECKING, Any, Iterator
+
+from .enums import Phase
+
+if TYPE_CHECKING:
+    from .models import ProcessingResult
+
+# Percentiles reported for every phase
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+@dataclass
+class TrackTimings:
+    """Where the time of a single download went.
+
+    Phases are measured exclusively: a phase measured while another one is
+    running (e.g. tagging during the transfer) is not counted twice.
+    """
+
+    submitted: float = field(default_factory=perf_counter)
+    phases: dict[Phase, float] = field(default_factory=dict)
+    bytes: int = 0
+    retries: int = 0
+
+    _nested: float = field(default=0.0, init=False, repr=False)
+
+    def add(self, phase: Phase, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def measure(self, phase: Phase) -> Iterator[None]:
+        start = perf_counter()
+        outer, self._nested = self._nested, 0.0
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            self.add(phase, elapsed - self._nested)
+            self._nested = outer + elapsed
+
+    def queued(self) -> None:
+        """Record the time since submission as waiting in the queue."""
+        self.add(Phase.QUEUE, perf_counter() - self.submitted)
+
+
+def _percentile(values: list[float], share: float) -> float:
+    # Nearest rank of the sorted `values`
+    return values[min(int(share * len(values)), len(values) - 1)]
+
+
+class RunMetrics:
+    """Aggregates the results of a run for the JSON summary and the Prometheus textfile."""
+
+    started: float
+    successes: int = 0
+    retries: int = 0
+    bytes: int = 0
+
+    _lock: Lock
+    _start: float
+    _end: float | None = None
+    _failures: Counter[str]
+    _phases: defaultdict[Phase, list[float]]
+
+    def __init__(self) -> None:
+        self.started = time()
+        self._start = perf_counter()
+        self._lock = Lock()
+        self._failures = Counter()
+        self._phases = defaultdict(list)
+
+    def add(self, result: ProcessingResult) -> None:
+        timings = result.timings
+        with self._lock:
+            if result.exception is not None:
+                self._failures[type(result.exception).__name__] += 1
+            elif not result.interrupted:
+                self.successes += 1
+            self.retries += timings.retries
+            self.bytes += timings.bytes
+            for phase, seconds in timings.phases.items():
+                self._phases[phase].append(seconds)
+
+    def add_failure(self, exc: BaseException) -> None:
+        with self._lock:
+            self._failures[type(exc).__name__] += 1
+
+    def stop(self) -> None:
+        self._end = perf_counter()
+
+    @property
+    def duration(self) -> float:
+        return (self._end or perf_counter()) - self._start
+
+    def summary(self) -> dict[str, Any]:
+        with self._lock:
+            phases = {phase: sorted(values) for phase, values in self._phases.items()}
+            failures = dict(self._failures)
+        duration = self.duration
+        return {
+            "started": datetime.fromtimestamp(self.started, tz=timezone.utc).isoformat(),
+            "duration_seconds": duration,
+            "tracks": {"succeeded": self.successes, "failed": sum(failures.values())},
+            "failures": failures,
+            "retries": self.retries,
+            "bytes": self.bytes,
+            "bytes_per_second": self.bytes / duration if duration else 0.0,
+            "phases": {
+                str(phase): {
+                    "count": len(values),
+                    "sum": sum(values),
+                    **{f"p{round(q * 100)}": _percentile(values, q) for q in QUANTILES},
+                    "max": values[-1],
+                }
+                for phase, values in phases.items()
+            },
+        }
+
+    def write_json(self, path: Path) -> None:
+        _write_atomic(path, json.dumps(self.summary(), indent=2) + "\n")
+
+    def write_textfile(self, path: Path) -> None:
+        """Write the summary in the Prometheus text format, e.g. for node_exporter's textfile collector."""
+        summary = self.summary()
+        phases: list[tuple[str, float]] = []
+        for phase, stats in summary["phases"].items():
+            phases += [(f'{{phase="{phase}",quantile="{q}"}}', stats[f"p{round(q * 100)}"]) for q in QUANTILES]
+            phases += [(f'_sum{{phase="{phase}"}}', stats["sum"]), (f'_count{{phase="{phase}"}}', stats["count"])]
+        lines = [
+            *_metric("duration_seconds", "gauge", "Wall time of the last run.", [("", summary["duration_seconds"])]),
+            *_metric("timestamp_seconds", "gauge", "Start of the last run as a Unix timestamp.", [("", self.started)]),
+            *_metric(
+                "tracks",
+                "gauge",
+                "Tracks processed in the last run, by outcome.",
+                [(f'{{outcome="{outcome}"}}', count) for outcome, count in summary["tracks"].items()],
+            ),
+            *_metric(
+                "failures",
+                "gauge",
+                "Failed tracks in the last run, by exception type.",
+                [(f'{{exception="{name}"}}', count) for name, count in summary["failures"].items()],
+            ),
+            *_metric("retries", "gauge", "Retries in the last run.", [("", summary["retries"])]),
+            *_metric("bytes", "gauge", "Bytes downloaded in the last run.", [("", summary["bytes"])]),
+            *_metric("phase_seconds", "summary", "Time spent per track in each phase.", phases),
+        ]
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+
+def _metric(name: str, kind: str, description: str, samples: list[tuple[str, float]]) -> Iterator[str]:
+    # `samples` are pairs of the sample's suffix and labels (e.g. `_sum{phase="load"}`) and its value
+    name = f"despot_last_run_{name}"
+    yield f"# HELP {name} {description}"
+    yield f"# TYPE {name} {kind}"
+    for sample, value in samples:
+        yield f"{name}{sample} {value}"
+
+
+def _write_atomic(path: Path, content: str) -> None:
+    # Readers such as the textfile collector never see a partially written file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    temp.write_text(content)
+    os.replace(temp, path)
@@ -3,13 +3,18 @@ from __future__ import annotations
 from dataclasses import dataclass, field
 from functools import cached_property
 from pathlib import Path
+from typing import Iterator
 
 from librespot.audio import PlayableContentFeeder
 from librespot.audio.decoders import AudioQuality
 from librespot.metadata import EpisodeId, TrackId
+from librespot.proto import Metadata_pb2 as Metadata
 
+from .config import Config
 from .enums import ItemType
 from .metadata import WrappedMetadata
+from .metrics import TrackTimings
+from .templates import FilenameTemplate
 from .utils import get_filename_ext
 
 
@@ -35,21 +40,45 @@ AudioQuality._missing_ = _custom_missing_
 class DownloadableTrack:
     track_id: TrackId | EpisodeId
     originating_type: ItemType
+    # 1-based position in its batch, the `idx` of its filename. Set while queueing, unless it was set before because
+    # it differs from the queueing order, e.g. for a synced playlist
+    position: int | None = None
+    # SHA-256 of the downloaded file, computed while it is written
+    sha256: str | None = None
 
     metadata: WrappedMetadata = field(init=False, repr=False)
     target_filename: Path = field(init=False, repr=False)
 
     def populate_metadata(
-        self, *, stream: PlayableContentFeeder.LoadedStream, destination: Path, **filename_attrs: str | int
+        self,
+        *,
+        stream: PlayableContentFeeder.LoadedStream,
+        destination: Path,
+        template: FilenameTemplate,
+        **filename_attrs: str | int,
     ) -> None:
-        self.metadata = WrappedMetadata(stream.track or stream.episode)
-        self.target_filename = self.metadata.generate_filename(
-            destination,
-            originating_type=self.originating_type,
+        self.populate_from_metadata(
+            stream.track or stream.episode,
+            destination=destination,
+            template=template,
             ext=get_filename_ext(stream.input_stream.codec()),
             **filename_attrs,
         )
 
+    def populate_from_metadata(
+        self,
+        metadata: Metadata.Track | Metadata.Episode,
+        *,
+        destination: Path,
+        template: FilenameTemplate,
+        ext: str,
+        **filename_attrs: str | int,
+    ) -> None:
+        self.metadata = WrappedMetadata(metadata)
+        self.target_filename = self.metadata.generate_filename(
+            destination, template=template, ext=ext, **filename_attrs
+        )
+
     @property
     def is_abstract(self) -> bool:
         return getattr(self, "metadata", None) is None
@@ -71,23 +100,22 @@ class DownloadableTrack:
         target = self.target_filename
         return target.with_stem("." + target.stem).with_suffix(".part")
 
+    @cached_property
+    def resume_filename(self) -> Path:
+        return self.temp_filename.with_suffix(".resume")
+
 
 @dataclass
 class DownloadableBatch:
     type: ItemType  # noqa: A003
-    tracks: list[DownloadableTrack]
+    # Either all tracks, or an iterator that lists them while they are queued, e.g. for long playlists
+    tracks: list[DownloadableTrack] | Iterator[DownloadableTrack]
     description: str | None
     context: dict = field(default_factory=dict)
-
-    def __add__(self, other: DownloadableBatch | list[DownloadableBatch]) -> DownloadableBatch:
-        if isinstance(other, DownloadableBatch):
-            self.tracks += other.tracks
-        elif isinstance(other, list):
-            for nested in other:
-                self.tracks += nested.tracks
-        else:
-            raise NotImplementedError
-        return self
+    # Replaces the processor's configuration for the tracks of this batch, e.g. for a job of `despot serve`
+    config: Config | None = field(default=None, repr=False)
+    # Expected number of tracks if they are listed lazily
+    size: int | None = None
 
 
 @dataclass
@@ -95,3 +123,4 @@ class ProcessingResult:
     track: DownloadableTrack
     exception: BaseException | None = None
     interrupted: bool = False
+    timings: TrackTimings = field(default_factory=TrackTimings)
@@ -1,20 +1,30 @@
 from __future__ import annotations
 
 import re
-from typing import TYPE_CHECKING, Iterator
+import threading
+from contextlib import AbstractContextManager, nullcontext, suppress
+from datetime import date
+from queue import Full, Queue
+from typing import TYPE_CHECKING, Any, Iterable, Iterator
 
-from librespot.metadata import AlbumId, ArtistId, EpisodeId, PlaylistId, ShowId, TrackId
+from librespot.metadata import EpisodeId, TrackId
 from librespot.util import Base62, bytes_to_hex
 from rich.console import Console
 
 from .constants import _fcbgvsl
 from .enums import ItemType
+from .fetcher import MetadataFetcher
 from .logging import logger
 from .models import DownloadableBatch, DownloadableTrack
 from .utils import format_artist
 
 if TYPE_CHECKING:
-    from librespot.core import ApiClient, Session
+    from librespot.core import Session
+    from librespot.proto import Metadata_pb2 as Metadata
+    from librespot.proto import Playlist4External_pb2 as Playlist4External
+
+    from .cache import MetadataCache
+    from .sync import SyncState
 
 _RE_ITEM_ID = r"/?(?P<item_id>[0-9a-zA-Z]{22})(?:\?si=.+?)?$"
 _RE_ITEM_TYPE = rf"/?(?P<item_type>{'|'.join(ItemType)})"
@@ -22,34 +32,87 @@ _RE_ITEM_TYPE = rf"/?(?P<item_type>{'|'.join(ItemType)})"
 ITEM_ID_RE = re.compile(_RE_ITEM_ID)
 ITEM_PATH_RE = re.compile(_RE_ITEM_TYPE + _RE_ITEM_ID)
 ITEM_URL_RE = re.compile(r"^(?:https?://)?open\.\w+\.com" + _RE_ITEM_TYPE + _RE_ITEM_ID)
+ITEM_URI_RE = re.compile(rf"^{_fcbgvsl}:(?P<item_type>{'|'.join(ItemType)}):(?P<item_id>[0-9a-zA-Z]{{22}})$")
+
 
+# Batches parsed ahead, followed by either `None` or the exception that ended parsing
+_BatchQueue = Queue["DownloadableBatch | BaseException | None"]
 
 _base62 = Base62.create_instance_with_inverted_character_set()
 
 
 class LinkParser:
-    _api: ApiClient
+    _fetcher: MetadataFetcher
     _console: Console
+    _sync: SyncState | None
+    # Limits for the episodes of shows
+    _since: date | None
+    _latest: int | None
 
-    def __init__(self, session: Session, console: Console | None = None) -> None:
-        self._api = session.api()
+    def __init__(
+        self,
+        session: Session,
+        console: Console | None = None,
+        concurrency: int = 8,
+        cache: MetadataCache | None = None,
+        sync: SyncState | None = None,
+        since: date | None = None,
+        latest: int | None = None,
+    ) -> None:
+        self._fetcher = MetadataFetcher(session=session, concurrency=concurrency, cache=cache)
         self._console = console or Console(quiet=True)
+        self._sync = sync
+        self._since = since
+        self._latest = latest
+
+    def shutdown(self) -> None:
+        self._fetcher.shutdown()
+
+    def parse_all(self, links: Iterable[str], lookahead: int = 2) -> Iterator[DownloadableBatch]:
+        """Parse `links` one after the other on a background thread.
+
+        Up to `lookahead` batches are parsed ahead of the consumer, so the
+        metadata of the next links is fetched while earlier ones download.
+        """
+        batches: _BatchQueue = Queue(maxsize=max(lookahead, 1))
+        stop = threading.Event()
+        threading.Thread(target=self._produce, args=(links, batches, stop), name="despot-parser", daemon=True).start()
+        try:
+            while (item := batches.get()) is not None:
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    def _produce(self, links: Iterable[str], batches: _BatchQueue, stop: threading.Event) -> None:
+        def _put(item: DownloadableBatch | BaseException | None) -> bool:
+            while not stop.is_set():
+                with suppress(Full):
+                    batches.put(item, timeout=0.5)
+                    return True
+            return False
+
+        try:
+            for link in links:
+                for batch in self.parse(uri_or_link=link):
+                    if not _put(batch):
+                        return
+        except BaseException as exc:
+            _put(exc)
+        else:
+            _put(None)
 
     def parse(self, *, uri_or_link: str, originating_type: ItemType | None = None) -> Iterator[DownloadableBatch]:
         logger.debug("Parsing link {}", uri_or_link)
-        if uri_or_link.startswith(_fcbgvsl + ":"):
-            _, item_type, item_id_b62 = uri_or_link.split(":")
-        elif (match := ITEM_URL_RE.match(uri_or_link)) or (match := ITEM_PATH_RE.match(uri_or_link)):
-            item_type, item_id_b62 = match.groups()
-        elif match := ITEM_ID_RE.match(uri_or_link):
-            item_id_b62 = match.group("item_id")
-            item_type = "track"
-        else:
+        if (split := self._split_link(uri_or_link)) is None:
             logger.error("Invalid link: {}", uri_or_link)
-            return []
+            return
+        current_type, item_id_b62 = split
 
         item_gid = self.get_hex_gid(item_id_b62)
-        current_type = ItemType(item_type)
+        # The same show or playlist has the same key however it was linked, which is what `--sync` keys it by
+        link = f"{_fcbgvsl}:{current_type}:{item_id_b62}"
         logger.debug("Resolved link to {} with GID {}", current_type, item_gid)
         match current_type:
             # Podcasts
@@ -60,7 +123,7 @@ class LinkParser:
                     description=None,
                 )
             case ItemType.SHOW:
-                yield self._parse_show(item_gid)
+                yield self._parse_show(item_gid, link=link)
             # Music
             case ItemType.TRACK:
                 yield DownloadableBatch(
@@ -73,10 +136,29 @@ class LinkParser:
             case ItemType.ARTIST:
                 yield from self._parse_artist(item_gid)
             case ItemType.PLAYLIST:
-                yield self._parse_playlist(item_id_b62)
+                yield self._parse_playlist(item_id_b62, link=link)
             case _:
                 raise NotImplementedError
 
+    @staticmethod
+    def _split_link(uri_or_link: str) -> tuple[ItemType, str] | None:
+        if uri_or_link.startswith(_fcbgvsl + ":"):
+            match = ITEM_URI_RE.match(uri_or_link)
+        else:
+            match = ITEM_URL_RE.match(uri_or_link) or ITEM_PATH_RE.match(uri_or_link)
+        if match:
+            return ItemType(match["item_type"]), match["item_id"]
+        if match := ITEM_ID_RE.match(uri_or_link):
+            return ItemType.TRACK, match["item_id"]
+        return None
+
+    def _status(self, status: str) -> AbstractContextManager[Any]:
+        # Only one live display may be active per console, so nested parses
+        # running on fetcher threads stay silent.
+        if threading.current_thread() is threading.main_thread():
+            return self._console.status(status)
+        return nullcontext()
+
     @staticmethod
     def get_hex_gid(url_id: str) -> str:
         return bytes_to_hex(_base62.decode(url_id.encode(), 16))
@@ -90,9 +172,11 @@ class LinkParser:
         return DownloadableTrack(track_id=EpisodeId(gid), originating_type=originating_type)
 
     def _parse_album(self, gid: str, originating_type: ItemType = ItemType.ALBUM) -> DownloadableBatch:
-        with self._console.status("Fetching album metadata"):
-            metadata = self._api.get_metadata_4_album(AlbumId(gid))
+        with self._status("Fetching album metadata"):
+            metadata = self._fetcher.album(gid)
+        return self._album_to_batch(metadata, originating_type=originating_type)
 
+    def _album_to_batch(self, metadata: Metadata.Album, originating_type: ItemType) -> DownloadableBatch:
         artist = format_artist(metadata.artist)
         return DownloadableBatch(
             type=ItemType.ALBUM,
@@ -104,37 +188,90 @@ class LinkParser:
             description=f"album '{metadata.name}' by {artist}",
         )
 
-    def _parse_show(self, gid: str, originating_type: ItemType = ItemType.SHOW) -> DownloadableBatch:
-        with self._console.status("Fetching show metadata"):
-            metadata = self._api.get_metadata_4_show(ShowId(gid))
+    def _parse_show(self, gid: str, link: str, originating_type: ItemType = ItemType.SHOW) -> DownloadableBatch:
+        with self._status("Fetching show metadata"):
+            metadata = self._fetcher.show(gid)
 
-        return DownloadableBatch(
-            type=ItemType.SHOW,
-            tracks=[
-                self._parse_episode(bytes_to_hex(episode.gid), originating_type=originating_type)
-                for episode in reversed(metadata.episode)
-            ],
-            description=f"episodes of {metadata.name}",
-        )
+        # Shows list their episodes newest first
+        episode_gids = [bytes_to_hex(episode.gid) for episode in metadata.episode]
+        if self._latest is not None:
+            episode_gids = episode_gids[: self._latest]
+        if self._since is not None:
+            episode_gids = list(self._published_since(episode_gids, self._since))
+        tracks = [
+            self._parse_episode(episode_gid, originating_type=originating_type)
+            for episode_gid in reversed(episode_gids)
+        ]
+        if self._sync:
+            tracks = list(self._sync_tracks(self._sync, link, tracks))
+            logger.info("Found {} new episodes of {} since the last sync", len(tracks), metadata.name)
+
+        return DownloadableBatch(type=ItemType.SHOW, tracks=tracks, description=f"episodes of {metadata.name}")
+
+    def _published_since(self, episode_gids: list[str], since: date) -> Iterator[str]:
+        # Stops at the first older episode, so only the metadata of the recent ones is fetched
+        episodes = self._fetcher.map(self._fetcher.episode, episode_gids)
+        for episode_gid, episode in zip(episode_gids, episodes, strict=True):
+            published = episode.publish_time
+            if date(published.year, published.month or 1, published.day or 1) < since:
+                return
+            yield episode_gid
 
     def _parse_artist(self, gid: str, originating_type: ItemType = ItemType.ARTIST) -> Iterator[DownloadableBatch]:
-        with self._console.status("Fetching artist metadata"):
-            metadata = self._api.get_metadata_4_artist(ArtistId(gid))
+        with self._status("Fetching artist metadata"):
+            metadata = self._fetcher.artist(gid)
 
-        for album_group in metadata.album_group:
-            for album in album_group.album:
-                yield self._parse_album(bytes_to_hex(album.gid), originating_type=originating_type)
+        album_gids = [bytes_to_hex(album.gid) for album_group in metadata.album_group for album in album_group.album]
+        for album in self._fetcher.albums(album_gids):
+            yield self._album_to_batch(album, originating_type=originating_type)
 
-    def _parse_playlist(self, gid: str, originating_type: ItemType = ItemType.PLAYLIST) -> DownloadableBatch:
-        with self._console.status("Fetching playlist metadata"):
-            metadata = self._api.get_playlist(PlaylistId(gid))
+    def _parse_playlist(
+        self, item_id_b62: str, link: str, originating_type: ItemType = ItemType.PLAYLIST
+    ) -> DownloadableBatch:
+        with self._status("Fetching playlist metadata"):
+            metadata = self._fetcher.playlist(item_id_b62)
 
-        tracks = DownloadableBatch(
+        batch = DownloadableBatch(
             type=ItemType.PLAYLIST,
             description=f"playlist {metadata.attributes.name}",
             context={"playlist_name": metadata.attributes.name},
-            tracks=[],
+            tracks=self._playlist_tracks(item_id_b62, metadata, originating_type=originating_type),
+            size=metadata.length or len(metadata.contents.items),
         )
-        for track in metadata.contents.items:
-            tracks += list(self.parse(uri_or_link=track.uri, originating_type=originating_type))
-        return tracks
+        if self._sync is None:
+            return batch
+        if self._sync.revision(link) == metadata.revision:
+            logger.info("Playlist {} is unchanged since the last sync", metadata.attributes.name)
+            batch.tracks, batch.size = [], None
+        else:
+            batch.tracks = self._sync_tracks(self._sync, link, batch.tracks, revision=metadata.revision)
+        return batch
+
+    def _playlist_tracks(
+        self, item_id_b62: str, metadata: Playlist4External.SelectedListContent, originating_type: ItemType
+    ) -> Iterator[DownloadableTrack]:
+        """Yield the tracks of a playlist in order, fetching further windows of long playlists as they are needed."""
+        contents = metadata.contents
+        while True:
+            for item in contents.items:
+                for batch in self.parse(uri_or_link=item.uri, originating_type=originating_type):
+                    yield from batch.tracks
+            if not contents.truncated or not contents.items:
+                return
+            start = contents.pos + len(contents.items)
+            logger.debug("Fetching items of playlist {} from position {}", item_id_b62, start)
+            contents = self._fetcher.playlist_window(item_id_b62, start, metadata.revision).contents
+
+    @staticmethod
+    def _sync_tracks(
+        sync: SyncState, link: str, tracks: Iterable[DownloadableTrack], revision: bytes | None = None
+    ) -> Iterator[DownloadableTrack]:
+        """Yield the tracks that weren't downloaded from `link` before, keeping their position among all of them."""
+        seen = sync.seen(link)
+        for position, track in enumerate(tracks, 1):
+            if (gid := track.track_id.hex_id()) in seen:
+                continue
+            track.position = position
+            sync.expect(link, gid)
+            yield track
+        sync.listed(link, revision)
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import json
+from dataclasses import asdict, dataclass
+from json import JSONDecodeError
+from pathlib import Path
+
+from .logging import logger
+
+
+@dataclass
+class PartialDownload:
+    """Identity and progress of an unfinished `.part` file, stored in a sidecar next to it.
+
+    `offset` is the number of bytes at the start of the `.part` file that are
+    complete. Since tags are injected while downloading, the file and the
+    stream diverge, so the matching stream position (`source_offset`, not
+    counting the `OGG_HEADER_SIZE` prefix) and the state of the comment
+    injector are kept as well.
+    """
+
+    gid: str
+    file_id: str | None
+    size: int
+    offset: int = 0
+    source_offset: int = 0
+    sequence_delta: int | None = None
+    serial: int | None = None
+
+    @classmethod
+    def load(cls, path: Path) -> PartialDownload | None:
+        try:
+            return cls(**json.loads(path.read_text()))
+        except FileNotFoundError:
+            return None
+        except (JSONDecodeError, TypeError) as exc:
+            logger.debug("Ignoring unreadable resume file '{}': {}", path, exc)
+            return None
+
+    def save(self, path: Path) -> None:
+        path.write_text(json.dumps(asdict(self)))
+
+    def matches(self, other: PartialDownload) -> bool:
+        return (self.gid, self.file_id, self.size) == (other.gid, other.file_id, other.size)
+
+    def can_resume(self, part_size: int) -> bool:
+        return self.offset > 0 and self.sequence_delta is not None and part_size >= self.offset
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import cProfile
+import pstats
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from types import FrameType
+from typing import Any, Iterator
+
+from rich.console import Console
+from rich.table import Table
+
+from .constants import PROFILE_SAMPLE_INTERVAL
+from .enums import ProfileMode
+from .logging import logger
+
+# Parts of the pipeline that samples and profiled calls are attributed to, as
+# (source file, function names). A sample belongs to the first phase that
+# has a frame anywhere on its stack, so e.g. chunk reads while loading a
+# stream count as loading.
+_PHASES = {
+    "tagging": (("despot/vorbis.py", ("feed", "flush")), ("despot/metadata.py", ("write_tags",)), ("mutagen/", ())),
+    "stream loading": (("despot/resolver.py", ("resolve",)),),
+    "chunk reads": (
+        ("librespot/audio/__init__.py", ("read", "check_availability")),
+        ("despot/aio.py", ("_read_chunk",)),
+    ),
+    "writing": (("despot/batch.py", ("_write_from_stream",)), ("despot/aio.py", ("_write_from_stream_async",))),
+    "finalizing": (("despot/batch.py", ("_finalize",)),),
+    "parsing": (("despot/parser.py", ("parse",)), ("despot/fetcher.py", ())),
+}
+# Files whose frames at the top of an unattributed stack mean the thread is idle
+_IDLE_FILES = ("threading.py", "queue.py", "selectors.py", "concurrent/futures/thread.py")
+
+
+def _matches(filename: str, function: str, rule: tuple[str, tuple[str, ...]]) -> bool:
+    path, functions = rule
+    return path in filename.replace("\\", "/") and (not functions or function in functions)
+
+
+def _phase_of(stack: list[tuple[str, str]]) -> str:
+    for phase, rules in _PHASES.items():
+        if any(_matches(filename, function, rule) for filename, function in stack for rule in rules):
+            return phase
+    if stack and stack[-1][0].replace("\\", "/").endswith(_IDLE_FILES):
+        return "idle"
+    return "other"
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads at a fixed interval.
+
+    The result is written in the collapsed stack format understood by
+    flamegraph.pl, speedscope and others, one line per distinct stack with
+    the phase and thread name as the outermost frames.
+    """
+
+    phases: Counter[str]
+
+    _stacks: Counter[str]
+    _stop: threading.Event
+    _thread: threading.Thread
+
+    def __init__(self) -> None:
+        self.phases = Counter()
+        self._stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="despot-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self, path: Path) -> None:
+        self._stop.set()
+        self._thread.join()
+        path.write_text("".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common()))
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(PROFILE_SAMPLE_INTERVAL):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self._sample(names.get(ident, str(ident)), frame)
+
+    def _sample(self, thread_name: str, frame: FrameType | None) -> None:
+        stack = []
+        while frame is not None:
+            stack.append((frame.f_code.co_filename, frame.f_code.co_name))
+            frame = frame.f_back
+        stack.reverse()
+        phase = _phase_of(stack)
+        self.phases[phase] += 1
+        frames = ";".join(f"{function} ({Path(filename).name})" for filename, function in stack)
+        self._stacks[f"[{phase}];{thread_name};{frames}"] += 1
+
+
+class TracingProfiler:
+    """Runs cProfile on every thread and merges the results into one pstats file."""
+
+    phases: Counter[str]
+
+    _profiles: list[cProfile.Profile]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self.phases = Counter()
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        if sys.version_info < (3, 12):
+            # Threads started from now on enable their own profiler on their first call
+            threading.setprofile(self._profile_thread)
+        # From Python 3.12, cProfile is built on sys.monitoring, which already covers every thread
+        self._profile_thread()
+
+    def stop(self, path: Path) -> None:
+        threading.setprofile(None)  # type: ignore[arg-type]
+        with self._lock:
+            profiles, self._profiles = self._profiles, []
+        for profile in profiles:
+            profile.disable()
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(path)
+        for (filename, _, function), (_, _, _, cumulative, _) in stats.stats.items():  # type: ignore[attr-defined]
+            for phase, rules in _PHASES.items():
+                if any(rule[1] and _matches(filename, function, rule) for rule in rules):
+                    self.phases[phase] += cumulative
+
+    def _profile_thread(self, *_: Any) -> None:
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        profile.enable()
+
+
+@contextmanager
+def profiling(path: Path | None, mode: ProfileMode, console: Console) -> Iterator[None]:
+    """Profile all threads of the enclosed code and write the results to `path`."""
+    if path is None:
+        yield
+        return
+
+    profiler = SamplingProfiler() if mode == ProfileMode.SAMPLE else TracingProfiler()
+    logger.debug("Starting {} profiler", mode)
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop(path)
+        unit = "Samples" if mode == ProfileMode.SAMPLE else "Cumulative seconds"
+        table = Table("Phase", unit, title="Profile", box=None)
+        for phase, value in profiler.phases.most_common():
+            table.add_row(phase, f"{value:.2f}" if isinstance(value, float) else str(value))
+        console.print(table)
+        console.print(f"Wrote profile to {path}")
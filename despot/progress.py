@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import itertools
+from threading import Lock
+from time import monotonic
+from types import TracebackType
+from typing import Any
+
+from rich import progress
+from rich.console import Console
+from rich.progress import Progress, TaskID
+
+from .constants import PROGRESS_INTERVAL
+from .enums import ProgressMode
+from .logging import logger
+
+RICH_PROGRESS_COLUMNS = (
+    progress.SpinnerColumn(finished_text="[bar.finished]✔️"),
+    progress.TextColumn("[bar.complete]{task.fields[batch_idx]}/{task.fields[batch_size]}", justify="right"),
+    progress.TextColumn("[progress.description]{task.description}"),
+    progress.BarColumn(bar_width=25),
+    progress.TaskProgressColumn(),
+    progress.TimeRemainingColumn(),
+    progress.DownloadColumn(),
+    progress.TransferSpeedColumn(),
+)
+
+
+class BatchProgress:
+    """Progress display of a single batch.
+
+    Byte counts reported through `advance()` are coalesced and only passed on
+    to rich every `PROGRESS_INTERVAL` seconds. In `SUMMARY` mode finished
+    tasks are removed and counted in a single aggregate row instead, and in
+    `NONE` mode rich is not used at all and failures are logged.
+
+    A single instance may cover several batches, see `extend()`.
+    """
+
+    mode: ProgressMode
+
+    _console: Console
+    _progress: Progress | None = None
+    _summary: TaskID | None = None
+    _lock: Lock
+    _task_ids: itertools.count
+    _pending: dict[TaskID, int]
+    _reported_at: dict[TaskID, float]
+    _finished: int = 0
+    _finished_bytes: int = 0
+    _queued: int = 0
+
+    def __init__(self, mode: ProgressMode, console: Console, disable: bool = False) -> None:
+        self.mode = mode
+        self._console = console
+        self._lock = Lock()
+        self._task_ids = itertools.count()
+        self._pending = {}
+        self._reported_at = {}
+        if mode == ProgressMode.NONE:
+            return
+        self._progress = Progress(*RICH_PROGRESS_COLUMNS, console=console, disable=disable, transient=False)
+        self._progress.live.vertical_overflow = "visible"
+        if mode == ProgressMode.SUMMARY:
+            self._summary = self._progress.add_task(
+                "[bar.finished]Finished", total=0, batch_idx=0, batch_size=0, visible=False
+            )
+
+    def __enter__(self) -> BatchProgress:
+        if self._progress:
+            self._progress.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_val: BaseException | None,
+        exc_tb: TracebackType | None,
+    ) -> None:
+        self.stop()
+
+    def stop(self, hide_unfinished: bool = False) -> None:
+        if self._progress is None:
+            return
+        if hide_unfinished:
+            for task in self._progress.tasks:
+                if not task.finished:
+                    task.visible = False
+        self._progress.stop()
+
+    def extend(self, batch_size: int) -> None:
+        """Account for another `batch_size` items in the summary row."""
+        if self._summary is None or self._progress is None:
+            return
+        with self._lock:
+            self._queued += batch_size
+            self._progress.update(self._summary, batch_size=self._queued)
+
+    def print(self, *objects: Any) -> None:
+        if self._progress:
+            self._console.print(*objects)
+
+    def add_task(self, description: str, **fields: Any) -> TaskID:
+        if self._progress is None:
+            return TaskID(next(self._task_ids))
+        fields.setdefault("total", None)
+        return self._progress.add_task(description, **fields)
+
+    def update(self, task: TaskID, **fields: Any) -> None:
+        if self._progress:
+            self._progress.update(task, **fields)
+
+    def advance(self, task: TaskID, advance: int) -> None:
+        # Every task is advanced by a single worker thread only, so the
+        # bookkeeping needs no lock; rich's own lock is only taken when the
+        # coalesced bytes are passed on.
+        if self._progress is None:
+            return
+        self._pending[task] = self._pending.get(task, 0) + advance
+        now = monotonic()
+        if now - self._reported_at.get(task, 0.0) >= PROGRESS_INTERVAL:
+            self._reported_at[task] = now
+            self._progress.update(task, advance=self._pending.pop(task))
+
+    def flush(self, task: TaskID) -> None:
+        self._reported_at.pop(task, None)
+        if self._progress and (pending := self._pending.pop(task, 0)):
+            self._progress.update(task, advance=pending)
+
+    def finish(self, task: TaskID, **fields: Any) -> None:
+        self.flush(task)
+        if self._progress is None:
+            return
+        if self._summary is None:
+            self._progress.update(task, visible=True, **fields)
+            return
+        total = fields.get("total", next((t.total for t in self._progress.tasks if t.id == task), 0)) or 0
+        self._progress.remove_task(task)
+        with self._lock:
+            self._finished += 1
+            self._finished_bytes += int(total)
+            self._progress.update(
+                self._summary,
+                batch_idx=self._finished,
+                total=self._finished_bytes,
+                completed=self._finished_bytes,
+                visible=True,
+            )
+
+    def fail(self, task: TaskID, exc: Exception, name: str) -> None:
+        self.flush(task)
+        if self._progress is None:
+            logger.warning("Failed to download {}: {}", name, exc)
+            return
+        self._progress.update(task, description=f"[red]<{exc}>", visible=True)
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial, wraps
+from http import HTTPStatus
+from threading import Event, Lock, local
+from typing import Any
+
+from librespot.audio import AudioKeyManager, CdnFeedHelper, PlayableContentFeeder
+from librespot.audio.decoders import VorbisOnlyAudioQuality
+from librespot.core import ApiClient, Session
+from librespot.metadata import EpisodeId, TrackId
+
+from .chunks import ChunkTracker
+from .enums import Phase
+from .exceptions import ContentUnavailableError, StreamError
+from .fetcher import MetadataFetcher
+from .logging import logger
+from .metrics import TrackTimings
+from .retry import RetryPolicy
+
+_audio_key_lock = Lock()
+# Timings of the track each resolver thread is working on, to attribute waiting for the key lock
+_resolving = local()
+
+
+def _serialize_audio_keys(audio_key_manager: AudioKeyManager) -> None:
+    # librespot's AudioKeyManager.SyncCallback keeps its response queue on the
+    # class, so concurrent key requests can receive each other's keys. Metadata
+    # lookups, storage resolution and CDN requests are plain HTTP calls and are
+    # safe to run in parallel, so only the key exchange itself is serialized.
+    if getattr(audio_key_manager, "_despot_serialized", False):
+        return
+    get_audio_key = audio_key_manager.get_audio_key
+
+    @wraps(get_audio_key)
+    def _get_audio_key(*args: Any, **kwargs: Any) -> bytes:
+        timings: TrackTimings | None = getattr(_resolving, "timings", None)
+        with timings.measure(Phase.LOCK) if timings else nullcontext():
+            _audio_key_lock.acquire()
+        try:
+            return get_audio_key(*args, **kwargs)
+        finally:
+            _audio_key_lock.release()
+
+    audio_key_manager.get_audio_key = _get_audio_key
+    audio_key_manager._despot_serialized = True
+
+
+class StreamResolver:
+    _session: Session
+    _executor: ThreadPoolExecutor
+    _content_feeder: PlayableContentFeeder
+    _quality_picker: VorbisOnlyAudioQuality
+    _fetcher: MetadataFetcher
+    _retry: RetryPolicy
+    # Ends the backoff of pending retries on shutdown
+    _closed: Event
+
+    def __init__(
+        self,
+        session: Session,
+        quality_picker: VorbisOnlyAudioQuality,
+        workers: int = 1,
+        fetcher: MetadataFetcher | None = None,
+        retry: RetryPolicy | None = None,
+    ) -> None:
+        _serialize_audio_keys(session.audio_key())
+        self._session = session
+        self._executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="despot-resolver")
+        self._content_feeder = session.content_feeder()
+        self._quality_picker = quality_picker
+        self._fetcher = fetcher or MetadataFetcher(session=session)
+        self._retry = retry or RetryPolicy()
+        self._closed = Event()
+
+    def submit(
+        self, track_id: TrackId | EpisodeId, timings: TrackTimings | None = None
+    ) -> Future[PlayableContentFeeder.LoadedStream]:
+        return self._executor.submit(self.resolve, track_id, timings=timings)
+
+    def shutdown(self) -> None:
+        self._closed.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def resolve(
+        self, track_id: TrackId | EpisodeId, timings: TrackTimings | None = None
+    ) -> PlayableContentFeeder.LoadedStream:
+        logger.debug("Resolving stream for {}", track_id.hex_id())
+        timings = timings or TrackTimings()
+        _resolving.timings = timings
+        try:
+            with timings.measure(Phase.LOAD):
+                return self._resolve(track_id, timings=timings)
+        finally:
+            _resolving.timings = None
+
+    def _resolve(self, track_id: TrackId | EpisodeId, *, timings: TrackTimings) -> PlayableContentFeeder.LoadedStream:
+        # Transient failures are retried with backoff, which never happens under the audio key lock
+        try:
+            stream = self._retry.call(
+                partial(self._load, track_id),
+                description=f"loading the stream of {track_id.hex_id()}",
+                timings=timings,
+                stop=self._closed,
+            )
+        except StreamError:
+            raise
+        except Exception as exc:
+            if isinstance(exc, ApiClient.StatusCodeException) and exc.code == HTTPStatus.UNAVAILABLE_FOR_LEGAL_REASONS:
+                raise ContentUnavailableError from exc
+            raise StreamError from exc
+        if not stream:
+            raise StreamError
+        # Before anything requests its chunks, so that every failed request is noticed
+        ChunkTracker.of(stream.input_stream)
+        return stream
+
+    def _load(self, track_id: TrackId | EpisodeId) -> PlayableContentFeeder.LoadedStream:
+        # Mirrors PlayableContentFeeder.load(), but takes the metadata from the
+        # (possibly cached) fetcher instead of always requesting it again.
+        if isinstance(track_id, TrackId):
+            track = self._content_feeder.pick_alternative_if_necessary(self._fetcher.track(track_id.hex_id()))
+            if track is None:
+                raise StreamError("Cannot get alternative track")
+            return self._content_feeder.load_track(track, self._quality_picker, False, None)
+
+        episode = self._fetcher.episode(track_id.hex_id())
+        if episode.external_url:
+            return CdnFeedHelper.load_episode_external(self._session, episode, None)
+        if (file := self._quality_picker.get_file(episode.audio)) is None:
+            raise StreamError("Couldn't find any suitable audio file")
+        return self._content_feeder.load_stream(file, None, episode, False, None)
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import asyncio
+import random
+from dataclasses import dataclass
+from http import HTTPStatus
+from threading import Event
+from time import sleep
+from typing import Awaitable, Callable, TypeVar
+
+from librespot.core import ApiClient
+
+from .exceptions import ContentUnavailableError, StreamError
+from .logging import logger
+from .metrics import TrackTimings
+
+T = TypeVar("T")
+
+# HTTP statuses after which the same request may well succeed
+TRANSIENT_STATUSES = frozenset(
+    (
+        HTTPStatus.REQUEST_TIMEOUT,
+        HTTPStatus.TOO_MANY_REQUESTS,
+        HTTPStatus.INTERNAL_SERVER_ERROR,
+        HTTPStatus.BAD_GATEWAY,
+        HTTPStatus.SERVICE_UNAVAILABLE,
+        HTTPStatus.GATEWAY_TIMEOUT,
+    )
+)
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Whether retrying the call that raised `exc` may succeed."""
+    if isinstance(exc, ContentUnavailableError):
+        return False
+    if isinstance(exc, ApiClient.StatusCodeException):
+        return exc.code in TRANSIENT_STATUSES
+    if isinstance(exc, StreamError):
+        return exc.__cause__ is not None and is_transient(exc.__cause__)
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    # Network errors of librespot and requests are `IOError`s without an errno, unlike those of local files.
+    # librespot passes the HTTP status of failed CDN requests as their only argument.
+    if isinstance(exc, OSError) and exc.errno is None:
+        status = exc.args[0] if exc.args else None
+        return not isinstance(status, int) or status in TRANSIENT_STATUSES
+    return False
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """How often and how patiently transient failures are retried.
+
+    The delay before each retry grows exponentially from `base_delay` up to
+    `max_delay`, and a random share of it is used ("full jitter"), so that
+    downloads that failed together don't retry in lockstep. Permanent errors,
+    e.g. for content that isn't available, are raised right away.
+    """
+
+    retries: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 10.0
+
+    def delay(self, retry: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**retry))
+
+    def call(
+        self,
+        fn: Callable[[], T],
+        *,
+        description: str,
+        timings: TrackTimings | None = None,
+        stop: Event | None = None,
+    ) -> T:
+        """Call `fn` until it succeeds, raising the last error once retrying is pointless.
+
+        Waiting for the next attempt ends early once `stop` is set. Callers
+        must not hold any shared lock, the wait blocks the calling thread.
+        """
+        retry = 0
+        while True:
+            try:
+                return fn()
+            except Exception as exc:
+                if (delay := self._next_delay(exc, retry, description=description, timings=timings)) is None:
+                    raise
+                if stop is None:
+                    sleep(delay)
+                elif stop.wait(delay):
+                    raise
+            retry += 1
+
+    async def call_async(
+        self, fn: Callable[[], Awaitable[T]], *, description: str, timings: TrackTimings | None = None
+    ) -> T:
+        """Like `call()`, but for coroutines, waiting on the event loop."""
+        retry = 0
+        while True:
+            try:
+                return await fn()
+            except Exception as exc:
+                if (delay := self._next_delay(exc, retry, description=description, timings=timings)) is None:
+                    raise
+                await asyncio.sleep(delay)
+            retry += 1
+
+    def _next_delay(
+        self, exc: Exception, retry: int, *, description: str, timings: TrackTimings | None
+    ) -> float | None:
+        if retry >= self.retries or not is_transient(exc):
+            return None
+        delay = self.delay(retry)
+        logger.debug("Retrying {} in {:.2f}s after {!r}", description, delay, exc)
+        if timings:
+            timings.retries += 1
+        return delay
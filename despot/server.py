@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+import json
+import threading
+from dataclasses import dataclass, field, replace
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from pathlib import Path
+from queue import SimpleQueue
+from socketserver import ThreadingMixIn, UnixStreamServer
+from typing import Any, Iterable, Iterator
+
+import rich_click as click
+
+from .base import Despot
+from .config import Config
+from .enums import ProgressMode
+from .logging import logger
+from .models import DownloadableBatch, DownloadableTrack, ProcessingResult
+from .parser import LinkParser
+
+# Options a job may set for its own downloads, everything else is fixed when the server starts
+JOB_OPTIONS = ("overwrite", "dry_run", "newest_first")
+
+_Event = dict[str, Any]
+
+
+@dataclass
+class Job:
+    """Links submitted together, and the events of their downloads."""
+
+    id: str  # noqa: A003
+    links: list[str]
+    config: Config
+    # Events for the client, followed by `None` once the job is done
+    events: SimpleQueue[_Event | None] = field(default_factory=SimpleQueue, repr=False)
+    # Held until the job is done, which keeps their id() from being reused by other tracks meanwhile
+    tracks: list[DownloadableTrack] = field(default_factory=list, repr=False)
+    succeeded: int = 0
+    failed: int = 0
+    parsed: bool = False
+
+    @property
+    def done(self) -> bool:
+        return self.parsed and self.succeeded + self.failed == len(self.tracks)
+
+    def iter_events(self) -> Iterator[_Event]:
+        while (event := self.events.get()) is not None:
+            yield event
+
+    def status(self) -> _Event:
+        return {
+            "links": len(self.links),
+            "tracks": len(self.tracks),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "parsed": self.parsed,
+        }
+
+
+class DespotServer(Despot):
+    """Keeps one session and one batch processor alive and downloads the links of submitted jobs.
+
+    All jobs go through a single run of the processor, so they share its
+    window and workers: the tracks of a job are queued behind the ones
+    submitted before it, and the workers stay busy across job boundaries.
+    Results are routed back to their job as soon as each download completes.
+    """
+
+    _jobs: SimpleQueue[Job | None]
+    _active: dict[str, Job]
+    # Jobs by the id() of the tracks they are waiting for, which the jobs keep alive
+    _tracks: dict[int, Job]
+    _lock: threading.Lock
+    _ids: Iterator[int]
+    _scheduler: threading.Thread
+
+    def __init__(self, config: Config, ctx: click.RichContext | None = None) -> None:
+        # Results are streamed to the clients instead
+        config = replace(config, progress=ProgressMode.NONE, ordered=False, fail_early=False)
+        super().__init__(config, ctx=ctx)
+        self._jobs = SimpleQueue()
+        self._active = {}
+        self._tracks = {}
+        self._lock = threading.Lock()
+        self._ids = count(1)
+        self._batch_processor.on_result = self._on_result
+        self._scheduler = threading.Thread(target=self._schedule, name="despot-scheduler", daemon=True)
+
+    def close(self) -> None:
+        self._jobs.put(None)
+        super().close()
+
+    def submit(self, links: list[str], options: dict[str, Any] | None = None) -> Job:
+        """Queue a job for `links`, raises `ValueError` for invalid links or options."""
+        options = options or {}
+        if not isinstance(links, list) or not links or not all(isinstance(link, str) for link in links):
+            raise ValueError("Pass a non-empty list of links.")
+        if invalid := [link for link in links if LinkParser._split_link(link) is None]:
+            raise ValueError(f"Invalid links: {', '.join(invalid)}")
+        if not isinstance(options, dict) or set(options) - set(JOB_OPTIONS):
+            raise ValueError(f"Jobs only support the options {', '.join(JOB_OPTIONS)}.")
+        if not all(isinstance(value, bool) for value in options.values()):
+            raise ValueError("Job options must be booleans.")
+        if not self._scheduler.is_alive():
+            raise RuntimeError("The scheduler is not running.")
+
+        job = Job(id=str(next(self._ids)), links=links, config=replace(self.config, **options))
+        with self._lock:
+            self._active[job.id] = job
+        self._jobs.put(job)
+        logger.info("Queued job {} with {} link{}", job.id, len(links), "s" if len(links) != 1 else "")
+        return job
+
+    def status(self) -> _Event:
+        with self._lock:
+            jobs = {job.id: job.status() for job in self._active.values()}
+        return {"running": self._scheduler.is_alive(), "jobs": jobs, "metrics": self.metrics.summary()}
+
+    def serve(self, *, host: str, port: int, unix_socket: Path | None = None) -> None:
+        """Accept jobs over HTTP on `host`:`port`, or on a UNIX socket if `unix_socket` is set."""
+        httpd: _HTTPServer | _UnixHTTPServer
+        if unix_socket:
+            unix_socket.unlink(missing_ok=True)
+            httpd = _UnixHTTPServer(str(unix_socket), _RequestHandler)
+            address = str(unix_socket)
+        else:
+            httpd = _HTTPServer((host, port), _RequestHandler)
+            address = f"http://{host}:{httpd.server_port}"
+        httpd.despot = self
+        self._scheduler.start()
+        self.console.print(f"[bar.finished]Listening on {address}")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Shutting down")
+        finally:
+            httpd.server_close()
+            if unix_socket:
+                unix_socket.unlink(missing_ok=True)
+
+    def _schedule(self) -> None:
+        try:
+            for _ in self._batch_processor.process_many(self._batches()):
+                pass  # Results reach their jobs through `_on_result` as soon as they complete
+        except Exception as exc:
+            logger.opt(exception=exc).error("Scheduler failed, no more jobs will be processed")
+
+    def _batches(self) -> Iterator[DownloadableBatch]:
+        # Blocks between jobs, which keeps the processor's run going for the lifetime of the server
+        while (job := self._jobs.get()) is not None:
+            logger.debug("Starting job {}", job.id)
+            try:
+                for batch in self._link_parser.parse_all(job.links):
+                    batch.config = job.config
+                    tracks = self._register(job, batch.tracks)
+                    # Lazily listed tracks are registered as the processor queues them
+                    batch.tracks = list(tracks) if isinstance(batch.tracks, list) else tracks
+                    yield batch
+            except Exception as exc:
+                logger.opt(exception=exc).debug("Failed to parse the links of job {}", job.id)
+                job.events.put({"event": "error", "job": job.id, "error": str(exc) or type(exc).__name__})
+            with self._lock:
+                job.parsed = True
+                self._finish_if_done(job)
+
+    def _register(self, job: Job, tracks: Iterable[DownloadableTrack]) -> Iterator[DownloadableTrack]:
+        for track in tracks:
+            with self._lock:
+                job.tracks.append(track)
+                self._tracks[id(track)] = job
+            yield track
+
+    def _on_result(self, result: ProcessingResult) -> None:
+        with self._lock:
+            if (job := self._tracks.get(id(result.track))) is None:
+                return
+            self._record_sync(result, job.config)
+            if result.exception is None and not result.interrupted:
+                job.succeeded += 1
+            else:
+                job.failed += 1
+            job.events.put(_result_event(job, result))
+            self._finish_if_done(job)
+
+    def _finish_if_done(self, job: Job) -> None:
+        if not job.done:
+            return
+        for track in job.tracks:
+            self._tracks.pop(id(track), None)
+        del self._active[job.id]
+        logger.info("Finished job {}: {} succeeded, {} failed", job.id, job.succeeded, job.failed)
+        job.events.put({"event": "done", "job": job.id, "succeeded": job.succeeded, "failed": job.failed})
+        job.events.put(None)
+
+
+def _result_event(job: Job, result: ProcessingResult) -> _Event:
+    track = result.track
+    event: _Event = {
+        "event": "result",
+        "job": job.id,
+        "track": track.track_id.hex_id(),
+        "type": str(track.originating_type),
+        "status": "interrupted" if result.interrupted else "succeeded" if result.exception is None else "failed",
+    }
+    if not track.is_abstract:
+        event["name"] = track.metadata.get("name")
+        event["path"] = str(track.target_filename)
+    if result.exception is not None:
+        event["error"] = str(result.exception) or type(result.exception).__name__
+    event["timings"] = {str(phase): seconds for phase, seconds in result.timings.phases.items()}
+    return event
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """`POST /jobs` queues a job and streams its events as JSON lines, `GET /status` reports the server's state."""
+
+    server: _HTTPServer | _UnixHTTPServer
+
+    def do_GET(self) -> None:
+        if self.path != "/status":
+            return self._send_json(HTTPStatus.NOT_FOUND, {"error": f"Unknown path {self.path}"})
+        self._send_json(HTTPStatus.OK, self.server.despot.status())
+
+    def do_POST(self) -> None:
+        if self.path != "/jobs":
+            return self._send_json(HTTPStatus.NOT_FOUND, {"error": f"Unknown path {self.path}"})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            job = self.server.despot.submit(body["links"], body.get("options"))
+        except (ValueError, KeyError, TypeError) as exc:
+            return self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(exc)})
+        except RuntimeError as exc:
+            return self._send_json(HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(exc)})
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        self._write_line({"event": "queued", "job": job.id})
+        try:
+            for event in job.iter_events():
+                self._write_line(event)
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info("Client of job {} disconnected, the job keeps running", job.id)
+
+    def _send_json(self, status: HTTPStatus, content: _Event) -> None:
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_line(self, event: _Event) -> None:
+        self.wfile.write(json.dumps(event).encode() + b"\n")
+        self.wfile.flush()
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        # The default implementation writes to stderr and fails for UNIX sockets, whose clients have no address
+        logger.debug("HTTP: {}", format % args)
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    despot: DespotServer
+
+
+class _UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+    despot: DespotServer
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import os
+import shutil
+from pathlib import Path
+
+from .enums import LinkMode
+from .logging import logger
+
+# ioctl request that clones a file's extents on Linux (Btrfs, XFS, ...)
+_FICLONE = 0x40049409
+
+
+class ContentStore:
+    """One copy of each downloaded track, keyed by GID and quality.
+
+    Files in the store are never exposed directly. Every originating-type
+    path (album, playlist, ...) is created as a link to them, so a track that
+    appears in several places is only downloaded and stored once.
+    """
+
+    root: Path
+    link_mode: LinkMode
+
+    def __init__(self, root: Path, link_mode: LinkMode = LinkMode.HARDLINK) -> None:
+        self.root = root
+        self.link_mode = link_mode
+
+    def path(self, gid: str, quality: str, ext: str = "ogg") -> Path:
+        return self.root / gid[:2] / f"{gid}-{quality.lower()}.{ext}"
+
+    def get(self, gid: str, quality: str) -> Path | None:
+        directory = self.root / gid[:2]
+        return next(directory.glob(f"{gid}-{quality.lower()}.*"), None) if directory.is_dir() else None
+
+    def add(self, source: Path, gid: str, quality: str, ext: str = "ogg") -> Path:
+        """Move `source` into the store and return its new path."""
+        stored = self.path(gid, quality, ext=ext)
+        stored.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(source, stored)
+        return stored
+
+    def remove(self, gid: str, quality: str) -> None:
+        if (stored := self.get(gid, quality)) is not None:
+            stored.unlink()
+
+    def link(self, stored: Path, target: Path) -> None:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Link to a temporary name first, so an existing target is replaced atomically.
+        temp = target.with_name(f".{target.name}.link")
+        temp.unlink(missing_ok=True)
+        logger.debug("Linking {} to {} ({})", target, stored, self.link_mode)
+        match self.link_mode:
+            case LinkMode.SYMLINK:
+                temp.symlink_to(os.path.relpath(stored, target.parent))
+            case LinkMode.HARDLINK:
+                try:
+                    os.link(stored, temp)
+                except OSError as exc:
+                    logger.debug("Hardlink failed ({}), copying instead", exc)
+                    shutil.copy2(stored, temp)
+            case LinkMode.REFLINK:
+                _reflink_or_copy(stored, temp)
+        os.replace(temp, target)
+
+
+def _reflink_or_copy(source: Path, target: Path) -> None:
+    try:
+        import fcntl
+
+        with source.open("rb") as src, target.open("wb") as dst:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        shutil.copystat(source, target)
+    except (ImportError, OSError) as exc:
+        logger.debug("Reflink failed ({}), copying instead", exc)
+        shutil.copy2(source, target)
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from time import time
+
+from .logging import logger
+from .models import ProcessingResult
+
+SYNC_FILENAME = "sync.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS links (
+    link TEXT PRIMARY KEY,
+    revision BLOB,
+    synced_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    link TEXT NOT NULL,
+    gid TEXT NOT NULL,
+    published TEXT,
+    PRIMARY KEY (link, gid)
+);
+"""
+
+
+class SyncState:
+    """What `--sync` has downloaded from each show and playlist, so later runs only queue new items.
+
+    An item is recorded once its download succeeded. The revision of a
+    playlist is recorded once every item listed for it was downloaded, and an
+    unchanged playlist is skipped on later runs without listing its items.
+    """
+
+    path: Path
+
+    _conn: sqlite3.Connection
+    _lock: Lock
+    # GIDs that were queued but haven't completed yet, by link
+    _pending: dict[str, set[str]]
+    # Links waiting for their queued items, by GID
+    _links: dict[str, set[str]]
+    # Revisions to record once all items of the link are done, `None` for shows
+    _revisions: dict[str, bytes | None]
+    _failed: set[str]
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        self._pending = {}
+        self._links = {}
+        self._revisions = {}
+        self._failed = set()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def revision(self, link: str) -> bytes | None:
+        """Return the revision of `link` whose items were all downloaded by an earlier sync."""
+        with self._lock:
+            row = self._conn.execute("SELECT revision FROM links WHERE link = ?", (link,)).fetchone()
+        return row[0] if row else None
+
+    def seen(self, link: str) -> set[str]:
+        """Return the GIDs that were already downloaded from `link`."""
+        with self._lock:
+            return {gid for (gid,) in self._conn.execute("SELECT gid FROM items WHERE link = ?", (link,))}
+
+    def expect(self, link: str, gid: str) -> None:
+        """Note that `gid` was queued for `link`."""
+        with self._lock:
+            self._pending.setdefault(link, set()).add(gid)
+            self._links.setdefault(gid, set()).add(link)
+
+    def listed(self, link: str, revision: bytes | None = None) -> None:
+        """Note that all new items of `link` at `revision` were queued."""
+        with self._lock:
+            self._revisions[link] = revision
+            self._finish_if_done(link)
+
+    def record(self, result: ProcessingResult) -> None:
+        """Record a completed download for the links that are waiting for it."""
+        gid = result.track.track_id.hex_id()
+        succeeded = result.exception is None and not result.interrupted
+        published = None if result.track.is_abstract else result.track.metadata.get("publish_time") or None
+        with self._lock:
+            for link in self._links.pop(gid, ()):
+                self._pending[link].discard(gid)
+                if succeeded:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO items (link, gid, published) VALUES (?, ?, ?)", (link, gid, published)
+                    )
+                else:
+                    self._failed.add(link)
+                self._finish_if_done(link)
+
+    def forget(self, gid: str) -> None:
+        """Forget that `gid` was downloaded, so the next sync of the links it came from queues it again."""
+        with self._lock:
+            self._conn.execute("DELETE FROM links WHERE link IN (SELECT link FROM items WHERE gid = ?)", (gid,))
+            self._conn.execute("DELETE FROM items WHERE gid = ?", (gid,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _finish_if_done(self, link: str) -> None:
+        if link not in self._revisions or self._pending.get(link):
+            return
+        revision = self._revisions.pop(link)
+        self._pending.pop(link, None)
+        if link in self._failed:
+            self._failed.discard(link)
+            logger.debug("Not recording {} as synced, some of its items failed", link)
+            return
+        self._conn.execute(
+            "INSERT OR REPLACE INTO links (link, revision, synced_at) VALUES (?, ?, ?)", (link, revision, time())
+        )
+        logger.debug("Recorded {} as synced", link)
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+from string import Formatter
+from typing import Mapping
+
+from .enums import ItemType
+from .exceptions import FilenameTemplateError
+
+# Fields filled from the metadata of tracks and episodes
+TRACK_FIELDS = ("name", "artist", "artist_or_show", "album", "album_artist", "album_year", "disc", "track")
+EPISODE_FIELDS = ("name", "show", "artist_or_show", "publish_time")
+# Filename fields that are filled from the batch context rather than the track metadata
+CONTEXT_FIELDS: dict[ItemType, tuple[str, ...]] = {ItemType.PLAYLIST: ("playlist_name",)}
+# Fields that are available for every item, the position in its batch and the file extension
+_COMMON_FIELDS = ("idx", "ext")
+_INT_FIELDS = frozenset(("album_year", "disc", "track", "idx"))
+
+DEFAULT_TEMPLATES: dict[ItemType, str] = {
+    ItemType.TRACK: "{artist} - {name}.{ext}",
+    ItemType.SHOW: "{show}/{publish_time} - {name}.{ext}",
+    ItemType.EPISODE: "{show}/{publish_time} - {name}.{ext}",
+    ItemType.ALBUM: "{album_artist}/{album} ({album_year})/{disc:02d}-{track:02d} {name}.{ext}",
+    ItemType.ARTIST: "{album_artist}/{album} ({album_year})/{disc:02d}-{track:02d} {name}.{ext}",
+    ItemType.PLAYLIST: "{playlist_name}/{idx:03d} {artist_or_show} - {name}.{ext}",
+}
+# Types that use the template given for another one unless they have their own
+_FALLBACKS = {ItemType.ARTIST: ItemType.ALBUM, ItemType.SHOW: ItemType.EPISODE}
+
+
+def _metadata_fields(originating_type: ItemType) -> tuple[str, ...]:
+    if originating_type in (ItemType.SHOW, ItemType.EPISODE):
+        return EPISODE_FIELDS
+    if originating_type == ItemType.PLAYLIST:
+        # Playlists may contain both
+        return TRACK_FIELDS + tuple(field for field in EPISODE_FIELDS if field not in TRACK_FIELDS)
+    return TRACK_FIELDS
+
+
+class FilenameTemplate:
+    """A filename template for one originating type, parsed and validated once.
+
+    `fields` are the metadata fields the template references, so only those
+    have to be looked up for each track.
+    """
+
+    template: str
+    originating_type: ItemType
+    fields: tuple[str, ...]
+
+    def __init__(self, template: str, originating_type: ItemType) -> None:
+        self.template = template
+        self.originating_type = originating_type
+        metadata_fields = _metadata_fields(originating_type)
+        available = (*metadata_fields, *CONTEXT_FIELDS.get(originating_type, ()), *_COMMON_FIELDS)
+        try:
+            referenced = [(field, spec) for _, field, spec, _ in Formatter().parse(template) if field is not None]
+        except ValueError as exc:
+            raise FilenameTemplateError(f"Invalid {originating_type} filename template: {exc}") from exc
+        for field, spec in referenced:
+            if field not in available:
+                raise FilenameTemplateError(
+                    f"Invalid field '{field}' for {originating_type} filename, use {', '.join(available)}"
+                )
+            if "{" in (spec or ""):
+                raise FilenameTemplateError(f"Nested fields are not supported in {originating_type} filenames")
+        if "ext" not in (field for field, _ in referenced):
+            raise FilenameTemplateError(f"The {originating_type} filename template must contain '{{ext}}'")
+        if template.startswith("/") or ".." in template.split("/"):
+            raise FilenameTemplateError(f"The {originating_type} filename must be relative to the destination")
+        self.fields = tuple(dict.fromkeys(field for field, _ in referenced if field in metadata_fields))
+        # Catches format specs that don't fit the field, e.g. `{name:03d}`
+        self.format(**{field: 1 if field in _INT_FIELDS else "-" for field in available})
+
+    def __str__(self) -> str:
+        return self.template
+
+    def __repr__(self) -> str:
+        return f"FilenameTemplate({self.template!r}, {self.originating_type!r})"
+
+    def format(self, **values: str | int) -> str:  # noqa: A003
+        try:
+            return self.template.format_map(values)
+        except KeyError as exc:
+            raise FilenameTemplateError(f"Invalid field '{exc.args[0]}' for {self.originating_type} filename") from exc
+        except (ValueError, TypeError) as exc:
+            raise FilenameTemplateError(f"Invalid {self.originating_type} filename template: {exc}") from exc
+
+
+def compile_templates(overrides: Mapping[ItemType, str] | None = None) -> dict[ItemType, FilenameTemplate]:
+    """Compile the filename templates of all types, with `overrides` replacing the defaults."""
+    overrides = overrides or {}
+    templates = {}
+    for item_type, default in DEFAULT_TEMPLATES.items():
+        template = overrides.get(item_type) or overrides.get(_FALLBACKS.get(item_type, item_type)) or default
+        templates[item_type] = FilenameTemplate(template, item_type)
+    return templates
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import re
 from datetime import datetime, timezone
-from typing import TYPE_CHECKING, TypeVar
+from typing import TYPE_CHECKING, Iterable, Iterator, TypeVar
 
 from librespot.audio import SuperAudioFormat
 
@@ -50,3 +50,10 @@ def format_date(value: Metadata.Date) -> str:
         value.minute or 0,
         tzinfo=timezone.utc,
     ).strftime(DATETIME_FORMAT)
+
+
+def read_links(lines: Iterable[str]) -> Iterator[str]:
+    """Yield the links in `lines`, one per line, skipping blank lines and lines starting with `#`."""
+    for line in lines:
+        if (link := line.strip()) and not link.startswith("#"):
+            yield link
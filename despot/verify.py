@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import hashlib
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator
+
+from mutagen._util import cdata
+
+from .constants import VERIFY_BLOCK_SIZE
+from .index import IndexEntry
+
+_OGG_CAPTURE = b"OggS"
+_OGG_HEADER_SIZE = 27
+# Offset of the checksum in the page header
+_OGG_CRC_OFFSET = 22
+_OGG_END_OF_STREAM = 0x04
+
+
+def _page_checksum(page: bytes | bytearray) -> bytes:
+    # Ogg's CRC is zlib's with the bits of every byte reversed, as computed by mutagen
+    data = page[:_OGG_CRC_OFFSET] + bytes(4) + page[_OGG_CRC_OFFSET + 4 :]
+    crc = ~zlib.crc32(data.translate(cdata.bitswap), -1) & 0xFFFFFFFF
+    return struct.pack(">I", crc).translate(cdata.bitswap)
+
+
+class OggPageChecker:
+    """Checks the framing and checksums of the Ogg pages of a file that is fed in pieces."""
+
+    pages: int = 0
+
+    _buffer: bytearray
+    # Offset of the buffer in the file
+    _offset: int = 0
+    _flags: int = 0
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> str | None:
+        """Return what is wrong with the pages completed by `data`, if anything."""
+        buffer = self._buffer
+        buffer += data
+        start = 0
+        try:
+            while len(buffer) - start >= _OGG_HEADER_SIZE:
+                if buffer[start : start + 4] != _OGG_CAPTURE:
+                    return f"no Ogg page at byte {self._offset + start}"
+                header_size = _OGG_HEADER_SIZE + buffer[start + 26]
+                if len(buffer) - start < header_size:
+                    break
+                page_size = header_size + sum(buffer[start + _OGG_HEADER_SIZE : start + header_size])
+                if len(buffer) - start < page_size:
+                    break
+                page = buffer[start : start + page_size]
+                if _page_checksum(page) != page[_OGG_CRC_OFFSET : _OGG_CRC_OFFSET + 4]:
+                    return f"corrupted Ogg page at byte {self._offset + start}"
+                self._flags = page[5]
+                self.pages += 1
+                start += page_size
+        finally:
+            del buffer[:start]
+            self._offset += start
+        return None
+
+    def finish(self) -> str | None:
+        """Return what is wrong with the end of the file, if anything."""
+        if self._buffer:
+            return f"truncated Ogg page at byte {self._offset}"
+        if not self.pages:
+            return "no Ogg pages"
+        if not self._flags & _OGG_END_OF_STREAM:
+            return "truncated, the Ogg stream doesn't end"
+        return None
+
+
+def check_file(path: Path, size: int, sha256: str | None = None) -> str | None:
+    """Return what is wrong with the file at `path`, or `None` if it is intact.
+
+    The file is read once, for both its Ogg page checksums and its SHA-256.
+    """
+    try:
+        actual = path.stat().st_size
+    except FileNotFoundError:
+        return "missing"
+    if actual < size:
+        return f"truncated, {actual} of {size} bytes"
+    if actual > size:
+        return f"{actual - size} bytes larger than downloaded"
+    digest = hashlib.sha256()
+    pages = OggPageChecker()
+    with path.open("rb", buffering=0) as fp:
+        while data := fp.read(VERIFY_BLOCK_SIZE):
+            digest.update(data)
+            if problem := pages.feed(data):
+                return problem
+    if problem := pages.finish():
+        return problem
+    if sha256 is not None and digest.hexdigest() != sha256:
+        return "corrupted, its checksum doesn't match"
+    return None
+
+
+def verify(entries: list[IndexEntry], workers: int | None = None) -> Iterator[tuple[IndexEntry, str | None]]:
+    """Check the files of `entries` on a pool of processes, yielding each with its problem, if any.
+
+    Reading is spread over processes rather than threads, so that checking
+    a large library uses every core.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        problems = pool.map(
+            check_file,
+            [entry.path for entry in entries],
+            [entry.size for entry in entries],
+            [entry.sha256 for entry in entries],
+        )
+        yield from zip(entries, problems, strict=True)
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+from io import BytesIO
+from typing import Mapping
+
+from mutagen._vorbis import VCommentDict
+from mutagen.ogg import OggPage
+
+from .logging import logger
+
+_OGG_CAPTURE = b"OggS"
+_OGG_HEADER_SIZE = 27
+_COMMENT_PREFIX = b"\x03vorbis"
+
+
+class VorbisCommentInjector:
+    """Replaces the Vorbis comment header of an Ogg stream while it passes through.
+
+    Feed the stream in arbitrary pieces to `feed()` and write whatever it
+    returns. Only complete pages are returned, so `source_offset` always
+    points at the page boundary in the input that corresponds to the end of
+    the output produced so far. If the rewritten comment needs a different
+    number of pages, all following pages of the stream are renumbered
+    (`sequence_delta`) and get a new checksum, just like mutagen does when
+    saving in place.
+    """
+
+    source_offset: int = 0
+    sequence_delta: int | None = None
+    injected: bool = False
+
+    _tags: Mapping[str, str | list[str]]
+    _buffer: bytearray
+    _serial: int | None = None
+    _comment_pages: list[OggPage]
+
+    def __init__(
+        self,
+        tags: Mapping[str, str | list[str]],
+        *,
+        source_offset: int = 0,
+        sequence_delta: int | None = None,
+        serial: int | None = None,
+    ) -> None:
+        self._tags = tags
+        self._buffer = bytearray()
+        self._comment_pages = []
+        self.source_offset = source_offset
+        self._serial = serial
+        if sequence_delta is not None:
+            # Resuming behind already rewritten headers
+            self.sequence_delta = sequence_delta
+            self.injected = True
+
+    @property
+    def serial(self) -> int | None:
+        return self._serial
+
+    def feed(self, data: bytes | memoryview) -> bytes | bytearray:
+        self._buffer += data
+        if self.sequence_delta == 0:
+            return self._pass_through()
+        out = []
+        while (page := self._next_page()) is not None:
+            out.append(self._process(page))
+        return b"".join(out)
+
+    def flush(self) -> bytes:
+        """Return anything still held back at the end of the stream."""
+        out = b"".join(page.write() for page in self._comment_pages) + bytes(self._buffer)
+        if self._comment_pages:
+            logger.warning("Stream ended before the Vorbis comment header was complete")
+        self._comment_pages = []
+        self._buffer.clear()
+        return out
+
+    def _page_size(self, start: int) -> int | None:
+        """Size of the page at `start` of the buffer, or `None` if it is incomplete."""
+        buffer = self._buffer
+        available = len(buffer) - start
+        if available < _OGG_HEADER_SIZE:
+            return None
+        if buffer[start : start + 4] != _OGG_CAPTURE:
+            raise ValueError(f"Expected Ogg page at input offset {self.source_offset + start}")
+        segments = buffer[start + 26]
+        if available < _OGG_HEADER_SIZE + segments:
+            return None
+        table = start + _OGG_HEADER_SIZE
+        size = _OGG_HEADER_SIZE + segments + sum(buffer[table : table + segments])
+        return size if available >= size else None
+
+    def _next_page(self) -> bytes | None:
+        if (size := self._page_size(0)) is None:
+            return None
+        page = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.source_offset += size
+        return page
+
+    def _pass_through(self) -> bytearray:
+        # Nothing left to rewrite: return all complete pages at once instead of copying them one by one
+        buffer, end = self._buffer, 0
+        while (size := self._page_size(end)) is not None:
+            end += size
+        self._buffer = buffer[end:]
+        del buffer[end:]
+        self.source_offset += end
+        return buffer
+
+    def _process(self, data: bytes) -> bytes:
+        if self.sequence_delta is not None:
+            if not self.sequence_delta or int.from_bytes(data[14:18], "little") != self._serial:
+                return data
+            page = OggPage(BytesIO(data))
+            page.sequence += self.sequence_delta
+            return page.write()
+
+        page = OggPage(BytesIO(data))
+        if self._serial is None:
+            self._serial = page.serial
+        if page.serial != self._serial or not (self._comment_pages or page.packets[0].startswith(_COMMENT_PREFIX)):
+            return data
+
+        self._comment_pages.append(page)
+        if not (page.complete or len(page.packets) > 1):
+            return b""
+        return self._inject()
+
+    def _inject(self) -> bytes:
+        old_pages, self._comment_pages = self._comment_pages, []
+        packets = OggPage.to_packets(old_pages, strict=False)
+        comment = VCommentDict(packets[0][len(_COMMENT_PREFIX) :])
+        for key, value in self._tags.items():
+            comment[key] = value
+        packets[0] = _COMMENT_PREFIX + comment.write()
+
+        new_pages = OggPage.from_packets(packets, old_pages[0].sequence)
+        for page in new_pages:
+            page.serial = old_pages[0].serial
+        new_pages[0].first = old_pages[0].first
+        new_pages[0].continued = old_pages[0].continued
+        new_pages[-1].last = old_pages[-1].last
+        new_pages[-1].complete = old_pages[-1].complete
+        if not new_pages[-1].complete and len(new_pages[-1].packets) == 1:
+            new_pages[-1].position = -1
+        else:
+            new_pages[-1].position = old_pages[-1].position
+
+        self.sequence_delta = len(new_pages) - len(old_pages)
+        self.injected = True
+        logger.debug("Injected Vorbis comment, page sequence shifted by {}", self.sequence_delta)
+        return b"".join(page.write() for page in new_pages)